@@ -3,17 +3,21 @@ import subprocess
 import threading
 import time
 from server import PromptServer  # 导入 PromptServer 以确保注册时机
-from .nodes.chat import MXChatSendNode, MXChatReceiveNode
+from .nodes.chat import MXChatSendNode, MXChatReceiveNode, MXChatStreamReceiveNode
 from .nodes.image import MXChatImageReceiveNode
 from .nodes.image_send import MXChatImageSendNode
 from .nodes.table_send import MXChatTableSendNode
 from .nodes.audio_send import MXChatAudioSendNode
 from .nodes.video_send import MXChatVideoSendNode
 from .nodes.video import MXChatVideoReceiveNode
+from .nodes.audio import MXChatAudioReceiveNode
 from .websocket_handler import websocket_handler  # 确保导入 WebSocket 处理器
-from .chat_server import config_manager  # 导入配置管理器
+from .routes import register_routes
 from .logger import MXLogger
-from .folder_sync import FolderSync
+from .settings import SettingsManager
+from .retention import RetentionManager
+from .result_cache import ResultCache, cache_key_from, receive_node_ids
+from .tracing import Tracer, trace_id_from
 
 # 获取日志实例
 logger = MXLogger.get_instance()
@@ -24,6 +28,8 @@ WEB_DIRECTORY = os.path.join(os.path.dirname(os.path.realpath(__file__)), "web")
 # 服务器进程
 server_process = None
 chat_server_process = None
+folder_sync = None
+retention_manager = None
 
 def start_server(script_name, port):
     """启动服务器并检查是否成功"""
@@ -33,14 +39,14 @@ def start_server(script_name, port):
             logger.error(f"服务器脚本 {script_path} 不存在")
             return None
         process = subprocess.Popen(["python", script_path], cwd=os.path.dirname(script_path))
-        # 等待短暂时间检查进程是否存活
-        time.sleep(2)
-        if process.poll() is None:
+        # 等待短暂时间检查进程是否存活，进程提前退出时立即返回
+        try:
+            process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
             logger.info(f"成功启动服务器 {script_name} 在端口 {port}")
             return process
-        else:
-            logger.error(f"服务器 {script_name} 启动后立即退出，返回码: {process.returncode}")
-            return None
+        logger.error(f"服务器 {script_name} 启动后立即退出，返回码: {process.returncode}")
+        return None
     except Exception as e:
         logger.error(f"启动服务器 {script_name} 失败: {str(e)}")
         return None
@@ -59,56 +65,118 @@ def monitor_servers():
         
         time.sleep(5)
 
+def trace_prompt(json_data):
+    """记录带 traceId 的提示词到达服务端的时刻，衔接浏览器提交和节点执行两段"""
+    try:
+        extra_pnginfo = json_data.get("extra_data", {}).get("extra_pnginfo")
+        trace_id = trace_id_from(extra_pnginfo)
+        if trace_id:
+            Tracer.get_instance().record(trace_id, "prompt_received", time.time(), 0)
+    except Exception as e:
+        logger.error(f"记录提示词追踪失败: {str(e)}")
+    return json_data
+
+def cache_prompt(json_data):
+    """侧边栏查询缓存未命中后提交的提示词：开始按 traceId 记录各接收节点的结果"""
+    try:
+        extra_pnginfo = json_data.get("extra_data", {}).get("extra_pnginfo")
+        key = cache_key_from(extra_pnginfo)
+        prompt = json_data.get("prompt")
+        if key and isinstance(prompt, dict):
+            # 执行结束后侧边栏按 /prompt 返回的 prompt_id 调用 /mx/cache/commit，服务端从历史记录中找到这里的 traceId
+            ResultCache.get_instance().begin(trace_id_from(extra_pnginfo), key, receive_node_ids(prompt))
+    except Exception as e:
+        logger.error(f"记录结果缓存失败: {str(e)}")
+    return json_data
+
+def update_chat_config(config):
+    """模型配置变更时同步到配置管理器；chat_server 依赖 fastapi/openai，在首次变更时才导入"""
+    from .chat_server import config_manager
+    config_manager.update_config(config)
+
 def ensure_websocket_handler_registered():
     """确保 WebSocket 处理器在 PromptServer 可用时注册"""
     if PromptServer.instance is not None:
         # 确保 websocket_handler 单例已初始化并注册
         websocket_handler.register_handlers()
         # 将 config_manager 的更新函数注册为监听器
-        websocket_handler.register_config_listener(config_manager.update_config)
+        websocket_handler.register_config_listener(update_chat_config)
+        register_routes()
+        PromptServer.instance.add_on_prompt_handler(trace_prompt)
+        if ResultCache.get_instance().enabled:
+            PromptServer.instance.add_on_prompt_handler(cache_prompt)
         logger.info("WebSocket 处理器和配置监听器已注册")
     else:
         logger.warning("PromptServer.instance 尚未初始化，延迟注册 WebSocket 处理器")
         # 如果 PromptServer 未就绪，延迟重试
         threading.Timer(1.0, ensure_websocket_handler_registered).start()
 
-# 启动服务器
-server_process = start_server("server.py", 8165)
-chat_server_process = start_server("chat_server.py", 8166)
+def start_services():
+    """启动语音识别和聊天服务器、工作流同步和输出文件清理（在后台线程中运行，不阻塞 ComfyUI）"""
+    global server_process, chat_server_process, folder_sync, retention_manager
+    server_process = start_server("server.py", 8165)
+    chat_server_process = start_server("chat_server.py", 8166)
+
+    # 启动监控线程
+    threading.Thread(target=monitor_servers, name="mx-server-monitor", daemon=True).start()
+
+    # 初始化文件夹同步（watchdog 在这里才导入）
+    from .folder_sync import FolderSync
+    source_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "agentpark_workflow")
+    target_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))), "user", "default", "workflows", "agentpark_workflow")
+    folder_sync = FolderSync(source_dir, target_dir)
+    folder_sync.start_sync()
+
+    # 启动输出文件清理，仍有打开连接的会话所生成的文件不会被清理
+    retention_manager = RetentionManager.get_instance()
+    retention_manager.active_sessions = lambda: set(PromptServer.instance.sockets.keys()) if PromptServer.instance else set()
+    retention_manager.start()
 
-# 启动监控线程
-monitor_thread = threading.Thread(target=monitor_servers, daemon=True)
-monitor_thread.start()
+def schedule_services():
+    """ComfyUI 的 HTTP 服务启动时再在后台启动插件的服务；取不到 aiohttp 应用时直接在后台启动"""
+    def launch():
+        threading.Thread(target=start_services, name="mx-services", daemon=True).start()
 
-# 初始化文件夹同步
-source_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "agentpark_workflow")
-target_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))), "user", "default", "workflows", "agentpark_workflow")
-folder_sync = FolderSync(source_dir, target_dir)
-folder_sync.start_sync()
+    async def on_startup(app):
+        launch()
 
-# 在模块加载时尝试注册 WebSocket 处理器
+    app = getattr(PromptServer.instance, "app", None)
+    try:
+        app.on_startup.append(on_startup)
+    except (AttributeError, RuntimeError):
+        # 没有 aiohttp 应用，或应用已经启动、不能再注册回调
+        launch()
+
+# 在模块加载时尝试注册 WebSocket 处理器（路由必须在 ComfyUI 启动 HTTP 服务前注册）
 ensure_websocket_handler_registered()
 
+# 服务器、工作流同步和清理任务都推迟到 HTTP 服务启动时在后台进行
+schedule_services()
+
 # 导出节点
 NODE_CLASS_MAPPINGS = {
     "MXChatSend": MXChatSendNode,
     "MXChatReceive": MXChatReceiveNode,
+    "MXChatStreamReceive": MXChatStreamReceiveNode,
     "MXChatImageReceive": MXChatImageReceiveNode,
     "MXChatImageSend": MXChatImageSendNode,
     "MXChatTableSend": MXChatTableSendNode,
     "MXChatAudioSend": MXChatAudioSendNode,
     "MXChatVideoSend": MXChatVideoSendNode,
     "MXChatVideoReceive": MXChatVideoReceiveNode,
+    "MXChatAudioReceive": MXChatAudioReceiveNode,
 }
 
 # 节点显示名称映射
 NODE_DISPLAY_NAME_MAPPINGS = {
     "MXChatSend": "发送消息",
     "MXChatReceive": "接收消息",
+    "MXChatStreamReceive": "流式接收消息",
     "MXChatImageReceive": "接收图片",
     "MXChatImageSend": "发送图片",
     "MXChatTableSend": "发送表格",
     "MXChatAudioSend": "发送音频",
     "MXChatVideoSend": "发送视频",
     "MXChatVideoReceive": "接收视频",
+    "MXChatAudioReceive": "接收音频",
 }
\ No newline at end of file
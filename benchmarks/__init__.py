@@ -0,0 +1,8 @@
+"""
+Agentpark 节点的离线性能基准。
+
+不需要运行 ComfyUI：harness 提供一个轻量的 PromptServer 替身，并在不执行插件根目录
+__init__.py（不会启动 Whisper / 聊天服务器和文件夹同步）的情况下加载节点模块。
+``--import-time`` 则相反，会执行根目录 __init__.py 测量插件的导入耗时（后台服务只注册、不启动）。
+用法见 ``python -m benchmarks --help``。
+"""
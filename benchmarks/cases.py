@@ -0,0 +1,141 @@
+"""
+各节点 execute 的基准用例。
+
+每个用例函数接收一个规模参数，完成数据准备后返回被测的无参函数，
+准备阶段（生成图片、视频等）不计入测量。
+"""
+import json
+
+from . import generators
+from .harness import import_module
+
+CASES = {}
+
+
+def case(name, params, quick=None):
+    """注册用例；quick 为 --quick 模式下使用的参数（默认取最小的一个）"""
+    def decorator(func):
+        CASES[name] = {"func": func, "params": list(params), "quick": [quick if quick is not None else params[0]]}
+        return func
+    return decorator
+
+
+def _node(module, class_name):
+    return getattr(import_module(f"nodes.{module}"), class_name)()
+
+
+# 图片边长从 512px 到 4K
+IMAGE_SIDES = [512, 1024, 2048, 3840]
+# 视频帧数从 16 到 2000，分辨率固定，单独考察帧数的影响
+VIDEO_FRAMES = [16, 128, 512, 2000]
+VIDEO_SIZE = (256, 144)
+# 4K 解码单独一组，帧数固定
+VIDEO_SIDES = [480, 1280, 3840]
+AUDIO_SECONDS = [5, 60, 600]
+TABLE_ROWS = [1000, 100000, 1000000]
+
+
+@case("image_send", IMAGE_SIDES)
+def image_send(side):
+    image_data = generators.image_base64(side, side * 9 // 16)
+    node = _node("image_send", "MXChatImageSendNode")
+    return lambda: node.execute(image_data)
+
+
+@case("image_send_downscale", IMAGE_SIDES)
+def image_send_downscale(side):
+    # 手机照片通常是 JPEG；输出固定为长边 512，耗时和内存应随输出尺寸而不是原图尺寸增长
+    image_data = generators.image_base64(side, side * 9 // 16, fmt="JPEG")
+    node = _node("image_send", "MXChatImageSendNode")
+    return lambda: node.execute(image_data, max_side=512)
+
+
+@case("image_send_batch", [1, 4, 16])
+def image_send_batch(count):
+    # 同一位置上传多张不同尺寸的图片，并行解码后补边合成一个批次
+    images = [generators.image_base64(1024 + 64 * index, 576 + 32 * index, fmt="JPEG") for index in range(count)]
+    image_data = json.dumps(images)
+    node = _node("image_send", "MXChatImageSendNode")
+    return lambda: node.execute(image_data, max_side=768, batch_policy="pad")
+
+
+@case("image_receive", IMAGE_SIDES)
+def image_receive(side):
+    image = generators.image_tensor(side, side * 9 // 16)
+    node = _node("image", "MXChatImageReceiveNode")
+    return lambda: node.execute(image)
+
+
+@case("video_send_frames", VIDEO_FRAMES)
+def video_send_frames(frames):
+    video_data = generators.video_base64(frames, *VIDEO_SIZE)
+    node = _node("video_send", "MXChatVideoSendNode")
+    return lambda: node.execute(video_data)
+
+
+@case("video_send_resolution", VIDEO_SIDES)
+def video_send_resolution(side):
+    video_data = generators.video_base64(16, side, side * 9 // 16)
+    node = _node("video_send", "MXChatVideoSendNode")
+    return lambda: node.execute(video_data)
+
+
+@case("video_receive", VIDEO_FRAMES)
+def video_receive(frames):
+    video = generators.video_tensor(frames, *VIDEO_SIZE)
+    audio = generators.audio_input(frames / 30.0)
+    node = _node("video", "MXChatVideoReceiveNode")
+    return lambda: node.execute(video, audio)
+
+
+@case("audio_send", AUDIO_SECONDS)
+def audio_send(seconds):
+    audio_data = generators.audio_wav_base64(seconds)
+    node = _node("audio_send", "MXChatAudioSendNode")
+    return lambda: node.execute(audio_data)
+
+
+@case("audio_receive", AUDIO_SECONDS)
+def audio_receive(seconds):
+    audio = generators.audio_input(seconds)
+    node = _node("audio", "MXChatAudioReceiveNode")
+    return lambda: node.execute(audio)
+
+
+@case("table_send_csv", TABLE_ROWS)
+def table_send_csv(rows):
+    table_data = generators.csv_base64(rows)
+    node = _node("table_send", "MXChatTableSendNode")
+    return lambda: node.execute(table_data, "text/csv", "bench.csv")
+
+
+@case("table_send_xlsx", TABLE_ROWS[:2])
+def table_send_xlsx(rows):
+    table_data = generators.xlsx_base64(rows)
+    node = _node("table_send", "MXChatTableSendNode")
+    file_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    return lambda: node.execute(table_data, file_type, "bench.xlsx")
+
+
+@case("chat_receive", [1000, 100000, 1000000])
+def chat_receive(chars):
+    text = generators.markdown_text(chars)
+    node = _node("chat", "MXChatReceiveNode")
+    return lambda: node.execute(text)
+
+
+# 200KB 量级的大模型输出，加上 1MB 的极端情况
+MARKDOWN_CHARS = [10000, 200000, 1000000]
+
+
+def _markdown_detect_case(kind):
+    @case(f"markdown_detect_{kind}", MARKDOWN_CHARS)
+    def run(chars):
+        detect_markdown = import_module("nodes.markdown_detect").detect_markdown
+        text = generators.adversarial_text(kind, chars)
+        return lambda: detect_markdown(text)
+    return run
+
+
+for _kind in generators.ADVERSARIAL_PATTERNS:
+    _markdown_detect_case(_kind)
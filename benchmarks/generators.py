@@ -0,0 +1,133 @@
+"""基准用的合成数据：固定随机种子，同一参数每次生成相同的内容"""
+import base64
+import io
+import subprocess
+import wave
+
+import numpy as np
+
+
+def _rng():
+    return np.random.default_rng(0)
+
+
+def image_array(width, height):
+    """带渐变和噪声的 RGB 图像，压缩率接近真实照片"""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([x / max(width - 1, 1), y / max(height - 1, 1), (x + y) / max(width + height - 2, 1)], axis=-1)
+    noise = _rng().normal(0, 0.05, size=(height, width, 3)).astype(np.float32)
+    return (np.clip(base + noise, 0, 1) * 255).astype(np.uint8)
+
+
+def image_base64(width, height, fmt="PNG"):
+    """编码后的图片附件（base64），与前端上传的格式一致"""
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.fromarray(image_array(width, height)).save(buffer, format=fmt)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def image_tensor(width, height, batch=1):
+    """ComfyUI IMAGE 张量 [批次, 高, 宽, 3]"""
+    import torch
+    frame = torch.from_numpy(image_array(width, height)).float().div_(255.0)
+    return frame.unsqueeze(0).repeat(batch, 1, 1, 1)
+
+
+def video_tensor(frames, width, height):
+    """逐帧平移的视频张量 [帧数, 高, 宽, 3]，帧间有变化，编码器不会退化成静止画面"""
+    import torch
+    base = torch.from_numpy(image_array(width * 2, height)).float().div_(255.0)
+    video = torch.empty((frames, height, width, 3), dtype=torch.float32)
+    for i in range(frames):
+        offset = (i * 4) % width
+        video[i] = base[:, offset:offset + width]
+    return video
+
+
+def video_base64(frames, width, height, fps=30, with_audio=True):
+    """用 ffmpeg 生成带测试图案（和正弦音轨）的 MP4 附件"""
+    duration = frames / fps
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin",
+           "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={fps}:duration={duration}"]
+    if with_audio:
+        cmd += ["-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={duration}", "-c:a", "aac"]
+    cmd += ["-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+            "-movflags", "frag_keyframe+empty_moov", "-f", "mp4", "pipe:1"]
+    data = subprocess.run(cmd, check=True, capture_output=True).stdout
+    return base64.b64encode(data).decode("ascii")
+
+
+def audio_array(seconds, sample_rate=44100, channels=2):
+    """多个正弦叠加噪声的 float32 音频 [声道, 采样]"""
+    t = np.arange(int(seconds * sample_rate), dtype=np.float32) / sample_rate
+    tone = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.2 * np.sin(2 * np.pi * 330 * t)
+    noise = _rng().normal(0, 0.02, size=(channels, len(t))).astype(np.float32)
+    return (tone[None, :] + noise).astype(np.float32)
+
+
+def audio_wav_base64(seconds, sample_rate=44100, channels=2):
+    """16 位 PCM WAV 附件（base64）"""
+    samples = (np.clip(audio_array(seconds, sample_rate, channels), -1, 1) * 32767).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(samples.T.tobytes())
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def audio_input(seconds, sample_rate=44100, channels=2):
+    """ComfyUI AUDIO 输入 {"waveform": [1, 声道, 采样], "sample_rate": int}"""
+    import torch
+    return {"waveform": torch.from_numpy(audio_array(seconds, sample_rate, channels)).unsqueeze(0),
+            "sample_rate": sample_rate}
+
+
+def table_frame(rows, columns=12):
+    """数值、分类和文本列混合的表格"""
+    import pandas as pd
+    rng = _rng()
+    data = {}
+    for i in range(columns):
+        kind = i % 3
+        if kind == 0:
+            data[f"value_{i}"] = rng.normal(100, 15, rows).round(3)
+        elif kind == 1:
+            data[f"category_{i}"] = rng.choice(["alpha", "beta", "gamma", "delta"], rows)
+        else:
+            data[f"text_{i}"] = [f"item-{n}" for n in rng.integers(0, 10000, rows)]
+    return pd.DataFrame(data)
+
+
+def csv_base64(rows, columns=12):
+    return base64.b64encode(table_frame(rows, columns).to_csv(index=False).encode("utf-8")).decode("ascii")
+
+
+def xlsx_base64(rows, columns=12):
+    buffer = io.BytesIO()
+    table_frame(rows, columns).to_excel(buffer, index=False)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def markdown_text(chars):
+    """混合标题、列表、表格和代码块的 Markdown 文本，长度约为 chars"""
+    block = ("## 标题\n\n这是一段**加粗**和*斜体*混合的说明文字，包含[链接](https://example.com)。\n\n"
+             "| 列1 | 列2 |\n| --- | --- |\n| a | b |\n\n```python\nprint('hello')\n```\n\n")
+    return (block * (chars // len(block) + 1))[:chars]
+
+
+# 针对格式检测的恶意输入：不闭合的定界符会让回溯式正则在每个起点都扫描到文本末尾
+ADVERSARIAL_PATTERNS = {
+    "brackets": "[",
+    "stars": "*a",
+    "underscores": "_a\n",
+    "pipes": "a|",
+    "plain": "这是一段没有任何格式的普通说明文字。The quick brown fox jumps over the lazy dog.\n",
+}
+
+
+def adversarial_text(kind, chars):
+    unit = ADVERSARIAL_PATTERNS[kind]
+    return (unit * (chars // len(unit) + 1))[:chars]
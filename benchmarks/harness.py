@@ -0,0 +1,129 @@
+import importlib
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import types
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+# 加载插件时使用的包名，避免与 ComfyUI 中真实加载的插件冲突
+PACKAGE_NAME = "agentpark_bench"
+
+
+class _StubRoutes:
+    """记录注册的路由，不启动 HTTP 服务"""
+
+    def __init__(self):
+        self._items = []
+
+    def _register(self, method, path):
+        def decorator(handler):
+            self._items.append(types.SimpleNamespace(method=method, path=path, handler=handler))
+            return handler
+        return decorator
+
+    def get(self, path):
+        return self._register("GET", path)
+
+    def post(self, path):
+        return self._register("POST", path)
+
+
+class StubPromptServer:
+    """PromptServer 的最小替身：记录节点发往前端的消息，供基准统计消息大小"""
+    instance = None
+
+    def __init__(self):
+        self.client_id = "benchmark"
+        self.last_node_id = None
+        self.sockets = {}
+        self.routes = _StubRoutes()
+        self.messages = []
+        self.on_prompt_handlers = []
+        # 插件在 aiohttp 应用启动时才启动后台服务，替身不会触发这些回调
+        self.app = types.SimpleNamespace(on_startup=[])
+
+    def send_sync(self, event, data, sid=None):
+        self.messages.append((event, data, sid))
+
+    async def send_json(self, event, data, sid=None):
+        self.send_sync(event, data, sid)
+
+    def add_on_prompt_handler(self, handler):
+        self.on_prompt_handlers.append(handler)
+
+    def get_queue_info(self):
+        return {"exec_info": {"queue_remaining": 0}}
+
+    def message_bytes(self):
+        """已记录消息按 JSON 序列化后的总字节数"""
+        return sum(len(json.dumps({"type": event, "data": data}, ensure_ascii=False).encode("utf-8"))
+                   for event, data, _ in self.messages)
+
+
+def install_stubs():
+    """注册 server 模块替身；已经存在真实的 server 模块时不覆盖"""
+    if "server" not in sys.modules:
+        module = types.ModuleType("server")
+        module.PromptServer = StubPromptServer
+        sys.modules["server"] = module
+    prompt_server = sys.modules["server"].PromptServer
+    if prompt_server.instance is None:
+        prompt_server.instance = StubPromptServer()
+    return prompt_server.instance
+
+
+def load_package():
+    """
+    以独立的包名加载插件目录，但不执行根目录 __init__.py，
+    节点模块中的相对导入（..logger、..delivery 等）照常工作。
+    """
+    if PACKAGE_NAME not in sys.modules:
+        package = types.ModuleType(PACKAGE_NAME)
+        package.__path__ = [PACKAGE_ROOT]
+        sys.modules[PACKAGE_NAME] = package
+    return sys.modules[PACKAGE_NAME]
+
+
+def import_module(name):
+    """导入插件内的模块，如 import_module("nodes.image_send")"""
+    load_package()
+    return importlib.import_module(f"{PACKAGE_NAME}.{name}")
+
+
+def import_package(name=PACKAGE_NAME + "_init"):
+    """像 ComfyUI 加载自定义节点那样执行根目录 __init__.py（后台服务只注册，不会启动）"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(PACKAGE_ROOT, "__init__.py"),
+                                                  submodule_search_locations=[PACKAGE_ROOT])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def isolate_retention():
+    """把输出文件索引换成临时数据库，基准运行不写入插件的 .cache"""
+    retention = import_module("retention")
+    if retention.RetentionManager._instance is None:
+        fd, db_path = tempfile.mkstemp(prefix="mxchat_bench_", suffix=".sqlite3")
+        os.close(fd)
+        retention.RetentionManager._instance = retention.RetentionManager(db_path=db_path)
+    return retention.RetentionManager._instance
+
+
+def cleanup_outputs():
+    """删除基准运行中节点写入 output/ 并登记到索引的文件"""
+    manager = isolate_retention()
+    with manager._db_lock:
+        paths = [row[0] for row in manager._db.execute("SELECT path FROM artifacts").fetchall()]
+    for path in paths:
+        manager._remove(path)
+
+
+def setup():
+    """安装替身并加载插件，返回 PromptServer 替身实例"""
+    server = install_stubs()
+    load_package()
+    isolate_retention()
+    return server
@@ -0,0 +1,74 @@
+"""
+插件导入耗时：像 ComfyUI 加载自定义节点那样执行根目录 __init__.py，测量它对 ComfyUI 启动时间的贡献。
+
+ComfyUI 在加载自定义节点之前已经导入的模块（torch、numpy、aiohttp、PIL）先行导入，不计入插件耗时。
+子进程以 ``python -X importtime`` 运行，同时列出插件导入过程中自身耗时最多的模块。
+"""
+import importlib
+import json
+import subprocess
+import sys
+import time
+
+from . import harness
+
+# 加载自定义节点时 ComfyUI 已经导入的模块
+COMFYUI_PRELOADED = ("asyncio", "aiohttp", "numpy", "torch", "PIL.Image")
+DEFAULT_BUDGET_MS = 100.0
+_MARKER = "mx-import-profile-start"
+
+
+def run_child():
+    """在子进程中执行：预先导入 ComfyUI 已加载的模块，再计时导入插件"""
+    harness.install_stubs()
+    for name in COMFYUI_PRELOADED:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+    sys.stderr.write(_MARKER + "\n")
+    sys.stderr.flush()
+    start = time.perf_counter()
+    harness.import_package()
+    elapsed = time.perf_counter() - start
+    return {"import_ms": elapsed * 1000}
+
+
+def _parse_importtime(stderr):
+    """解析 -X importtime 的输出，只保留标记之后（即插件导入期间）的模块"""
+    modules = []
+    started = False
+    for line in stderr.splitlines():
+        if line.strip() == _MARKER:
+            started = True
+            continue
+        if not started or not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            self_us, cumulative_us = int(parts[0]), int(parts[1])
+        except (ValueError, IndexError):
+            continue
+        modules.append({"module": parts[2].strip(), "self_ms": self_us / 1000, "cumulative_ms": cumulative_us / 1000})
+    return modules
+
+
+def profile(budget_ms=DEFAULT_BUDGET_MS, top=15):
+    """运行导入耗时测量，打印结果；超出预算时返回 1"""
+    cmd = [sys.executable, "-X", "importtime", "-m", "benchmarks", "--import-child"]
+    completed = subprocess.run(cmd, cwd=harness.PACKAGE_ROOT, capture_output=True, text=True)
+    if completed.returncode != 0:
+        print("导入插件失败:")
+        print("\n".join(line for line in completed.stderr.splitlines()
+                        if not line.startswith("import time:") and line.strip() != _MARKER))
+        return 1
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    modules = _parse_importtime(completed.stderr)
+
+    print(f"{'module':<48}{'self ms':>10}{'cumul ms':>10}")
+    for entry in sorted(modules, key=lambda m: m["self_ms"], reverse=True)[:top]:
+        print(f"{entry['module'][:47]:<48}{entry['self_ms']:>10.1f}{entry['cumulative_ms']:>10.1f}")
+    import_ms = result["import_ms"]
+    within = import_ms <= budget_ms
+    print(f"插件导入耗时 {import_ms:.1f} ms（预算 {budget_ms:.0f} ms）{'' if within else '，超出预算'}")
+    return 0 if within else 1
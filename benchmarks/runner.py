@@ -0,0 +1,180 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "results")
+
+
+def _peak_rss_mb():
+    """进程的峰值常驻内存（MB），无法获取时返回 None"""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_child(name, param, rounds, warmup=1):
+    """在当前进程中运行一个用例（由父进程以子进程方式调用，保证峰值内存互不影响）"""
+    from . import harness
+    server = harness.setup()
+    from .cases import CASES
+    delivery = harness.import_module("delivery").DeliveryService.get_instance()
+
+    fn = CASES[name]["func"](param)
+    setup_rss = _peak_rss_mb()
+
+    def run_once():
+        server.messages.clear()
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        executed = time.perf_counter()
+        # 节点返回后，后台投递（编码、发送）仍在进行，单独计时
+        delivery.wait_idle()
+        delivered = time.perf_counter()
+        harness.cleanup_outputs()
+        return {"execute_s": executed - start, "delivery_s": delivered - executed,
+                "message_bytes": server.message_bytes()}
+
+    # 预热轮次触发延迟导入和缓存，不计入结果
+    for _ in range(warmup):
+        run_once()
+    timings = [run_once() for _ in range(rounds)]
+    # tracemalloc 会显著拖慢分配，单独跑一轮统计分配峰值
+    tracemalloc.start()
+    run_once()
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"case": name, "param": param, "rounds": timings, "tracemalloc_peak_mb": traced_peak / (1024 * 1024),
+            "setup_rss_mb": setup_rss, "peak_rss_mb": _peak_rss_mb()}
+
+
+def summarize(result):
+    rounds = result["rounds"]
+    execute = [r["execute_s"] for r in rounds]
+    return {
+        "case": result["case"],
+        "param": result["param"],
+        "execute_min_s": min(execute),
+        "execute_median_s": statistics.median(execute),
+        "delivery_median_s": statistics.median(r["delivery_s"] for r in rounds),
+        "tracemalloc_peak_mb": result["tracemalloc_peak_mb"],
+        "setup_rss_mb": result["setup_rss_mb"],
+        "peak_rss_mb": result["peak_rss_mb"],
+        "message_bytes": rounds[-1]["message_bytes"],
+        "rounds": rounds,
+    }
+
+
+def _run_in_subprocess(name, param, rounds, warmup):
+    cmd = [sys.executable, "-m", "benchmarks", "--child", name, str(param),
+           "--rounds", str(rounds), "--warmup", str(warmup)]
+    cwd = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    completed = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {"case": name, "param": param, "error": completed.stderr.strip().splitlines()[-1:] or ["未知错误"]}
+    return summarize(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+
+def _metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(RESULTS_DIR)).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def _format_row(entry, baseline=None):
+    if "error" in entry:
+        return f"{entry['case']:<24}{str(entry['param']):>9}  失败: {entry['error'][0]}"
+    rss = f"{entry['peak_rss_mb']:.0f}" if entry["peak_rss_mb"] is not None else "-"
+    row = (f"{entry['case']:<24}{str(entry['param']):>9}{entry['execute_median_s'] * 1000:>12.1f}"
+           f"{entry['delivery_median_s'] * 1000:>12.1f}{entry['tracemalloc_peak_mb']:>12.1f}{rss:>10}"
+           f"{entry['message_bytes']:>12}")
+    if baseline and "error" not in baseline:
+        row += f"{entry['execute_median_s'] / max(baseline['execute_median_s'], 1e-9):>9.2f}x"
+    return row
+
+
+def compare_key(entry):
+    return entry["case"], str(entry["param"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Agentpark 节点离线性能基准")
+    parser.add_argument("--filter", "-k", default="", help="只运行名称包含该字符串的用例")
+    parser.add_argument("--quick", action="store_true", help="每个用例只运行最小规模")
+    parser.add_argument("--rounds", type=int, default=3, help="每个规模重复次数")
+    parser.add_argument("--warmup", type=int, default=1, help="不计入结果的预热次数")
+    parser.add_argument("--output", help="结果 JSON 路径（默认 benchmarks/results/<时间>.json）")
+    parser.add_argument("--compare", help="与之前保存的结果 JSON 比较")
+    parser.add_argument("--list", action="store_true", help="列出所有用例")
+    parser.add_argument("--import-time", action="store_true", help="测量插件导入（ComfyUI 启动时加载本插件）的耗时")
+    parser.add_argument("--budget-ms", type=float, default=None, help="导入耗时预算（毫秒），超出时返回非零退出码")
+    parser.add_argument("--child", nargs=2, metavar=("CASE", "PARAM"), help=argparse.SUPPRESS)
+    parser.add_argument("--import-child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.import_child:
+        from .import_time import run_child as run_import_child
+        print(json.dumps(run_import_child()))
+        return 0
+    if args.import_time:
+        from .import_time import DEFAULT_BUDGET_MS, profile
+        return profile(args.budget_ms if args.budget_ms is not None else DEFAULT_BUDGET_MS)
+
+    if args.child:
+        name, param = args.child
+        print(json.dumps(run_child(name, int(param), args.rounds, args.warmup)))
+        return 0
+
+    from .cases import CASES
+    if args.list:
+        for name, spec in CASES.items():
+            print(f"{name}: {spec['params']}")
+        return 0
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = {compare_key(entry): entry for entry in json.load(f)["results"]}
+
+    print(f"{'case':<24}{'param':>9}{'exec ms':>12}{'deliver ms':>12}{'alloc MB':>12}{'RSS MB':>10}"
+          f"{'msg bytes':>12}" + (f"{'vs base':>10}" if baseline else ""))
+    results = []
+    for name, spec in CASES.items():
+        if args.filter not in name:
+            continue
+        for param in spec["quick"] if args.quick else spec["params"]:
+            entry = _run_in_subprocess(name, param, args.rounds, args.warmup)
+            results.append(entry)
+            print(_format_row(entry, baseline.get(compare_key(entry))), flush=True)
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"meta": _metadata(), "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到 {output}")
+    return 1 if any("error" in entry for entry in results) else 0
@@ -0,0 +1,253 @@
+"""
+/chat 请求的加权公平调度。
+
+每个 clientId 有自己的等待队列，按启动时间公平排队（Start-time Fair Queuing）：请求到达时根据估算的
+token 数和客户端权重计算虚拟开始/完成时间，有空闲并发名额时总是放行虚拟完成时间最小的请求。
+粘贴大表格的用户单个请求代价大、连续追问时虚拟时间累积得快，只会让自己排在后面，
+不会挡住只发短消息的用户。另有全局并发上限，以及按客户端的 token 速率预算（令牌桶，允许透支一次，
+透支后该客户端的后续请求等到预算恢复再放行）。
+"""
+import asyncio
+import heapq
+import itertools
+import re
+import time
+from collections import defaultdict
+
+try:
+    from .metrics import counter, gauge, histogram
+except ImportError:
+    from metrics import counter, gauge, histogram
+
+CHAT_QUEUE_DEPTH = gauge("mxchat_chat_queue_depth", "等待调度的 /chat 请求数")
+CHAT_ACTIVE = gauge("mxchat_chat_active", "已放行、正在请求上游的 /chat 请求数")
+CHAT_QUEUE_SECONDS = histogram("mxchat_chat_queue_seconds", "/chat 请求排队等待的时间（秒）")
+CHAT_REJECTED = counter("mxchat_chat_rejected_total", "调度器拒绝的 /chat 请求数", ("reason",))
+
+_CJK = re.compile(r'[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]')
+# 客户端状态超过该数量时清理已经空闲的条目
+_PRUNE_THRESHOLD = 1024
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中日韩字符约 1 个 token，其余字符约 4 个一个 token"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class SchedulerRejected(Exception):
+    """排队已满或等待超时，reason 用于指标标签"""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+
+
+class _TokenBucket:
+    def __init__(self, rate_per_second, capacity):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_seconds(self, now):
+        """预算恢复为正之前需要等待的秒数"""
+        self.refill(now)
+        return 0.0 if self.level > 0 else (-self.level + 1) / self.rate
+
+    def charge(self, tokens, now):
+        self.refill(now)
+        self.level -= tokens
+
+
+class Ticket:
+    __slots__ = ("client_id", "cost", "start", "finish", "prev_finish", "future", "loop", "enqueued", "granted",
+                 "cancelled", "released")
+
+    def __init__(self, client_id, cost, start, finish, loop, prev_finish=None):
+        self.client_id = client_id
+        self.cost = cost
+        self.start = start
+        self.finish = finish
+        # 入队前该客户端最后一个请求的虚拟完成时间，取消时用于回滚
+        self.prev_finish = prev_finish
+        self.loop = loop
+        self.future = loop.create_future()
+        self.enqueued = time.perf_counter()
+        self.granted = False
+        self.cancelled = False
+        self.released = False
+
+
+class FairScheduler:
+    """只在事件循环线程中修改状态；release 可以从任意线程调用"""
+
+    def __init__(self, max_concurrent=4, tokens_per_minute=0, queue_timeout=120.0, max_queued_per_client=8,
+                 completion_tokens=512, weights=None):
+        self.max_concurrent = max(1, max_concurrent)
+        self.rate = tokens_per_minute / 60.0 if tokens_per_minute > 0 else 0.0
+        self.queue_timeout = queue_timeout if queue_timeout and queue_timeout > 0 else None
+        self.max_queued_per_client = max_queued_per_client
+        self.completion_tokens = completion_tokens
+        self.weights = dict(weights or {})
+        self._heap = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish = {}
+        self._queued = defaultdict(int)
+        self._buckets = {}
+        self._active = 0
+        self._retry_handle = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            max_concurrent=settings.get("max_concurrent", 4),
+            tokens_per_minute=settings.get("tokens_per_minute", 0),
+            queue_timeout=settings.get("queue_timeout_seconds", 120),
+            max_queued_per_client=settings.get("max_queued_per_client", 8),
+            completion_tokens=settings.get("completion_tokens_estimate", 512),
+            weights=settings.get("client_weights", {}),
+        )
+
+    def estimate_cost(self, messages, text):
+        """一次请求的代价：发送给上游的全部消息（含历史）加上预估的回复长度"""
+        return (estimate_tokens(text) + sum(estimate_tokens(m.get("content", "")) for m in messages)
+                + self.completion_tokens)
+
+    async def acquire(self, client_id, cost):
+        """排队直到被放行，返回的 Ticket 用完后必须 release"""
+        if self.max_queued_per_client and self._queued[client_id] >= self.max_queued_per_client:
+            CHAT_REJECTED.labels("queue_full").inc()
+            raise SchedulerRejected("queue_full", "请求过于频繁，请等待之前的回复完成")
+
+        weight = max(float(self.weights.get(client_id, 1.0)), 1e-6)
+        prev_finish = self._last_finish.get(client_id)
+        start = max(self._virtual_time, prev_finish or 0.0)
+        ticket = Ticket(client_id, cost, start, start + cost / weight, asyncio.get_running_loop(), prev_finish)
+        self._last_finish[client_id] = ticket.finish
+        self._queued[client_id] += 1
+        heapq.heappush(self._heap, (ticket.finish, next(self._seq), ticket))
+        CHAT_QUEUE_DEPTH.inc()
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if ticket.granted:
+                # 超时或取消的同时恰好被放行，归还名额
+                self._release(ticket, 0)
+            else:
+                self._cancel(ticket)
+            if isinstance(e, asyncio.TimeoutError):
+                CHAT_REJECTED.labels("timeout").inc()
+                raise SchedulerRejected("timeout", "排队等待超时，请稍后重试")
+            raise
+        return ticket
+
+    def release(self, ticket, output_tokens=0):
+        """归还并发名额，并按实际输出长度扣除 token 预算；可重复调用，可在任意线程调用"""
+        try:
+            ticket.loop.call_soon_threadsafe(self._release, ticket, output_tokens)
+        except RuntimeError:
+            # 事件循环已关闭（服务退出中）
+            pass
+
+    def _cancel(self, ticket):
+        ticket.cancelled = True
+        self._queued[ticket.client_id] -= 1
+        CHAT_QUEUE_DEPTH.dec()
+        # 没有被放行的请求不应推迟该客户端之后的请求；之后又有请求入队时，它们的时间已经基于这一个计算，保持不变
+        if self._last_finish.get(ticket.client_id) == ticket.finish:
+            if ticket.prev_finish is None:
+                del self._last_finish[ticket.client_id]
+            else:
+                self._last_finish[ticket.client_id] = ticket.prev_finish
+
+    def _release(self, ticket, output_tokens):
+        if ticket.released or not ticket.granted:
+            return
+        ticket.released = True
+        self._active -= 1
+        CHAT_ACTIVE.dec()
+        if self.rate and output_tokens:
+            # 放行时已按预估回复长度扣除，这里只补扣超出的部分
+            extra = output_tokens - self.completion_tokens
+            if extra > 0:
+                self._bucket(ticket.client_id).charge(extra, time.monotonic())
+        self._prune()
+        self._dispatch()
+
+    def _bucket(self, client_id):
+        bucket = self._buckets.get(client_id)
+        if bucket is None:
+            # 容量为一分钟的预算，空闲的客户端可以一次性发出较大的请求
+            bucket = self._buckets[client_id] = _TokenBucket(self.rate, self.rate * 60)
+        return bucket
+
+    def _dispatch(self):
+        if self._retry_handle is not None:
+            self._retry_handle.cancel()
+            self._retry_handle = None
+        now = time.monotonic()
+        while self._active < self.max_concurrent and self._heap:
+            deferred = []
+            chosen = None
+            retry_after = None
+            while self._heap:
+                entry = heapq.heappop(self._heap)
+                ticket = entry[2]
+                if ticket.cancelled:
+                    continue
+                delay = self._bucket(ticket.client_id).wait_seconds(now) if self.rate else 0.0
+                if delay > 0:
+                    # 该客户端预算透支，暂时跳过，先服务其他客户端
+                    deferred.append(entry)
+                    retry_after = delay if retry_after is None else min(retry_after, delay)
+                    continue
+                chosen = ticket
+                break
+            for entry in deferred:
+                heapq.heappush(self._heap, entry)
+            if chosen is None:
+                if retry_after is not None:
+                    self._schedule_retry(retry_after)
+                return
+            self._grant(chosen, now)
+
+    def _grant(self, ticket, now):
+        ticket.granted = True
+        self._active += 1
+        self._queued[ticket.client_id] -= 1
+        self._virtual_time = max(self._virtual_time, ticket.start)
+        if self.rate:
+            self._bucket(ticket.client_id).charge(ticket.cost, now)
+        CHAT_QUEUE_DEPTH.dec()
+        CHAT_ACTIVE.inc()
+        CHAT_QUEUE_SECONDS.observe(time.perf_counter() - ticket.enqueued)
+        ticket.future.set_result(True)
+
+    def _schedule_retry(self, delay):
+        if self._retry_handle is None:
+            self._retry_handle = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def _prune(self):
+        """清理已经空闲的客户端状态，避免长期运行后无限增长"""
+        if len(self._last_finish) > _PRUNE_THRESHOLD:
+            for client_id in [c for c, f in self._last_finish.items()
+                              if f <= self._virtual_time and not self._queued.get(c)]:
+                self._last_finish.pop(client_id, None)
+                self._queued.pop(client_id, None)
+        if len(self._buckets) > _PRUNE_THRESHOLD:
+            now = time.monotonic()
+            for client_id, bucket in list(self._buckets.items()):
+                bucket.refill(now)
+                if bucket.level >= bucket.capacity:
+                    del self._buckets[client_id]
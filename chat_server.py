@@ -4,13 +4,29 @@ import socket
 import subprocess
 import time
 import sys
+import weakref
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 from openai import OpenAI
 from collections import defaultdict
 
+try:
+    from .chat_scheduler import FairScheduler, SchedulerRejected
+    from .metrics import CONTENT_TYPE, counter, gauge, histogram, render_latest
+    from .settings import SettingsManager
+except ImportError:
+    from chat_scheduler import FairScheduler, SchedulerRejected
+    from metrics import CONTENT_TYPE, counter, gauge, histogram, render_latest
+    from settings import SettingsManager
+
+CHAT_IN_FLIGHT = gauge("mxchat_chat_streams_in_flight", "正在进行的 /chat 流式响应数")
+CHAT_TTFT_SECONDS = histogram("mxchat_chat_ttft_seconds", "从收到请求到发出第一个数据块的耗时（秒）")
+CHAT_STREAM_SECONDS = histogram("mxchat_chat_stream_seconds", "/chat 流式响应总耗时（秒）")
+CHAT_CHUNKS = counter("mxchat_chat_chunks_total", "发送给前端的数据块数")
+CHAT_STREAMS = counter("mxchat_chat_streams_total", "/chat 流式响应数", ("status",))
+
 
 # 配置管理类
 class ConfigManager:
@@ -104,6 +120,9 @@ app.add_middleware(
 # 存储对话历史的全局变量，按 clientId 分隔
 conversation_history = defaultdict(list)
 
+# 按 clientId 加权公平地放行请求，限制同时发往上游的请求数
+scheduler = FairScheduler.from_settings(SettingsManager.get_instance().section('chat_scheduler'))
+
 class ChatRequest(BaseModel):
     text: str
     mode: str = "chat"
@@ -140,7 +159,36 @@ async def update_config(request: ConfigUpdateRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-def stream_chat_response(user_message: str, client_id: str = "default"):
+def stream_chat_response(user_message: str, client_id: str = "default", started: float = None, ticket=None):
+    """包装实际的流式生成器，记录首个数据块延迟、总耗时和并发流数量；结束时归还调度名额"""
+    started = started or time.perf_counter()
+    status = "ok"
+    first_chunk = True
+    chunks = 0
+    CHAT_IN_FLIGHT.inc()
+    try:
+        for output in _stream_chat_response(user_message, client_id):
+            chunks += 1
+            if first_chunk:
+                CHAT_TTFT_SECONDS.observe(time.perf_counter() - started)
+                first_chunk = False
+            if output.startswith('{"error"'):
+                status = "error"
+            CHAT_CHUNKS.inc()
+            yield output
+    except GeneratorExit:
+        # 客户端提前断开
+        status = "cancelled"
+        raise
+    finally:
+        CHAT_IN_FLIGHT.dec()
+        CHAT_STREAM_SECONDS.observe(time.perf_counter() - started)
+        CHAT_STREAMS.labels(status).inc()
+        if ticket is not None:
+            # 流式回复每个数据块大约是一个 token
+            scheduler.release(ticket, chunks)
+
+def _stream_chat_response(user_message: str, client_id: str = "default"):
     """使用 openai 库实现流式输出，支持推理过程"""
     global conversation_history
 
@@ -208,16 +256,27 @@ def stream_chat_response(user_message: str, client_id: str = "default"):
 
 @app.post("/chat")
 async def chat(request: ChatRequest):
+    started = time.perf_counter()
     print(f"聊天模式请求: {request.text}, clientId: {request.clientId}")
     if request.mode == "chat":
         client_id = request.clientId or "default"
-        return StreamingResponse(
-            stream_chat_response(request.text, client_id),
-            media_type="application/x-ndjson"
-        )
+        cost = scheduler.estimate_cost(conversation_history.get(client_id, []), request.text)
+        try:
+            ticket = await scheduler.acquire(client_id, cost)
+        except SchedulerRejected as e:
+            CHAT_STREAMS.labels("rejected").inc()
+            raise HTTPException(status_code=429, detail=e.message)
+        stream = stream_chat_response(request.text, client_id, started, ticket)
+        # 生成器没有开始迭代就被丢弃时（例如客户端在响应开始前断开），finally 不会执行，在回收时归还名额
+        weakref.finalize(stream, scheduler.release, ticket)
+        return StreamingResponse(stream, media_type="application/x-ndjson")
     else:
         raise HTTPException(status_code=400, detail="仅支持 chat 模式")
 
+@app.get("/metrics")
+async def metrics():
+    return Response(content=render_latest(), headers={"Content-Type": CONTENT_TYPE})
+
 def check_port_in_use(port):
     """检查指定端口是否被占用"""
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -0,0 +1,109 @@
+import collections
+import threading
+import time
+import traceback
+
+from server import PromptServer
+from .logger import MXLogger
+from .metrics import DELIVERY_DROPPED, DELIVERY_QUEUE_DEPTH, DELIVERY_SECONDS
+from .result_cache import ResultCache
+from .settings import SettingsManager
+from .tracing import Tracer, current_trace_id, use_trace
+
+logger = MXLogger.get_instance()
+
+
+class DeliveryService:
+    """
+    节点结果的后台投递：节点只提交原始张量或文件引用以及构造消息的函数，
+    PNG/base64 编码和发送在后台线程中按提交顺序完成，不再计入节点执行时间。
+    max_queue 只约束预览：队列达到上限时丢弃最旧的预览（或新提交的预览），
+    必须送达的消息总是入队，提交方（节点执行线程）从不等待。
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, max_queue=None):
+        if max_queue is None:
+            max_queue = SettingsManager.get_instance().get('delivery', 'max_queue', 64)
+        self.max_queue = max(1, max_queue)
+        self.dropped = 0
+        self._queue = collections.deque()
+        self._condition = threading.Condition()
+        self._busy = False
+        self._thread = threading.Thread(target=self._run, name='mx-delivery', daemon=True)
+        self._thread.start()
+
+    def submit(self, build, event="mx-chat-message", sid=None, preview=False, trace_id=None, record=False, files=()):
+        """
+        提交一个在后台执行的 build()，其返回值作为消息数据发送；返回 None 时不发送。
+        trace_id 默认取当前节点执行的 traceId，会写入消息的 traceId 字段，并记录从提交到发出的 span。
+        record=True 表示这是接收节点的最终结果，发出后连同引用的输出文件 files 一起交给结果缓存记录。
+        """
+        trace_id = trace_id or current_trace_id()
+        submitted = (time.time(), time.perf_counter())
+        with self._condition:
+            while len(self._queue) >= self.max_queue and self._drop_oldest_preview():
+                pass
+            if preview and len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                DELIVERY_DROPPED.inc()
+                return
+            self._queue.append((build, event, sid, preview, trace_id, submitted, record, files))
+            DELIVERY_QUEUE_DEPTH.set(len(self._queue))
+            self._condition.notify_all()
+
+    def send(self, data, event="mx-chat-message", sid=None, preview=False, trace_id=None, record=False, files=()):
+        """投递已经构造好的消息"""
+        self.submit(lambda: data, event=event, sid=sid, preview=preview, trace_id=trace_id, record=record, files=files)
+
+    def wait_idle(self, timeout=None):
+        """等待队列中的消息全部发出"""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._queue and not self._busy, timeout)
+
+    def _drop_oldest_preview(self):
+        for index, queued in enumerate(self._queue):
+            if queued[3]:
+                del self._queue[index]
+                self.dropped += 1
+                DELIVERY_DROPPED.inc()
+                return True
+        return False
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue)
+                build, event, sid, _, trace_id, submitted, record, files = self._queue.popleft()
+                DELIVERY_QUEUE_DEPTH.set(len(self._queue))
+                self._busy = True
+                self._condition.notify_all()
+            try:
+                with DELIVERY_SECONDS.time(), use_trace(trace_id):
+                    data = build()
+                    if data is not None:
+                        message = data
+                        if trace_id and isinstance(data, dict):
+                            data = dict(data, traceId=trace_id)
+                        PromptServer.instance.send_sync(event, data, sid)
+                        if record:
+                            ResultCache.get_instance().record(trace_id, event, message, files)
+                if trace_id:
+                    Tracer.get_instance().record(trace_id, "deliver", submitted[0], time.perf_counter() - submitted[1],
+                                                 event=event)
+            except Exception as e:
+                logger.error(f"[DeliveryService] 投递消息失败: {str(e)}")
+                logger.error(traceback.format_exc())
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
@@ -1,100 +1,175 @@
 import os
+import json
 import shutil
+import hashlib
 import time
 import threading
-import msvcrt
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from .logger import MXLogger
+from .media_store import MediaStore, compact_workflow_file
+from .retention import RetentionManager
+from .settings import SettingsManager
 
 logger = MXLogger.get_instance()
 
+# Linux 上 reflink（写时复制克隆）对应的 ioctl 编号
+FICLONE = 0x40049409
+# 同步清单保存在扩展目录下，避免出现在 ComfyUI 的工作流列表中
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '.cache', 'folder_sync_manifest.json')
+
+
+def _file_hash(path):
+    """计算文件内容哈希"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_ready(path):
+    """
+    判断文件是否已写完：最近一次修改足够久远，且能以只读方式打开
+    （Windows 上写入方独占文件时打开会失败，其它平台依赖修改时间判断）。
+    """
+    try:
+        if time.time() - os.stat(path).st_mtime < 0.1:
+            return False
+        with open(path, 'rb'):
+            return True
+    except PermissionError:
+        return False
+
+
+def _reflink(src, dst):
+    """尝试创建 reflink 副本，文件系统不支持时返回 False"""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+        return True
+    except OSError:
+        if os.path.exists(dst):
+            os.unlink(dst)
+        return False
+
+
 class FolderSyncHandler(FileSystemEventHandler):
-    def __init__(self, source_dir, target_dir):
-        self.source_dir = Path(source_dir)
-        self.target_dir = Path(target_dir)
+    """
+    监听源目录的文件事件：同一路径的连续事件在防抖窗口内合并为一次处理，
+    不同路径交给线程池并行同步，watchdog 线程本身不做任何阻塞操作。
+    """
+
+    def __init__(self, folder_sync, debounce_ms=500, max_workers=4, max_retries=5):
+        self.folder_sync = folder_sync
+        self.source_dir = folder_sync.source_dir
+        self.target_dir = folder_sync.target_dir
+        self.debounce = max(debounce_ms, 0) / 1000.0
+        self.max_retries = max_retries
+        self._executor = ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix='mx-folder-sync')
+        self._condition = threading.Condition()
+        self._pending = {}    # 路径 -> (到期时间, 动作, 已重试次数)
+        self._running = set()  # 正在处理的路径
+        self._stopped = False
+        self._scheduler = threading.Thread(target=self._schedule_loop, name='mx-folder-sync-debounce', daemon=True)
+        self._scheduler.start()
 
     def on_modified(self, event):
         if event.is_directory:
             return
-        self._sync_file(event.src_path)
+        self._schedule(event.src_path, 'sync')
 
     def on_created(self, event):
         if event.is_directory:
             return
-        self._sync_file(event.src_path)
+        self._schedule(event.src_path, 'sync')
+
+    def on_moved(self, event):
+        if event.is_directory:
+            return
+        self._schedule(event.src_path, 'delete')
+        self._schedule(event.dest_path, 'sync')
 
     def on_deleted(self, event):
         if event.is_directory:
             return
-        rel_path = os.path.relpath(event.src_path, str(self.source_dir))
-        target_path = self.target_dir / rel_path
-        try:
-            if target_path.exists():
-                target_path.unlink()
-                logger.info(f"已删除文件: {rel_path}")
-        except Exception as e:
-            logger.error(f"删除文件失败: {str(e)}")
+        self._schedule(event.src_path, 'delete')
 
-    def _sync_file(self, src_path):
-        max_retries = 3
-        retry_delay = 1.0  # 重试等待时间(秒)
-        
-        for attempt in range(max_retries):
-            try:
-                rel_path = os.path.relpath(src_path, str(self.source_dir))
-                target_path = self.target_dir / rel_path
-                target_path.parent.mkdir(parents=True, exist_ok=True)
-                
-                # 等待文件写入完成
-                last_size = -1
-                last_mtime = -1
-                stable_count = 0
-                while stable_count < 2:  # 连续2次检查文件大小和修改时间不变才认为写入完成
-                    try:
-                        stat = os.stat(src_path)
-                        current_size = stat.st_size
-                        current_mtime = stat.st_mtime
-                        
-                        if current_size == last_size and current_mtime == last_mtime:
-                            stable_count += 1
-                        else:
-                            stable_count = 0
-                            
-                        last_size = current_size
-                        last_mtime = current_mtime
-                        time.sleep(0.1)  # 短暂等待后再次检查
-                    except FileNotFoundError:
-                        logger.error(f"源文件不存在: {rel_path}")
-                        return
-                    except Exception as e:
-                        logger.error(f"检查文件状态失败: {str(e)}")
-                        return
-                
-                # 使用临时文件进行复制
-                temp_target = target_path.with_suffix('.tmp')
-                shutil.copy2(src_path, temp_target)
-                if target_path.exists():
-                    target_path.unlink()
-                temp_target.rename(target_path)
-                
-                logger.info(f"已同步文件: {rel_path}")
-                break  # 成功后退出重试循环
-                
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    logger.warning(f"同步文件失败，将在 {retry_delay} 秒后重试: {str(e)}")
-                    time.sleep(retry_delay)
+    def stop(self):
+        """停止调度线程并等待正在进行的同步结束"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._scheduler.join()
+        self._executor.shutdown(wait=True)
+
+    def _schedule(self, src_path, action, retries=0, delay=None):
+        # 每来一个新事件就把到期时间往后推，最后一次事件的动作生效
+        src_path = os.path.abspath(src_path)
+        deadline = time.monotonic() + (self.debounce if delay is None else delay)
+        with self._condition:
+            self._pending[src_path] = (deadline, action, retries)
+            self._condition.notify()
+
+    def _schedule_loop(self):
+        with self._condition:
+            while not self._stopped:
+                now = time.monotonic()
+                due = [path for path, (deadline, _, _) in self._pending.items()
+                       if deadline <= now and path not in self._running]
+                for path in due:
+                    _, action, retries = self._pending.pop(path)
+                    self._running.add(path)
+                    self._executor.submit(self._process, path, action, retries)
+                waiting = [deadline for path, (deadline, _, _) in self._pending.items() if path not in self._running]
+                timeout = max(min(waiting) - now, 0) if waiting else None
+                self._condition.wait(timeout)
+
+    def _process(self, src_path, action, retries):
+        rel_path = os.path.relpath(src_path, str(self.source_dir))
+        try:
+            if action == 'delete' or not os.path.exists(src_path):
+                self.folder_sync.remove_file(rel_path)
+            elif not _file_ready(src_path):
+                # 文件仍在写入，稍后重试而不是阻塞工作线程
+                if retries < self.max_retries:
+                    self._schedule(src_path, action, retries + 1, delay=max(self.debounce, 0.2) * (retries + 1))
                 else:
-                    logger.error(f"同步文件失败，已达到最大重试次数: {str(e)}")
+                    logger.error(f"同步文件失败，文件长时间处于写入状态: {rel_path}")
+                return
+            elif self.folder_sync.sync_file(Path(src_path)):
+                logger.info(f"已同步文件: {rel_path}")
+            self.folder_sync.save_manifest()
+        except Exception as e:
+            if retries < self.max_retries:
+                logger.warning(f"同步文件失败，稍后重试: {rel_path}: {str(e)}")
+                self._schedule(src_path, action, retries + 1, delay=1.0)
+            else:
+                logger.error(f"同步文件失败，已达到最大重试次数: {rel_path}: {str(e)}")
+        finally:
+            with self._condition:
+                self._running.discard(src_path)
+                self._condition.notify()
 
 
 class FolderSync:
-    def __init__(self, source_dir, target_dir):
+    def __init__(self, source_dir, target_dir, manifest_path=MANIFEST_PATH):
         self.source_dir = Path(source_dir)
         self.target_dir = Path(target_dir)
+        self.manifest_path = Path(manifest_path)
+        self.link_mode = SettingsManager.get_instance().get('folder_sync', 'link_mode', 'auto')
+        self.compact_workflows = SettingsManager.get_instance().get('folder_sync', 'compact_workflows', False)
+        self.manifest = {}
+        self._manifest_lock = threading.Lock()
         self.observer = None
+        self.event_handler = None
         self.running = False
 
     def ensure_target_dir(self):
@@ -106,8 +181,148 @@ class FolderSync:
             logger.error(f"创建目标目录失败: {str(e)}")
             return False
 
+    def load_manifest(self):
+        """读取上次同步的清单（源文件大小、修改时间、哈希以及目标文件状态）"""
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('source') == str(self.source_dir) and data.get('target') == str(self.target_dir):
+                self.manifest = data.get('files', {})
+                return
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"读取同步清单失败，将重新同步全部文件: {str(e)}")
+        self.manifest = {}
+
+    def save_manifest(self):
+        """原子地写回同步清单"""
+        with self._manifest_lock:
+            data = {"source": str(self.source_dir), "target": str(self.target_dir), "files": dict(self.manifest)}
+        try:
+            self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.manifest_path.with_suffix('.tmp')
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=1)
+            os.replace(temp_path, self.manifest_path)
+        except Exception as e:
+            logger.warning(f"保存同步清单失败: {str(e)}")
+
+    def _place_file(self, src_path, target_path):
+        """按配置使用 reflink / 硬链接 / 复制把源文件放到目标位置（先写临时文件再替换）"""
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_target = target_path.with_name(target_path.name + '.tmp')
+        if temp_target.exists():
+            temp_target.unlink()
+        placed = False
+        if self.compact_workflows and src_path.suffix.lower() == '.json':
+            # 工作流中的内联附件移入附件仓库，用户目录里只保留引用，加载和保存都更快
+            store = MediaStore.get_instance()
+            result = compact_workflow_file(src_path, temp_target, store)
+            if result is not None:
+                replaced, refs = result
+                placed = replaced > 0
+                # 用户目录中的工作流引用这些附件，固定后不会被输出文件清理删除
+                for ref in refs:
+                    RetentionManager.get_instance().register(store.path_for(ref), "media", pinned=True)
+        if not placed and self.link_mode == 'hardlink':
+            # 硬链接与源文件共享数据，用户在 ComfyUI 中修改目标工作流会同时改动源文件
+            try:
+                os.link(src_path, temp_target)
+                placed = True
+            except OSError:
+                placed = False
+        elif not placed and self.link_mode == 'auto':
+            placed = _reflink(src_path, temp_target)
+        if not placed:
+            shutil.copy2(src_path, temp_target)
+        os.replace(temp_target, target_path)
+
+    @staticmethod
+    def _target_modified(target_path, target_stat, entry):
+        """目标文件在上次同步后是否被用户修改：大小和修改时间都没变视为未修改，变化时再比较内容哈希"""
+        if target_stat.st_size == entry['target_size'] and target_stat.st_mtime_ns == entry['target_mtime_ns']:
+            return False
+        target_hash = entry.get('target_hash')
+        return target_hash is None or _file_hash(target_path) != target_hash
+
+    def sync_file(self, src_path):
+        """同步单个文件，返回是否实际写入了目标文件"""
+        rel_path = src_path.relative_to(self.source_dir).as_posix()
+        target_path = self.target_dir / rel_path
+        src_stat = src_path.stat()
+        with self._manifest_lock:
+            entry = self.manifest.get(rel_path)
+        try:
+            target_stat = target_path.stat()
+        except FileNotFoundError:
+            target_stat = None
+
+        target_intact = (
+            entry is not None and target_stat is not None
+            and target_stat.st_size == entry['target_size']
+            and target_stat.st_mtime_ns == entry['target_mtime_ns']
+        )
+        if target_intact and src_stat.st_size == entry['size'] and src_stat.st_mtime_ns == entry['mtime_ns']:
+            return False
+
+        # 大小或修改时间变化时再比较内容哈希，仅被 touch 过的文件不会重新复制
+        digest = _file_hash(src_path)
+        if not target_intact and entry is not None and target_stat is not None:
+            if self._target_modified(target_path, target_stat, entry):
+                # 用户在 ComfyUI 中修改过目标文件：新版本写到旁边的副本，不覆盖用户的修改
+                conflict_path = target_path.with_name(f"{target_path.stem}.agentpark{target_path.suffix}")
+                self._place_file(src_path, conflict_path)
+                logger.warning(f"目标文件已被修改，新版本写入 {conflict_path.name}: {rel_path}")
+                with self._manifest_lock:
+                    # 目标文件状态保持上次写入时的记录，之后仍能识别出用户的修改
+                    self.manifest[rel_path] = dict(entry, size=src_stat.st_size, mtime_ns=src_stat.st_mtime_ns,
+                                                   hash=digest)
+                return True
+            # 只是被 touch 过，内容与上次写入的一致
+            target_intact = True
+
+        if not (target_intact and digest == entry['hash']):
+            self._place_file(src_path, target_path)
+            target_stat = target_path.stat()
+            target_hash = _file_hash(target_path)
+            copied = True
+        else:
+            target_hash = entry.get('target_hash') or _file_hash(target_path)
+            copied = False
+
+        with self._manifest_lock:
+            self.manifest[rel_path] = {
+                "size": src_stat.st_size,
+                "mtime_ns": src_stat.st_mtime_ns,
+                "hash": digest,
+                "target_size": target_stat.st_size,
+                "target_mtime_ns": target_stat.st_mtime_ns,
+                "target_hash": target_hash,
+            }
+        return copied
+
+    def remove_file(self, rel_path):
+        """源文件被删除时移除对应的目标文件（目标文件已被用户修改时保留）"""
+        rel_path = Path(rel_path).as_posix()
+        with self._manifest_lock:
+            entry = self.manifest.pop(rel_path, None)
+        target_path = self.target_dir / rel_path
+        try:
+            target_stat = target_path.stat()
+        except FileNotFoundError:
+            return
+        if entry is not None and self._target_modified(target_path, target_stat, entry):
+            logger.info(f"目标文件已被修改，保留: {rel_path}")
+            return
+        try:
+            target_path.unlink()
+            logger.info(f"已删除文件: {rel_path}")
+        except Exception as e:
+            logger.error(f"删除文件失败: {str(e)}")
+
     def sync_folders(self):
-        """初始同步文件夹内容"""
+        """按清单增量同步文件夹内容，只复制有变化的文件并清理已删除的文件"""
         try:
             if not self.source_dir.exists():
                 logger.error(f"源目录不存在: {self.source_dir}")
@@ -116,13 +331,22 @@ class FolderSync:
             if not self.ensure_target_dir():
                 return False
 
-            # 复制源文件夹中的所有文件到目标文件夹
+            self.load_manifest()
+            copied = 0
+            seen = set()
             try:
-                for item in self.source_dir.iterdir():
-                    if item.is_file():
-                        target_item = self.target_dir / item.name
-                        shutil.copy2(item, target_item)
-                logger.info(f"已完成初始同步: {self.source_dir.name}")
+                for item in self.source_dir.rglob('*'):
+                    if not item.is_file():
+                        continue
+                    seen.add(item.relative_to(self.source_dir).as_posix())
+                    if self.sync_file(item):
+                        copied += 1
+                with self._manifest_lock:
+                    removed = [rel for rel in self.manifest if rel not in seen]
+                for rel_path in removed:
+                    self.remove_file(rel_path)
+                self.save_manifest()
+                logger.info(f"已完成初始同步: {self.source_dir.name}，更新 {copied} 个文件，清理 {len(removed)} 个文件")
             except Exception as e:
                 logger.error(f"初始同步失败: {str(e)}")
 
@@ -142,9 +366,14 @@ class FolderSync:
 
         # 启动文件系统监控
         self.running = True
-        event_handler = FolderSyncHandler(self.source_dir, self.target_dir)
+        sync_settings = SettingsManager.get_instance().section('folder_sync')
+        self.event_handler = FolderSyncHandler(
+            self,
+            debounce_ms=sync_settings.get('debounce_ms', 500),
+            max_workers=sync_settings.get('workers', 4),
+        )
         self.observer = Observer()
-        self.observer.schedule(event_handler, str(self.source_dir), recursive=True)
+        self.observer.schedule(self.event_handler, str(self.source_dir), recursive=True)
         self.observer.start()
         logger.info("已启动实时同步监控")
 
@@ -154,4 +383,7 @@ class FolderSync:
         if self.observer:
             self.observer.stop()
             self.observer.join()
-        logger.info("已停止同步监控")
\ No newline at end of file
+        if self.event_handler:
+            self.event_handler.stop()
+            self.event_handler = None
+        logger.info("已停止同步监控")
@@ -0,0 +1,247 @@
+import argparse
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+
+logger = logging.getLogger('MXChat')
+
+# 工作流中附件引用的前缀，后接内容哈希
+REF_PREFIX = "mxref:"
+# 需要抽取附件的发送节点及其数据输入名
+SEND_NODE_INPUTS = {
+    "MXChatImageSend": "image_data",
+    "MXChatAudioSend": "audio_data",
+    "MXChatVideoSend": "video_data",
+    "MXChatTableSend": "table_data",
+}
+# 短于该长度的小部件值保持内联
+MIN_EXTRACT_CHARS = 4096
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '.cache', 'media')
+
+_BASE64_HEAD = re.compile(r'^(data:[\w.+-]+/[\w.+-]+;base64,)?[A-Za-z0-9+/]{16}')
+
+
+def is_media_ref(value):
+    return isinstance(value, str) and value.startswith(REF_PREFIX)
+
+
+def attachment_list(value):
+    """一个小部件中携带多个附件时以 JSON 数组字符串保存；是附件列表时返回其中的字符串列表，否则返回 None"""
+    if not isinstance(value, str) or not value.startswith('['):
+        return None
+    try:
+        items = json.loads(value)
+    except ValueError:
+        return None
+    if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+        return None
+    return items
+
+
+def attachment_refs(value):
+    """小部件值中引用的附件（单个引用或 JSON 数组中的引用）"""
+    if is_media_ref(value):
+        return [value]
+    return [item for item in attachment_list(value) or [] if is_media_ref(item)]
+
+
+class MediaStore:
+    """按内容寻址的附件仓库：附件以解码后的原始字节保存，文件名为内容哈希"""
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, root=DEFAULT_STORE_DIR):
+        self.root = root
+
+    def path_for(self, ref):
+        digest = ref[len(REF_PREFIX):]
+        if not re.fullmatch(r'[0-9a-f]{32,128}', digest):
+            raise ValueError(f"无效的附件引用: {ref[:80]}")
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put_bytes(self, data):
+        """保存字节数据并返回引用，内容相同的附件只保存一份"""
+        ref = REF_PREFIX + hashlib.blake2b(data, digest_size=20).hexdigest()
+        path = self.path_for(ref)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        return ref
+
+    def put_base64(self, value):
+        """保存 base64 字符串（可带 data URL 前缀）对应的内容，返回引用；无法解码时返回 None"""
+        payload = value.split('base64,', 1)[1] if 'base64,' in value[:256] else value
+        try:
+            data = base64.b64decode(payload, validate=True)
+        except (binascii.Error, ValueError):
+            return None
+        return self.put_bytes(data)
+
+    def open(self, ref):
+        """以二进制流打开引用的附件"""
+        path = self.path_for(ref)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"附件仓库中找不到 {ref}，请重新上传或恢复 {self.root}")
+        return open(path, 'rb')
+
+    def read_bytes(self, ref):
+        with self.open(ref) as f:
+            return f.read()
+
+    def size(self, ref):
+        return os.path.getsize(self.path_for(ref))
+
+    def expand(self, ref):
+        """把引用还原为 base64 字符串"""
+        return base64.b64encode(self.read_bytes(ref)).decode('ascii')
+
+
+def _should_extract(value, min_chars):
+    return (isinstance(value, str) and len(value) >= min_chars
+            and not is_media_ref(value) and _BASE64_HEAD.match(value) is not None)
+
+
+def _compact_value(value, store, min_chars):
+    """把单个附件或附件列表中的内联附件移入仓库，返回 (新值, 替换数量)"""
+    if _should_extract(value, min_chars):
+        ref = store.put_base64(value)
+        return (ref, 1) if ref else (value, 0)
+    items = attachment_list(value) if isinstance(value, str) and len(value) >= min_chars else None
+    if not items:
+        return value, 0
+    replaced = 0
+    for index, item in enumerate(items):
+        if _should_extract(item, min_chars):
+            ref = store.put_base64(item)
+            if ref:
+                items[index] = ref
+                replaced += 1
+    return (json.dumps(items), replaced) if replaced else (value, 0)
+
+
+def _expand_value(value, store):
+    if is_media_ref(value):
+        return store.expand(value), 1
+    items = attachment_list(value) or []
+    restored = sum(1 for item in items if is_media_ref(item))
+    if not restored:
+        return value, 0
+    return json.dumps([store.expand(item) if is_media_ref(item) else item for item in items]), restored
+
+
+def _iter_workflow_nodes(workflow):
+    yield from workflow.get('nodes', [])
+    # 新版前端把子图定义放在 definitions.subgraphs 中
+    for subgraph in workflow.get('definitions', {}).get('subgraphs', []):
+        yield from subgraph.get('nodes', [])
+
+
+def compact_workflow(workflow, store, min_chars=MIN_EXTRACT_CHARS):
+    """把工作流（前端格式）中发送节点的内联附件移入仓库并替换为引用，返回替换数量"""
+    replaced = 0
+    for node in _iter_workflow_nodes(workflow):
+        if node.get('type') not in SEND_NODE_INPUTS:
+            continue
+        values = node.get('widgets_values')
+        if not isinstance(values, list):
+            continue
+        for index, value in enumerate(values):
+            values[index], count = _compact_value(value, store, min_chars)
+            replaced += count
+    return replaced
+
+
+def workflow_refs(workflow):
+    """工作流中发送节点引用的全部附件"""
+    refs = []
+    for node in _iter_workflow_nodes(workflow):
+        values = node.get('widgets_values')
+        if node.get('type') in SEND_NODE_INPUTS and isinstance(values, list):
+            for value in values:
+                refs.extend(attachment_refs(value))
+    return refs
+
+
+def expand_workflow(workflow, store):
+    """把工作流中的引用还原为内联 base64，用于分享到未安装本扩展的环境"""
+    restored = 0
+    for node in _iter_workflow_nodes(workflow):
+        values = node.get('widgets_values')
+        if not isinstance(values, list):
+            continue
+        for index, value in enumerate(values):
+            values[index], count = _expand_value(value, store)
+            restored += count
+    return restored
+
+
+def store_attachment(value, store):
+    """保存侧边栏上传的发送节点附件（单个或 JSON 数组），返回替换为引用后的值；无法解码时返回 None"""
+    value, replaced = _compact_value(value, store, 0)
+    return value if replaced else None
+
+
+def compact_workflow_file(src_path, dst_path, store, min_chars=MIN_EXTRACT_CHARS):
+    """
+    压缩单个工作流文件，返回替换数量和工作流引用的附件；不是工作流 JSON 时返回 None。
+    没有可替换的附件时不写 dst_path，由调用方按原文件放置。
+    """
+    with open(src_path, 'r', encoding='utf-8') as f:
+        try:
+            workflow = json.load(f)
+        except json.JSONDecodeError:
+            return None
+    if not isinstance(workflow, dict):
+        return None
+    replaced = compact_workflow(workflow, store, min_chars)
+    if replaced:
+        with open(dst_path, 'w', encoding='utf-8') as f:
+            json.dump(workflow, f, ensure_ascii=False, indent=2)
+    return replaced, workflow_refs(workflow)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="压缩 / 还原工作流中的内联附件")
+    parser.add_argument('command', choices=['compact', 'expand'])
+    parser.add_argument('files', nargs='+', help="工作流 JSON 文件")
+    parser.add_argument('--store', default=DEFAULT_STORE_DIR, help="附件仓库目录")
+    parser.add_argument('--out', help="输出目录（默认原地修改）")
+    parser.add_argument('--min-chars', type=int, default=MIN_EXTRACT_CHARS, help="抽取附件的最小长度")
+    args = parser.parse_args(argv)
+
+    store = MediaStore(args.store)
+    for path in args.files:
+        with open(path, 'r', encoding='utf-8') as f:
+            workflow = json.load(f)
+        before = os.path.getsize(path)
+        if args.command == 'compact':
+            count = compact_workflow(workflow, store, args.min_chars)
+        else:
+            count = expand_workflow(workflow, store)
+        if not count and not args.out:
+            print(f"{path}: 没有需要处理的附件")
+            continue
+        out_path = os.path.join(args.out, os.path.basename(path)) if args.out else path
+        if args.out:
+            os.makedirs(args.out, exist_ok=True)
+        with open(out_path, 'w', encoding='utf-8') as f:
+            json.dump(workflow, f, ensure_ascii=False, indent=2)
+        print(f"{path}: {count} 个附件, {before} -> {os.path.getsize(out_path)} 字节")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
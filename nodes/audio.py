@@ -0,0 +1,124 @@
+import os
+import uuid
+import traceback
+
+from server import PromptServer
+from ..delivery import DeliveryService
+from ..logger import MXLogger
+from ..metrics import NODE_PAYLOAD_BYTES
+from ..tracing import phase, traced
+from ..retention import RetentionManager
+from .lazy import lazy_import
+from .media_io import AUDIO_CODECS, encode_audio, waveform_peaks
+
+torch = lazy_import("torch")
+
+logger = MXLogger.get_instance()
+
+
+class MXChatAudioReceiveNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "audio": ("AUDIO", {"forceInput": True}),
+            },
+            "optional": {
+                "codec": (list(AUDIO_CODECS.keys()), {"default": "opus"}),
+                "bitrate": ("INT", {"default": 96, "min": 16, "max": 320, "step": 8}),
+            },
+            "hidden": {
+                "extra_pnginfo": "EXTRA_PNGINFO",
+            }
+        }
+
+    RETURN_TYPES = ("AUDIO",)
+    FUNCTION = "execute"
+    OUTPUT_NODE = True
+    CATEGORY = "Agentpark/ReceiveNode"
+
+    @traced
+    def execute(self, audio, codec="opus", bitrate=96):
+        try:
+            logger.info("[MXChatAudioReceiveNode] 开始处理接收到的音频数据")
+
+            if not isinstance(audio, dict) or 'waveform' not in audio or 'sample_rate' not in audio:
+                logger.error("[MXChatAudioReceiveNode] 输入音频为空或无效")
+                return (audio,)
+
+            waveform = audio['waveform']
+            if waveform.dim() == 3:  # [batch, channels, samples]，只发送第一条
+                waveform = waveform[0]
+            if waveform.dim() != 2 or waveform.numel() == 0:
+                logger.error(f"[MXChatAudioReceiveNode] 输入音频形状无效: {tuple(waveform.shape)}")
+                return (audio,)
+
+            # 复制一份快照交给后台编码，之后上游修改或释放张量都不影响
+            samples = waveform.detach().to(device="cpu", dtype=torch.float32, copy=True).numpy()
+            sample_rate = int(audio['sample_rate'])
+
+            comfyui_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+            output_dir = os.path.join(comfyui_root, 'output')
+            os.makedirs(output_dir, exist_ok=True)
+            filename = f"{uuid.uuid4()}.{AUDIO_CODECS[codec]['ext']}"
+            target_path = os.path.join(output_dir, filename)
+
+            # 编码和发送交给后台投递线程，按提交顺序完成，节点直接返回
+            session = PromptServer.instance.client_id
+            DeliveryService.get_instance().submit(
+                lambda: self._build_message(samples, sample_rate, target_path, codec, bitrate, session),
+                record=True, files=[target_path])
+            logger.info("[MXChatAudioReceiveNode] 音频已提交后台编码")
+            return (audio,)
+
+        except Exception as e:
+            error_msg = f"[MXChatAudioReceiveNode] 处理音频失败: {str(e)}"
+            logger.error(error_msg)
+            logger.error(traceback.format_exc())
+            DeliveryService.get_instance().send({
+                "text": error_msg,
+                "isUser": False,
+                "sender": "牧小新",
+                "mode": "agent",
+                "format": "markdown"
+            })
+            return (audio,)
+
+    @staticmethod
+    def _build_message(samples, sample_rate, target_path, codec, bitrate, session):
+        try:
+            with phase("MXChatAudioReceiveNode", "encode"):
+                mime = encode_audio(samples, sample_rate, target_path, codec=codec, bitrate_kbps=bitrate)
+        except Exception as e:
+            if os.path.exists(target_path):
+                os.remove(target_path)
+            error_msg = f"[MXChatAudioReceiveNode] 音频编码失败: {str(e)}"
+            logger.error(error_msg)
+            logger.error(traceback.format_exc())
+            # 错误提示直接发出，不作为结果交给结果缓存
+            PromptServer.instance.send_sync("mx-chat-message", {
+                "text": error_msg,
+                "isUser": False,
+                "sender": "牧小新",
+                "mode": "agent",
+                "format": "markdown"
+            }, None)
+            return None
+        size = os.path.getsize(target_path)
+        NODE_PAYLOAD_BYTES.labels("MXChatAudioReceiveNode", "out").observe(size)
+        # 登记到输出索引，由后台按配额和保存时间清理
+        RetentionManager.get_instance().register(target_path, "audio", session=session)
+        logger.info(f"[MXChatAudioReceiveNode] 音频文件成功保存: {target_path}，大小 {size} 字节")
+        return {
+            "text": "这是生成的音频",
+            "isUser": False,
+            "sender": "牧小新",
+            "audioData": [{
+                "fileType": mime,
+                "audioUrl": f"/view?filename={os.path.basename(target_path)}",
+                "duration": round(samples.shape[1] / sample_rate, 3),
+                "waveform": waveform_peaks(samples),
+            }],
+            "mode": "agent",
+            "format": "markdown"
+        }
@@ -1,8 +1,12 @@
-import base64
-import torch
-import torchaudio
-import io
 import logging
+from ..metrics import NODE_PAYLOAD_BYTES
+from ..tracing import phase, traced
+from .lazy import lazy_import
+from .media_io import FFmpegError, decode_audio
+from .payload import content_fingerprint, payload_path, payload_size
+
+torch = lazy_import("torch")
+torchaudio = lazy_import("torchaudio")
 
 logger = logging.getLogger('MXChat')
 
@@ -16,6 +20,13 @@ class MXChatAudioSendNode:
             },
             "optional": {
                 "text": ("STRING", {"default": "", "hidden": True}),
+                "target_sample_rate": ("INT", {"default": 0, "min": 0, "max": 192000, "step": 1, "display": "目标采样率 (0=原始)"}),
+                "mono": ("BOOLEAN", {"default": False}),
+                "max_duration": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 86400.0, "step": 0.1, "display": "最长时长/秒 (0=全部)"}),
+                "offset": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 86400.0, "step": 0.1, "display": "起始位置/秒"}),
+            },
+            "hidden": {
+                "extra_pnginfo": "EXTRA_PNGINFO",
             }
         }
 
@@ -24,6 +35,11 @@ class MXChatAudioSendNode:
     FUNCTION = "execute"
     CATEGORY = "Agentpark/SendNode"
 
+    @classmethod
+    def IS_CHANGED(cls, audio_data, **kwargs):
+        # 以附件内容哈希作为变化标记，相同附件重复运行时可命中 ComfyUI 的执行缓存
+        return content_fingerprint(audio_data=audio_data, **kwargs)
+
     def __init__(self):
         self.location_name = None
 
@@ -39,7 +55,8 @@ class MXChatAudioSendNode:
         else:
             logger.warning("[MXChatAudioSendNode] widgets 未定义，跳过初始化")
 
-    def execute(self, audio_data, location_name="默认位置", text=""):
+    @traced
+    def execute(self, audio_data, location_name="默认位置", text="", target_sample_rate=0, mono=False, max_duration=0.0, offset=0.0):
         effective_location_name = self.location_name if self.location_name else location_name
         try:
             logger.info(f"[MXChatAudioSendNode] 开始处理音频数据，location_name: {effective_location_name}")
@@ -47,17 +64,10 @@ class MXChatAudioSendNode:
                 logger.error("[MXChatAudioSendNode] 未提供音频数据")
                 return ({"waveform": torch.zeros(1, 1, 1), "sample_rate": 44100},)
 
-            # 移除 base64 前缀（如果存在）
-            if 'base64,' in audio_data:
-                audio_data = audio_data.split('base64,')[1]
-               
-
-            # 解码 base64 数据为字节
-            audio_bytes = base64.b64decode(audio_data)
-
-            # 将字节数据转换为音频波形
-            audio_io = io.BytesIO(audio_bytes)
-            waveform, sample_rate = torchaudio.load(audio_io)
+            # 附件流式解码到临时文件（仓库引用直接使用仓库文件），再只解码需要的时间窗口
+            NODE_PAYLOAD_BYTES.labels("MXChatAudioSendNode", "in").observe(payload_size(audio_data))
+            with phase("MXChatAudioSendNode", "decode"), payload_path(audio_data) as audio_path:
+                waveform, sample_rate = self._load_window(audio_path, target_sample_rate, mono, max_duration, offset)
 
             # 确保波形是三维张量 [batch_size, channels, samples]
             if waveform.dim() == 1:  # 单声道一维数据
@@ -72,5 +82,30 @@ class MXChatAudioSendNode:
             logger.error(f"[MXChatAudioSendNode] 处理音频失败: {str(e)}")
             return ({"waveform": torch.zeros(1, 1, 1), "sample_rate": 44100},)
 
+    def _load_window(self, audio_path, target_sample_rate, mono, max_duration, offset):
+        """解码指定时间窗口，重采样和单声道混音在 ffmpeg 解码过程中完成"""
+        try:
+            samples, sample_rate = decode_audio(
+                audio_path,
+                sample_rate=target_sample_rate or None,
+                channels=1 if mono else None,
+                offset=offset,
+                duration=max_duration or None,
+            )
+            return torch.from_numpy(samples), sample_rate
+        except FFmpegError as e:
+            logger.warning(f"[MXChatAudioSendNode] ffmpeg 解码失败，改用 torchaudio: {str(e)}")
+
+        # 回退：torchaudio 只读取窗口内的帧，再做混音和重采样
+        sample_rate = torchaudio.info(audio_path).sample_rate
+        num_frames = int(max_duration * sample_rate) if max_duration > 0 else -1
+        waveform, sample_rate = torchaudio.load(audio_path, frame_offset=int(offset * sample_rate), num_frames=num_frames)
+        if mono and waveform.shape[0] > 1:
+            waveform = waveform.mean(dim=0, keepdim=True)
+        if target_sample_rate and target_sample_rate != sample_rate:
+            waveform = torchaudio.functional.resample(waveform, sample_rate, target_sample_rate)
+            sample_rate = target_sample_rate
+        return waveform, sample_rate
+
     def _return_default(self):
         return ({"waveform": torch.zeros(1, 1, 1), "sample_rate": 44100},)
\ No newline at end of file
@@ -1,6 +1,9 @@
-import re
-from server import PromptServer
+import time
+import uuid
+from ..delivery import DeliveryService
 from ..logger import MXLogger
+from .markdown_detect import detect_markdown
+from ..tracing import traced
 
 # 获取日志实例
 logger = MXLogger.get_instance()
@@ -14,6 +17,9 @@ class MXChatSendNode:
         return {
             "required": {
                 "text": ("STRING", {"hidden": True})
+            },
+            "hidden": {
+                "extra_pnginfo": "EXTRA_PNGINFO",
             }
         }
     
@@ -21,6 +27,7 @@ class MXChatSendNode:
     FUNCTION = "execute"
     CATEGORY = "Agentpark/SendNode"
     
+    @traced
     def execute(self, text):
         # 将用户输入的文本向下传递
         return (text,)
@@ -34,6 +41,9 @@ class MXChatReceiveNode:
         return {
             "required": {
                 "text": ("STRING", {"forceInput": True}),
+            },
+            "hidden": {
+                "extra_pnginfo": "EXTRA_PNGINFO",
             }
         }
     
@@ -42,6 +52,7 @@ class MXChatReceiveNode:
     OUTPUT_NODE = True
     CATEGORY = "Agentpark/ReceiveNode"
 
+    @traced
     def execute(self, text):
         logger.info("开始处理接收到的消息")
         # 处理输入的消息文本
@@ -56,37 +67,136 @@ class MXChatReceiveNode:
         
         # 使用strip()方法去除消息前后的空格、换行等空白字符
         message = message.strip()
+
+        # 格式检测和发送在后台投递线程中进行，不计入节点执行时间
+        DeliveryService.get_instance().submit(lambda: self._build_message(message), record=True)
         
+        # 返回处理后的消息内容，作为节点的输出
+        return (message,)
+
+    @staticmethod
+    def _build_message(message):
         try:
-            # 检查消息是否包含markdown元素
-            has_markdown = any([
-                bool(re.search(r'```[\s\S]*?```', message)),  # 代码块
-                bool(re.search(r'\|[^|]+\|[^|]+\|', message)),  # 表格（至少两列）
-                bool(re.search(r'^[-*_]{3,}$', message, re.MULTILINE)),  # 分隔线
-                bool(re.search(r'^#{1,6}\s+\S+', message, re.MULTILINE)),  # 标题
-                bool(re.search(r'\*\*[^*]+\*\*|__[^_]+__', message)),  # 加粗
-                bool(re.search(r'\*[^*]+\*|_[^_]+_', message)),  # 斜体
-                bool(re.search(r'\[([^\]]+)\]\(([^)]+)\)', message))  # 链接
-            ]) if message else False
+            # 单次扫描检查消息是否包含markdown元素，并记录代码块/表格/标题，前端据此选择渲染方式
+            has_markdown, features = detect_markdown(message)
 
             # 准备消息数据
-            message_data = {
+            return {
                 "text": message,  # 直接使用处理后的消息
                 "isUser": False,
                 "sender": "牧小新",
                 "mode": "agent",
-                "format": "markdown" if has_markdown else "text"  # 始终设置format字段
+                "format": "markdown" if has_markdown else "text",  # 始终设置format字段
+                "formatFeatures": features
             }
-
-          
-            
-            # 使用PromptServer的send_sync方法同步发送消息到前端
-            PromptServer.instance.send_sync("mx-chat-message", message_data)
         
         except Exception as e:
             error_msg = f"处理消息失败: {str(e)}"
             logger.error(error_msg)
-            print(error_msg)
-        
-        # 返回处理后的消息内容，作为节点的输出
-        return (message,)
\ No newline at end of file
+            return None
+
+def session_from(extra_pnginfo):
+    """聊天侧边栏提交工作流时写入的 clientId（即侧边栏 WebSocket 的 sid），没有时返回 None（广播）"""
+    try:
+        return extra_pnginfo["workflow"]["extra"].get("mx_client_id") or None
+    except (KeyError, TypeError, AttributeError):
+        return None
+
+
+class MXChatStreamReceiveNode:
+    """
+    流式接收消息节点：输入可以是字符串、逐段产出文本的迭代器/生成器，
+    或接收回调的函数 producer(emit)（每产生一段文本调用一次 emit，返回值为完整文本，可省略）。
+    文本片段按间隔合并后以 mx-chat-stream 事件发往发起请求的侧边栏，结束时再发送完整文本，
+    Markdown 格式只在结束时检测一次。
+    """
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "text": ("*", {"forceInput": True}),
+            },
+            "optional": {
+                "flush_interval_ms": ("INT", {"default": 50, "min": 0, "max": 2000, "step": 10}),
+            },
+            "hidden": {
+                "extra_pnginfo": "EXTRA_PNGINFO",
+            }
+        }
+
+    RETURN_TYPES = ("STRING",)
+    FUNCTION = "execute"
+    OUTPUT_NODE = True
+    CATEGORY = "Agentpark/ReceiveNode"
+
+    # 缓冲的文本超过该长度时立即发送，不等间隔
+    MAX_BUFFERED_CHARS = 2048
+
+    @traced
+    def execute(self, text, flush_interval_ms=50, extra_pnginfo=None):
+        logger.info("[MXChatStreamReceiveNode] 开始流式接收消息")
+        stream_id = uuid.uuid4().hex
+        sid = session_from(extra_pnginfo)
+        delivery = DeliveryService.get_instance()
+        interval = flush_interval_ms / 1000.0
+        parts = []
+        buffer = []
+        state = {"buffered": 0, "last_flush": 0.0}
+
+        def flush():
+            if not buffer:
+                return
+            delivery.send({
+                "streamId": stream_id,
+                "delta": "".join(buffer),
+                "isUser": False,
+                "sender": "牧小新",
+                "mode": "agent",
+            }, event="mx-chat-stream", sid=sid)
+            buffer.clear()
+            state["buffered"] = 0
+            state["last_flush"] = time.monotonic()
+
+        def emit(delta):
+            if delta is None:
+                return
+            delta = str(delta)
+            if not delta:
+                return
+            parts.append(delta)
+            buffer.append(delta)
+            state["buffered"] += len(delta)
+            # 第一段立即发送，之后按间隔合并，降低消息数量
+            if (time.monotonic() - state["last_flush"] >= interval
+                    or state["buffered"] >= self.MAX_BUFFERED_CHARS):
+                flush()
+
+        try:
+            if isinstance(text, (tuple, list)) and len(text) == 1 and not isinstance(text[0], str):
+                text = text[0]
+            if callable(text):
+                result = text(emit)
+                if isinstance(result, str) and not parts:
+                    emit(result)
+            elif isinstance(text, (str, bytes)) or text is None:
+                emit(text.decode("utf-8", "replace") if isinstance(text, bytes) else text)
+            else:
+                for chunk in text:
+                    emit(chunk)
+        except Exception as e:
+            logger.error(f"[MXChatStreamReceiveNode] 读取文本流失败: {str(e)}")
+            emit(f"\n\n[生成中断: {str(e)}]")
+        finally:
+            flush()
+
+        message = "".join(parts).strip()
+        delivery.submit(lambda: self._build_final(stream_id, message), event="mx-chat-stream", sid=sid, record=True)
+        return (message,)
+
+    @staticmethod
+    def _build_final(stream_id, message):
+        data = MXChatReceiveNode._build_message(message)
+        if data is None:
+            return None
+        data.update({"streamId": stream_id, "done": True})
+        return data
@@ -2,14 +2,17 @@ import base64
 import json
 import traceback
 from io import BytesIO
-from PIL import Image
-import numpy as np
-import torch
 import threading
 import os
 import time
-from server import PromptServer
+from ..delivery import DeliveryService
 from ..logger import MXLogger
+from ..tracing import traced
+from .lazy import lazy_import
+
+Image = lazy_import("PIL.Image")
+np = lazy_import("numpy")
+torch = lazy_import("torch")
 
 # 获取日志记录器实例
 logger = MXLogger.get_instance()
@@ -25,6 +28,9 @@ class MXChatImageReceiveNode:
         return {
             "required": {
                 "image": ("IMAGE", {"forceInput": True}),
+            },
+            "hidden": {
+                "extra_pnginfo": "EXTRA_PNGINFO",
             }
         }
     
@@ -33,6 +39,7 @@ class MXChatImageReceiveNode:
     OUTPUT_NODE = True
     CATEGORY = "Agentpark/ReceiveNode"
 
+    @traced
     def execute(self, image):
         try:
             logger.info("[MXChatImageReceiveNode] 开始处理接收到的图片数据")
@@ -88,21 +95,9 @@ class MXChatImageReceiveNode:
                 logger.error("[MXChatImageReceiveNode] 未生成有效的输出图像")
                 return self._return_default()
             
-            first_img_np = (output_image[0].cpu().numpy() * 255).astype(np.uint8)
-            first_img_pil = Image.fromarray(first_img_np)
-            buffer = BytesIO()
-            first_img_pil.save(buffer, format='PNG')
-            image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            
-            PromptServer.instance.send_sync("mx-chat-message", {
-                "text": "这是生成的图片",
-                "isUser": False,
-                "sender": "牧小新",
-                "imageData": image_base64,
-                "mode": "agent",
-                "format": "markdown"
-            })
-         
+            # PNG 编码和发送交给后台投递线程，节点直接返回
+            first_image = output_image[0]
+            DeliveryService.get_instance().submit(lambda: self._build_message(first_image), record=True)
             
             return (output_image, output_mask)
         
@@ -110,7 +105,7 @@ class MXChatImageReceiveNode:
             error_msg = f"[MXChatImageReceiveNode] 处理接收到的图片失败: {str(e)}"
             logger.error(error_msg)
             logger.error(traceback.format_exc())
-            PromptServer.instance.send_sync("mx-chat-message", {
+            DeliveryService.get_instance().send({
                 "text": error_msg,
                 "isUser": False,
                 "sender": "牧小新",
@@ -119,6 +114,20 @@ class MXChatImageReceiveNode:
             })
             return self._return_default()
 
+    @staticmethod
+    def _build_message(image):
+        img_np = (image.cpu().numpy() * 255).astype(np.uint8)
+        buffer = BytesIO()
+        Image.fromarray(img_np).save(buffer, format='PNG')
+        return {
+            "text": "这是生成的图片",
+            "isUser": False,
+            "sender": "牧小新",
+            "imageData": base64.b64encode(buffer.getvalue()).decode('utf-8'),
+            "mode": "agent",
+            "format": "markdown"
+        }
+
     def _return_default(self):
         default_image = torch.zeros((1, 64, 64, 3), dtype=torch.float32)
         default_mask = torch.zeros((1, 64, 64), dtype=torch.float32)
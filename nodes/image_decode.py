@@ -0,0 +1,143 @@
+from io import BytesIO
+
+from .lazy import lazy_import
+
+Image = lazy_import("PIL.Image")
+np = lazy_import("numpy")
+
+# EXIF Orientation 标签
+_ORIENTATION_TAG = 0x0112
+# 方向 5~8 需要交换宽高
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+# 尺寸不同的图片合成一个批次时的处理方式：拉伸到目标尺寸 / 按比例缩放后补边 / 按比例缩放后居中裁剪
+FIT_POLICIES = ("resize", "pad", "crop")
+
+
+def output_size(width, height, target_width=0, target_height=0, max_side=0):
+    """
+    计算输出尺寸，规则与视频解码的 scale_filter 一致：同时指定宽高时缩放到该尺寸，
+    只指定一边时按比例计算另一边，max_side 限制长边（不放大）。
+    """
+    if target_width > 0 and target_height > 0:
+        return target_width, target_height
+    if target_width > 0:
+        return target_width, max(1, round(height * target_width / width))
+    if target_height > 0:
+        return max(1, round(width * target_height / height)), target_height
+    if max_side > 0 and max(width, height) > max_side:
+        scale = max_side / max(width, height)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+    return width, height
+
+
+def _fit_size(width, height, box_width, box_height, fit):
+    """按 fit 策略计算放入 box 之前的缩放尺寸"""
+    if fit == "resize":
+        return box_width, box_height
+    scale = (min if fit == "pad" else max)(box_width / width, box_height / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _orientation(image):
+    return image.getexif().get(_ORIENTATION_TAG, 1)
+
+
+def probe_image(image_bytes):
+    """只读取文件头，返回按 EXIF 方向旋转后的 (宽, 高)"""
+    with Image.open(BytesIO(image_bytes)) as image:
+        width, height = image.size
+        if _orientation(image) in _TRANSPOSED_ORIENTATIONS:
+            return height, width
+        return width, height
+
+
+def _transpose_method(orientation):
+    transpose = Image.Transpose
+    return {
+        2: transpose.FLIP_LEFT_RIGHT,
+        3: transpose.ROTATE_180,
+        4: transpose.FLIP_TOP_BOTTOM,
+        5: transpose.TRANSPOSE,
+        6: transpose.ROTATE_270,
+        7: transpose.TRANSVERSE,
+        8: transpose.ROTATE_90,
+    }.get(orientation)
+
+
+def _normalize_mode(image):
+    """统一为 RGB/RGBA（8 位）或 I（16 位灰度，保留精度），其余模式（调色板、CMYK、1 位等）在此转换"""
+    if image.mode in ("RGB", "RGBA", "I"):
+        return image
+    if image.mode.startswith("I;16"):
+        return image.convert("I")
+    if image.mode == "F":
+        return image.convert("L").convert("RGB")
+    has_alpha = "A" in image.getbands() or "transparency" in image.info
+    return image.convert("RGBA" if has_alpha else "RGB")
+
+
+def decode_image(image_bytes, target_width=0, target_height=0, max_side=0, fit="resize"):
+    """
+    解码图片，返回 ([高, 宽, 3] float32 RGB 数组, [高, 宽] float32 掩码)。
+    同时指定宽高时按 fit 策略放入该尺寸：resize 拉伸，pad 按比例缩放后补黑边（补边区域掩码为 1），crop 按比例缩放后居中裁剪。
+    按 EXIF 方向旋转；需要缩小时 JPEG 直接以 1/2~1/8 分辨率解码（draft），缩小后才转换为 float32，
+    内存和耗时随输出尺寸而不是原图尺寸增长。掩码与 ComfyUI LoadImage 一致：1 - alpha，没有透明通道时全 0。
+    """
+    image = Image.open(BytesIO(image_bytes))
+    orientation = _orientation(image)
+    width, height = image.size
+    transposed = orientation in _TRANSPOSED_ORIENTATIONS
+    if transposed:
+        width, height = height, width
+    if target_width > 0 and target_height > 0:
+        out_width, out_height = _fit_size(width, height, target_width, target_height, fit)
+    else:
+        out_width, out_height = output_size(width, height, target_width, target_height, max_side)
+    # 缩放在原始方向上进行，最后再旋转
+    size = (out_height, out_width) if transposed else (out_width, out_height)
+
+    if size != image.size and image.format == "JPEG":
+        # 选择不小于目标尺寸的最小 DCT 缩放比例解码，不生成全分辨率位图
+        image.draft("RGB" if image.mode != "L" else "L", size)
+    image = _normalize_mode(image)
+    if image.size != size:
+        # 缩小用区域平均（与视频解码的 flags=area 一致），放大用双三次插值
+        shrinking = size[0] <= image.size[0] and size[1] <= image.size[1]
+        image = image.resize(size, Image.Resampling.BOX if shrinking else Image.Resampling.BICUBIC)
+    method = _transpose_method(orientation)
+    if method is not None:
+        image = image.transpose(method)
+
+    array, mask = _to_arrays(image)
+    if (out_width, out_height) != (target_width, target_height) and target_width > 0 and target_height > 0:
+        array, mask = _place(array, mask, target_width, target_height)
+    return array, mask
+
+
+def _to_arrays(image):
+    if image.mode == "I":
+        gray = np.asarray(image, dtype=np.float32)
+        gray /= 65535.0
+        np.clip(gray, 0.0, 1.0, out=gray)
+        return np.repeat(gray[:, :, None], 3, axis=2), np.zeros(gray.shape, dtype=np.float32)
+
+    array = np.asarray(image, dtype=np.float32)
+    array /= 255.0
+    if image.mode == "RGBA":
+        mask = 1.0 - array[:, :, 3]
+        return np.ascontiguousarray(array[:, :, :3]), mask
+    return array, np.zeros(array.shape[:2], dtype=np.float32)
+
+
+def _place(array, mask, width, height):
+    """把缩放后的图片居中放入 width x height：超出的部分裁掉，不足的部分补黑边，补边区域掩码为 1"""
+    src_height, src_width = mask.shape
+    # 源图中保留的区域（裁剪）和在画布中的位置（补边）
+    crop_top, crop_left = max(0, (src_height - height) // 2), max(0, (src_width - width) // 2)
+    top, left = max(0, (height - src_height) // 2), max(0, (width - src_width) // 2)
+    rows, cols = min(height, src_height), min(width, src_width)
+    canvas = np.zeros((height, width, 3), dtype=np.float32)
+    canvas_mask = np.ones((height, width), dtype=np.float32)
+    canvas[top:top + rows, left:left + cols] = array[crop_top:crop_top + rows, crop_left:crop_left + cols]
+    canvas_mask[top:top + rows, left:left + cols] = mask[crop_top:crop_top + rows, crop_left:crop_left + cols]
+    return canvas, canvas_mask
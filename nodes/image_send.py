@@ -1,12 +1,22 @@
-import base64
-from io import BytesIO
-from PIL import Image
-import numpy as np
-import torch
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 from ..logger import MXLogger
+from ..media_store import attachment_list
+from ..metrics import NODE_PAYLOAD_BYTES
+from ..tracing import phase, traced
+from .image_decode import FIT_POLICIES, decode_image, output_size, probe_image
+from .lazy import lazy_import
+from .payload import content_fingerprint, payload_size, read_payload_bytes, strip_data_url
+
+np = lazy_import("numpy")
+torch = lazy_import("torch")
 
 logger = MXLogger.get_instance()
 
+# 多个附件并行解码；PIL 解码和缩放时释放 GIL
+_decode_pool = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="mx-image-decode")
+
 class MXChatImageSendNode:
     @classmethod
     def INPUT_TYPES(cls):
@@ -17,15 +27,27 @@ class MXChatImageSendNode:
             },
             "optional": {
                 "text": ("STRING", {"default": "", "hidden": True}),
+                "target_width": ("INT", {"default": 0, "min": 0, "max": 16384, "step": 1, "display": "输出宽度 (0=按比例/原始)"}),
+                "target_height": ("INT", {"default": 0, "min": 0, "max": 16384, "step": 1, "display": "输出高度 (0=按比例/原始)"}),
+                "max_side": ("INT", {"default": 0, "min": 0, "max": 16384, "step": 1, "display": "长边上限 (0=不限制)"}),
+                "batch_policy": (list(FIT_POLICIES), {"default": "resize"}),
+            },
+            "hidden": {
+                "extra_pnginfo": "EXTRA_PNGINFO",
             }
         }
     
-    RETURN_TYPES = ("IMAGE",)  # 保持接口一致，但 MASK 可以是占位符
-    RETURN_NAMES = ("image", )
+    RETURN_TYPES = ("IMAGE", "MASK")
+    RETURN_NAMES = ("image", "mask")
     FUNCTION = "execute"
     OUTPUT_NODE = True
     CATEGORY = "Agentpark"
 
+    @classmethod
+    def IS_CHANGED(cls, image_data, **kwargs):
+        # 以附件内容哈希作为变化标记，相同附件重复运行时可命中 ComfyUI 的执行缓存
+        return content_fingerprint(image_data=image_data, **kwargs)
+
     def __init__(self):
         self.location_name = None
 
@@ -39,25 +61,29 @@ class MXChatImageSendNode:
         else:
             logger.warning("[MXChatImageSendNode] widgets 未定义，跳过初始化")
 
-    def execute(self, image_data, location_name="默认位置", text=""):
+    @traced
+    def execute(self, image_data, location_name="默认位置", text="", target_width=0, target_height=0, max_side=0,
+                batch_policy="resize"):
         effective_location_name = self.location_name if self.location_name else location_name
         try:
             logger.info(f"[MXChatImageSendNode] 开始处理图片数据，location_name: {effective_location_name}")
             if not image_data:
                 logger.error("[MXChatImageSendNode] 未提供图片数据")
                 return self._return_default()
-            if 'base64,' in image_data:
-                image_data = image_data.split('base64,')[1]
-          
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(BytesIO(image_bytes))
-       
-            # 直接使用原始图像数据，不强制转换模式
-            img_array = np.array(image).astype(np.float32) / 255.0
-            img_tensor = torch.from_numpy(img_array).unsqueeze(0)  # 保持原始通道数
-            
-            # 生成一个占位符掩码（如果下游需要，但不包含透明信息）
-            mask = torch.ones((1, image.size[1], image.size[0]), dtype=torch.float32)  # 全1掩码，表示不透明
+            # 同一位置上传多张图片时 image_data 为附件列表（JSON 数组），每项是 base64 或附件仓库引用
+            attachments = [strip_data_url(item) for item in attachment_list(image_data) or [image_data]]
+            attachments = [item for item in attachments if item]
+            if not attachments:
+                logger.error("[MXChatImageSendNode] 附件列表为空")
+                return self._return_default()
+
+            NODE_PAYLOAD_BYTES.labels("MXChatImageSendNode", "in").observe(sum(payload_size(item) for item in attachments))
+            with phase("MXChatImageSendNode", "decode"):
+                # 直接按需要的尺寸解码，统一为 RGB，按 EXIF 方向旋转，透明通道转为掩码
+                images, masks = self._decode_batch(attachments, target_width, target_height, max_side, batch_policy)
+                img_tensor = torch.from_numpy(images)
+
+            mask = torch.from_numpy(masks)
 
             logger.info(f"[MXChatImageSendNode] 图片处理完成，输出张量形状: {img_tensor.shape}")
             return (img_tensor, mask)
@@ -65,7 +91,31 @@ class MXChatImageSendNode:
             logger.error(f"[MXChatImageSendNode] 处理图片失败: {str(e)}")
             return self._return_default()
 
+    @staticmethod
+    def _decode_batch(attachments, target_width, target_height, max_side, batch_policy):
+        """并行解码所有附件，返回 [N, 高, 宽, 3] 的图片批次和 [N, 高, 宽] 的掩码批次"""
+        # 解码 base64 数据（或从附件仓库读取引用的内容）
+        contents = list(_decode_pool.map(read_payload_bytes, attachments))
+        if len(contents) > 1 and not (target_width > 0 and target_height > 0):
+            # 未同时指定宽高时，以第一张图片的输出尺寸作为整个批次的尺寸
+            width, height = probe_image(contents[0])
+            target_width, target_height = output_size(width, height, target_width, target_height, max_side)
+        futures = [_decode_pool.submit(decode_image, content, target_width, target_height, max_side, batch_policy)
+                   for content in contents]
+
+        image, mask = futures[0].result()
+        if len(futures) == 1:
+            return image[None], mask[None]
+        # 预先分配批次，逐张写入，不再额外 stack 一次
+        images = np.empty((len(futures),) + image.shape, dtype=np.float32)
+        masks = np.empty((len(futures),) + mask.shape, dtype=np.float32)
+        images[0], masks[0] = image, mask
+        for index, future in enumerate(futures[1:], start=1):
+            images[index], masks[index] = future.result()
+        return images, masks
+
     def _return_default(self):
         default_image = torch.zeros((1, 64, 64, 3), dtype=torch.float32)  # 默认 RGB
-        
-        return (default_image, )
\ No newline at end of file
+        default_mask = torch.zeros((1, 64, 64), dtype=torch.float32)
+
+        return (default_image, default_mask)
\ No newline at end of file
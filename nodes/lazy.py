@@ -0,0 +1,38 @@
+import importlib
+import importlib.util
+import sys
+
+
+class _LazyModule:
+    """模块代理：第一次访问属性时才用 importlib.import_module 导入真实模块，之后直接转发"""
+    __slots__ = ("_name", "_module")
+
+    def __init__(self, name):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_module", None)
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            # import_module 自带导入锁，并发首次访问时只会真正导入一次
+            module = importlib.import_module(self._name)
+            object.__setattr__(self, "_module", module)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}'>"
+
+
+def lazy_import(name):
+    """
+    返回延迟加载的模块：导入时只查找模块，第一次访问属性（通常在节点首次 execute 时）才真正执行导入。
+    ComfyUI 加载插件时不再为 torch、cv2、pandas 等付出导入时间；已经导入过的模块直接返回。
+    代理只在本插件内部使用，不写入 sys.modules，其他插件导入同名模块时得到的仍是真实模块。
+    模块不存在时与普通 import 一样立即抛出 ModuleNotFoundError。
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    if importlib.util.find_spec(name) is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    return _LazyModule(name)
@@ -0,0 +1,69 @@
+import re
+
+# 行首特征：分隔线、标题
+_LINE_START = r'(?P<hr>[-*_]{3,}[ \t]*$)|(?P<heading>#{1,6}[ \t]+\S)'
+
+# 所有特征合并为一个预编译的正则，扫描到第一个特征即停止。开头的前瞻只在可能开始一个特征的字符处尝试各分支，
+# 普通文字直接跳过；行内特征的字符类都排除了换行和自身的定界符，每个起点最多扫描到行尾或下一个定界符，
+# 对不闭合的 ***、[[[ 等恶意输入也保持线性时间。
+_MARKDOWN = re.compile(
+    r'(?=[`\n|*_\[])(?:'
+    r'(?P<fence>```)'                               # 代码块定界符（出现两次才算代码块）
+    r'|\n(?:' + _LINE_START + r')'                  # 分隔线、标题
+    r'|(?P<table>\|[^|\n]+\|[^|\n]+\|)'             # 表格（至少两列）
+    r'|(?P<bold>\*\*[^*\n]+\*\*|__[^_\n]+__)'       # 加粗
+    r'|(?P<italic>\*[^*\n]+\*|_[^_\n]+_)'           # 斜体
+    r'|(?P<link>\[[^\[\]\n]+\]\([^()\s]+\))'        # 链接
+    r')',
+    re.MULTILINE,
+)
+# 主正则以换行定位行首，第一行单独匹配
+_FIRST_LINE = re.compile(_LINE_START, re.MULTILINE)
+
+# 确认是 Markdown 之后，其余块级特征各用一次字面量开头的查找确定，不再逐个遍历行内匹配
+_HEADING = re.compile(r'\n#{1,6}[ \t]+\S')
+_TABLE = re.compile(r'\|[^|\n]+\|[^|\n]+\|')
+
+# 前端选择渲染方式时关心的块级特征
+BLOCK_FEATURES = ("code", "table", "heading")
+
+
+def _first_feature(text):
+    """返回第一个 Markdown 特征的类型，没有时返回 None"""
+    first = _FIRST_LINE.match(text)
+    if first:
+        return first.lastgroup
+    fences = 0
+    for match in _MARKDOWN.finditer(text):
+        kind = match.lastgroup
+        if kind != "fence":
+            return kind
+        fences += 1
+        if fences == 2:
+            return "code"
+    return None
+
+
+def _has_feature(text, feature):
+    if feature == "code":
+        start = text.find("```")
+        return start >= 0 and text.find("```", start + 3) >= 0
+    if feature == "table":
+        return _TABLE.search(text) is not None
+    # 第一行是标题时 _first_feature 已经返回 heading，这里只需查找后续行
+    return _HEADING.search(text) is not None
+
+
+def detect_markdown(text, features=True):
+    """
+    判断文本是否为 Markdown，返回 (是否 Markdown, 包含的块级特征列表)。
+    在第一个 Markdown 特征处停止扫描；features=True 时再确定代码块、表格、标题各自是否存在，供前端选择渲染方式。
+    """
+    if not text:
+        return False, []
+    first = _first_feature(text)
+    if first is None:
+        return False, []
+    if not features:
+        return True, []
+    return True, [f for f in BLOCK_FEATURES if f == first or _has_feature(text, f)]
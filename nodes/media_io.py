@@ -0,0 +1,298 @@
+import functools
+import math
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+
+from .lazy import lazy_import
+
+np = lazy_import("numpy")
+
+# 从管道读取解码数据时的块大小
+READ_CHUNK_BYTES = 1024 * 1024
+
+
+class FFmpegError(RuntimeError):
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def find_ffmpeg():
+    """返回 ffmpeg 可执行文件路径，未安装时返回 None"""
+    return shutil.which("ffmpeg")
+
+
+@functools.lru_cache(maxsize=None)
+def find_ffprobe():
+    return shutil.which("ffprobe")
+
+
+class _StderrCollector(threading.Thread):
+    """后台读取 stderr，避免 ffmpeg 输出过多日志时管道写满而阻塞"""
+
+    def __init__(self, stream):
+        super().__init__(daemon=True)
+        self.stream = stream
+        self.data = b""
+
+    def run(self):
+        self.data = self.stream.read()
+
+    def text(self):
+        self.join()
+        return self.data.decode("utf-8", errors="replace").strip()
+
+
+def _read_exact(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise FFmpegError("ffmpeg 输出提前结束")
+    return data
+
+
+def _read_wav_header(stream):
+    """解析 ffmpeg 写到管道的 WAV 头，返回 (声道数, 采样率)，读取位置停在 PCM 数据开头"""
+    riff = _read_exact(stream, 12)
+    if riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+        raise FFmpegError("ffmpeg 输出不是 WAV 格式")
+    channels = sample_rate = None
+    while True:
+        chunk_id, chunk_size = struct.unpack("<4sI", _read_exact(stream, 8))
+        if chunk_id == b"data":
+            if channels is None:
+                raise FFmpegError("WAV 输出缺少 fmt 块")
+            return channels, sample_rate
+        body = _read_exact(stream, chunk_size + (chunk_size & 1))
+        if chunk_id == b"fmt ":
+            _, channels, sample_rate = struct.unpack("<HHI", body[:8])
+
+
+def _read_into_array(stream, capacity):
+    """把管道中的 float32 数据读入预分配数组；capacity 为 None 时按需增长"""
+    if capacity is None:
+        buffer = bytearray()
+        while True:
+            chunk = stream.read(READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            buffer.extend(chunk)
+        usable = len(buffer) - len(buffer) % 4
+        return np.frombuffer(memoryview(buffer)[:usable], dtype=np.float32)
+
+    samples = np.empty(capacity, dtype=np.float32)
+    view = memoryview(samples).cast("B")
+    filled = 0
+    while filled < len(view):
+        count = stream.readinto(view[filled:filled + READ_CHUNK_BYTES])
+        if not count:
+            break
+        filled += count
+    # 按上限预分配，读完后丢弃多余的部分（若比上限短）
+    return samples[:filled // 4]
+
+
+def audio_output_args(sample_rate=None, channels=None):
+    """ffmpeg 输出 float32 WAV 到标准输出的参数"""
+    args = []
+    if channels:
+        args += ["-ac", str(channels)]
+    if sample_rate:
+        args += ["-ar", str(sample_rate)]
+    return args + ["-c:a", "pcm_f32le", "-bitexact", "-f", "wav"]
+
+
+def read_wav_stream(stream, max_duration=None):
+    """从 ffmpeg 的 WAV 输出流读取全部采样，返回 ([声道, 采样] float32 数组, 采样率)"""
+    channels, sample_rate = _read_wav_header(stream)
+    capacity = None
+    if max_duration:
+        capacity = (int(math.ceil(max_duration * sample_rate)) + 1) * channels
+    samples = _read_into_array(stream, capacity)
+    samples = samples[:len(samples) - len(samples) % channels]
+    return np.ascontiguousarray(samples.reshape(-1, channels).T), sample_rate
+
+
+def decode_audio(path, sample_rate=None, channels=None, offset=0.0, duration=None):
+    """
+    用 ffmpeg 解码音频的一个时间窗口：seek、截取、重采样和混音都在解码过程中完成，
+    内存只与输出窗口大小有关。返回 ([声道, 采样] float32 数组, 采样率)。
+    """
+    ffmpeg = find_ffmpeg()
+    if not ffmpeg:
+        raise FFmpegError("未找到 ffmpeg")
+    cmd = [ffmpeg, "-hide_banner", "-loglevel", "error", "-nostdin"]
+    if offset and offset > 0:
+        cmd += ["-ss", f"{offset:.6f}"]
+    cmd += ["-i", path]
+    if duration and duration > 0:
+        cmd += ["-t", f"{duration:.6f}"]
+    cmd += ["-vn", "-map", "0:a:0"] + audio_output_args(sample_rate, channels) + ["pipe:1"]
+
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr = _StderrCollector(process.stderr)
+    stderr.start()
+    try:
+        waveform, rate = read_wav_stream(process.stdout, duration)
+    except FFmpegError as e:
+        process.kill()
+        process.wait()
+        raise FFmpegError(f"{str(e)}: {stderr.text()}")
+    finally:
+        process.stdout.close()
+    if process.wait() != 0:
+        raise FFmpegError(f"ffmpeg 解码音频失败: {stderr.text()}")
+    return waveform, rate
+
+
+# 压缩音频的编码参数：ffmpeg 编码器、容器格式、文件扩展名和 MIME 类型
+AUDIO_CODECS = {
+    "opus": {"args": ["-c:a", "libopus", "-ar", "48000", "-f", "ogg"], "ext": "ogg", "mime": "audio/ogg"},
+    "aac": {"args": ["-c:a", "aac", "-movflags", "+faststart", "-f", "mp4"], "ext": "m4a", "mime": "audio/mp4"},
+}
+
+
+def encode_audio(samples, sample_rate, path, codec="opus", bitrate_kbps=64, chunk_frames=65536):
+    """
+    把 [声道, 采样] 的 float32 数组流式写入 ffmpeg 编码为压缩音频文件，
+    每次只交织一小段数据，不生成完整的 PCM/WAV 副本。
+    """
+    ffmpeg = find_ffmpeg()
+    if not ffmpeg:
+        raise FFmpegError("未找到 ffmpeg")
+    spec = AUDIO_CODECS[codec]
+    channels = samples.shape[0]
+    cmd = [
+        ffmpeg, "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "f32le", "-ar", str(sample_rate), "-ac", str(channels), "-i", "pipe:0",
+        "-b:a", f"{bitrate_kbps}k",
+    ] + spec["args"] + [path]
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = _StderrCollector(process.stderr)
+    stderr.start()
+    try:
+        for start in range(0, samples.shape[1], chunk_frames):
+            process.stdin.write(np.ascontiguousarray(samples[:, start:start + chunk_frames].T).tobytes())
+    except BrokenPipeError:
+        pass
+    finally:
+        process.stdin.close()
+    if process.wait() != 0:
+        raise FFmpegError(f"ffmpeg 编码音频失败: {stderr.text()}")
+    return spec["mime"]
+
+
+def waveform_peaks(samples, bins=200):
+    """计算用于前端预览的波形峰值（0~1），长度为 bins"""
+    peaks = np.abs(samples).max(axis=0) if samples.size else np.zeros(0, dtype=np.float32)
+    if len(peaks) < bins:
+        peaks = np.pad(peaks, (0, bins - len(peaks)))
+    usable = len(peaks) - len(peaks) % bins
+    binned = peaks[:usable].reshape(bins, -1).max(axis=1)
+    return np.round(np.clip(binned, 0.0, 1.0).astype(np.float64), 3).tolist()
+
+
+def frame_select_filter(skip_first_frames=0, skip_frames=0):
+    """按帧序号选帧的 select 滤镜：跳过前 N 帧，之后每 skip_frames+1 帧取一帧"""
+    conditions = []
+    if skip_first_frames > 0:
+        conditions.append(f"gte(n\\,{skip_first_frames})")
+    if skip_frames > 0:
+        conditions.append(f"not(mod(n\\,{skip_frames + 1}))")
+    if not conditions:
+        return None
+    return f"select='{'*'.join(conditions)}'"
+
+
+def scale_filter(target_width=0, target_height=0, max_side=0):
+    """
+    解码时缩放的 scale 滤镜：同时指定宽高时缩放到该尺寸，只指定一边时按比例计算另一边，
+    max_side 限制长边（不放大）。缩放和转 rgb24 在同一次 swscale 中完成。
+    """
+    if target_width > 0 or target_height > 0:
+        width = target_width if target_width > 0 else -1
+        height = target_height if target_height > 0 else -1
+        return [f"scale={width}:{height}:flags=area", "format=rgb24"]
+    if max_side > 0:
+        return [f"scale=w='min(iw,{max_side})':h='min(ih,{max_side})':force_original_aspect_ratio=decrease:flags=area",
+                "format=rgb24"]
+    return ["format=rgb24"]
+
+
+def _read_ppm_frame(stream):
+    """从 image2pipe 输出中读取一帧 PPM（P6），返回 [高, 宽, 3] uint8 数组；流结束时返回 None"""
+    magic = stream.readline()
+    if not magic:
+        return None
+    if magic.strip() != b"P6":
+        raise FFmpegError("ffmpeg 输出不是 PPM 帧")
+    width, height = map(int, stream.readline().split())
+    stream.readline()  # 最大像素值，rgb24 固定为 255
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    view = memoryview(frame.reshape(-1))
+    filled = 0
+    while filled < len(view):
+        count = stream.readinto(view[filled:])
+        if not count:
+            raise FFmpegError("ffmpeg 输出提前结束")
+        filled += count
+    return frame
+
+
+def demux_video(path, video_filters=(), max_frames=0, sample_rate=44100, channels=2, with_audio=True):
+    """
+    用一个 ffmpeg 进程同时解码视频和音频：输入只读取一次，视频帧以 PPM 写到标准输出，
+    音频以 float32 WAV 写到临时文件，两路解码并行进行。
+    返回 (帧列表 [高, 宽, 3] uint8, ([声道, 采样] float32 数组, 采样率) 或 None)。
+    """
+    ffmpeg = find_ffmpeg()
+    if not ffmpeg:
+        raise FFmpegError("未找到 ffmpeg")
+    cmd = [ffmpeg, "-hide_banner", "-loglevel", "error", "-nostdin", "-i", path, "-map", "0:v:0"]
+    if video_filters:
+        cmd += ["-vf", ",".join(video_filters)]
+    cmd += ["-vsync", "passthrough"]
+    if max_frames > 0:
+        cmd += ["-frames:v", str(max_frames)]
+    cmd += ["-c:v", "ppm", "-f", "image2pipe", "pipe:1"]
+
+    audio_path = None
+    if with_audio:
+        fd, audio_path = tempfile.mkstemp(prefix="mxchat_", suffix=".wav")
+        os.close(fd)
+        cmd += ["-map", "0:a:0?"] + audio_output_args(sample_rate, channels) + ["-y", audio_path]
+
+    try:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stderr = _StderrCollector(process.stderr)
+        stderr.start()
+        frames = []
+        try:
+            while True:
+                frame = _read_ppm_frame(process.stdout)
+                if frame is None:
+                    break
+                frames.append(frame)
+        except FFmpegError as e:
+            process.kill()
+            process.wait()
+            raise FFmpegError(f"{str(e)}: {stderr.text()}")
+        finally:
+            process.stdout.close()
+        if process.wait() != 0:
+            message = stderr.text()
+            if with_audio and not frames and "does not contain any stream" in message:
+                # 输入没有音频流时音频输出无法创建，只解码视频
+                return demux_video(path, video_filters, max_frames, sample_rate, channels, with_audio=False)
+            raise FFmpegError(f"ffmpeg 解码视频失败: {message}")
+
+        audio = None
+        if audio_path and os.path.getsize(audio_path) > 0:
+            with open(audio_path, "rb") as f:
+                audio = read_wav_stream(f)
+        return frames, audio
+    finally:
+        if audio_path and os.path.exists(audio_path):
+            os.remove(audio_path)
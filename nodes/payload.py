@@ -0,0 +1,176 @@
+import base64
+import binascii
+import collections
+import contextlib
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+from ..media_store import MediaStore, is_media_ref
+
+# 解码块大小（base64 字符数，必须是 4 的倍数）
+_DECODE_CHUNK_CHARS = 4 * 64 * 1024
+# 超过该长度的字符串输入按内容哈希参与指纹，并按抽样键缓存哈希结果
+_HASH_MIN_CHARS = 1024
+# 抽样键取的片段数和每段长度：长度 + 首尾及均匀分布的片段，只读取几 KB
+_SAMPLE_SLICES = 16
+_SAMPLE_CHARS = 256
+# 缓存的哈希结果条数，只保存短摘要，不持有原字符串
+_HASH_MEMO_SIZE = 64
+
+_hash_memo = collections.OrderedDict()
+_hash_memo_lock = threading.Lock()
+
+
+def strip_data_url(data):
+    """移除 data URL 前缀（如 data:image/png;base64,），返回纯 base64 字符串"""
+    if data and 'base64,' in data[:256]:
+        return data.split('base64,', 1)[1]
+    return data
+
+
+class Base64Reader(io.RawIOBase):
+    """
+    按需解码 base64 字符串的只读流，避免一次性生成完整的字节副本。
+    可直接交给 pandas、PIL、ffmpeg 等按块读取的消费方。
+    """
+
+    def __init__(self, data):
+        super().__init__()
+        self._data = strip_data_url(data or "")
+        self._pos = 0
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        view = memoryview(b).cast('B')
+        wanted = len(view)
+        while len(self._buffer) < wanted and self._pos < len(self._data):
+            chars = max(_DECODE_CHUNK_CHARS, (wanted - len(self._buffer) + 2) // 3 * 4)
+            chunk = self._data[self._pos:self._pos + chars]
+            self._pos += len(chunk)
+            try:
+                self._buffer += base64.b64decode(chunk)
+            except binascii.Error as e:
+                raise ValueError(f"base64 数据无效: {str(e)}")
+        count = min(wanted, len(self._buffer))
+        view[:count] = self._buffer[:count]
+        self._buffer = self._buffer[count:]
+        return count
+
+    @property
+    def decoded_size(self):
+        """解码后的总字节数（根据字符数和填充计算，无需解码）"""
+        length = len(self._data)
+        padding = self._data[-2:].count('=') if length else 0
+        return length // 4 * 3 - padding
+
+
+def open_base64(data):
+    """返回带缓冲的附件字节流：内联 base64 按需解码，仓库引用（mxref:）直接打开对应文件"""
+    if is_media_ref(data):
+        return MediaStore.get_instance().open(data)
+    return io.BufferedReader(Base64Reader(data), buffer_size=256 * 1024)
+
+
+def read_payload_bytes(data):
+    """读取附件的完整字节内容，支持内联 base64 和仓库引用"""
+    if is_media_ref(data):
+        return MediaStore.get_instance().read_bytes(data)
+    return base64.b64decode(strip_data_url(data))
+
+
+def payload_size(data):
+    """附件解码后的字节数，根据 base64 长度计算，不做解码也不复制字符串"""
+    if is_media_ref(data):
+        return MediaStore.get_instance().size(data)
+    if not data:
+        return 0
+    start = data.find('base64,', 0, 256)
+    start = start + len('base64,') if start >= 0 else 0
+    padding = data[-2:].count('=')
+    return (len(data) - start) // 4 * 3 - padding
+
+
+def spool_base64(data, max_memory=16 * 1024 * 1024):
+    """
+    将 base64 数据解码到可随机访问的临时文件中（小文件留在内存，大文件落盘），
+    供 openpyxl 等需要 seek 的读取器使用。
+    """
+    if is_media_ref(data):
+        # 仓库中的文件本身即可随机访问
+        return MediaStore.get_instance().open(data)
+    spooled = tempfile.SpooledTemporaryFile(max_size=max_memory)
+    shutil.copyfileobj(open_base64(data), spooled, 1024 * 1024)
+    spooled.seek(0)
+    return spooled
+
+
+@contextlib.contextmanager
+def payload_path(data, suffix=""):
+    """
+    提供附件在磁盘上的路径，供 ffmpeg 等需要文件（可 seek）的工具使用：
+    仓库引用直接使用仓库文件，内联 base64 则流式解码到临时文件，用完删除。
+    """
+    if is_media_ref(data):
+        yield MediaStore.get_instance().path_for(data)
+        return
+    fd, temp_path = tempfile.mkstemp(prefix="mxchat_", suffix=suffix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(open_base64(data), f, 1024 * 1024)
+        yield temp_path
+    finally:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+
+
+def _sample_key(value):
+    """长度加均匀抽样片段的哈希，计算量与字符串长度无关"""
+    length = len(value)
+    step = max((length - _SAMPLE_CHARS) // (_SAMPLE_SLICES - 1), 1)
+    sampler = hashlib.blake2b(digest_size=16)
+    for start in range(0, length, step)[:_SAMPLE_SLICES - 1]:
+        sampler.update(value[start:start + _SAMPLE_CHARS].encode('utf-8'))
+    sampler.update(value[-_SAMPLE_CHARS:].encode('utf-8'))
+    return length, sampler.digest()
+
+
+def _hash_value(value):
+    # 每次提交的提示词都重新解析 JSON，同一附件是新的字符串对象，因此按抽样键而不是字符串本身缓存
+    key = _sample_key(value)
+    with _hash_memo_lock:
+        cached = _hash_memo.get(key)
+        if cached is not None:
+            _hash_memo.move_to_end(key)
+            return cached
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).hexdigest()
+    with _hash_memo_lock:
+        _hash_memo[key] = digest
+        while len(_hash_memo) > _HASH_MEMO_SIZE:
+            _hash_memo.popitem(last=False)
+    return digest
+
+
+def content_fingerprint(**inputs):
+    """
+    为节点输入计算稳定的内容指纹，供 IS_CHANGED 使用。
+    附件仓库引用本身就是内容哈希，直接使用；大体积的内联附件按抽样键缓存完整哈希，重复提交时不再整体计算。
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for name in sorted(inputs):
+        value = inputs[name]
+        if is_media_ref(value):
+            part = value
+        elif isinstance(value, str) and len(value) >= _HASH_MIN_CHARS:
+            part = _hash_value(value)
+        else:
+            part = repr(value)
+        digest.update(f"{name}={part}\0".encode('utf-8'))
+    return digest.hexdigest()
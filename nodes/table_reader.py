@@ -0,0 +1,294 @@
+import math
+from collections import deque
+
+from .lazy import lazy_import
+from .payload import open_base64, spool_base64
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+CSV_TYPES = ('text/csv',)
+XLSX_TYPES = ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',)
+XLS_TYPES = ('application/vnd.ms-excel',)
+SAMPLE_MODES = ["head_tail", "head", "tail", "stratified"]
+
+# 单元格展示的最大字符数，避免个别超长文本撑爆提示词
+MAX_CELL_CHARS = 64
+# 去重计数最多跟踪的取值个数，超过后只报告下限
+MAX_DISTINCT_TRACKED = 10000
+
+
+class _ColumnStats:
+    """按块累积的单列统计量，全部使用向量化运算"""
+
+    def __init__(self):
+        self.count = 0
+        self.nulls = 0
+        self.numeric = True
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.distinct = set()
+        self.distinct_overflow = False
+
+    def update(self, series):
+        nulls = int(series.isna().sum())
+        self.nulls += nulls
+        self.count += len(series) - nulls
+        values = series.dropna()
+        if values.empty:
+            return
+        if self.numeric and pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            arr = values.to_numpy(dtype=np.float64)
+            self.total += float(arr.sum())
+            self.total_sq += float(np.square(arr).sum())
+            lo, hi = float(arr.min()), float(arr.max())
+            self.minimum = lo if self.minimum is None else min(self.minimum, lo)
+            self.maximum = hi if self.maximum is None else max(self.maximum, hi)
+        else:
+            self.numeric = False
+        if not self.distinct_overflow:
+            self.distinct.update(values.astype(str).unique().tolist())
+            if len(self.distinct) > MAX_DISTINCT_TRACKED:
+                self.distinct_overflow = True
+                self.distinct = set()
+
+    def as_row(self, name):
+        row = {
+            "列": name,
+            "非空": self.count,
+            "缺失": self.nulls,
+            "去重数": f">{MAX_DISTINCT_TRACKED}" if self.distinct_overflow else len(self.distinct),
+        }
+        if self.numeric and self.count:
+            mean = self.total / self.count
+            variance = max(self.total_sq / self.count - mean * mean, 0.0)
+            row.update({
+                "最小值": _format_number(self.minimum),
+                "最大值": _format_number(self.maximum),
+                "均值": _format_number(mean),
+                "标准差": _format_number(math.sqrt(variance)),
+            })
+        return row
+
+
+class _StratifiedSampler:
+    """
+    在总行数未知的情况下做等间隔抽样：候选超过 2 * budget 行时步长翻倍并丢弃一半，
+    因此候选始终在 budget 到 2 * budget 行之间，最后再从中等间隔取出 budget 行，结果覆盖整个文件。
+    """
+
+    def __init__(self, budget):
+        self.budget = max(budget, 1)
+        self.capacity = 2 * self.budget
+        self.stride = 1
+        self.parts = []
+        self.size = 0
+
+    def update(self, chunk):
+        picked = chunk[chunk.index.to_numpy() % self.stride == 0]
+        if not picked.empty:
+            self.parts.append(picked)
+            self.size += len(picked)
+        while self.size > self.capacity:
+            self.stride *= 2
+            kept = [part[part.index.to_numpy() % self.stride == 0] for part in self.parts]
+            self.parts = [part for part in kept if not part.empty]
+            self.size = sum(len(part) for part in self.parts)
+
+    def result(self):
+        if not self.parts:
+            return None
+        sample = pd.concat(self.parts)
+        if len(sample) <= self.budget:
+            return sample
+        positions = np.linspace(0, len(sample) - 1, self.budget).round().astype(int)
+        return sample.iloc[positions]
+
+
+class TableSummary:
+    """分块读取后的表格摘要：总行列数、抽样行和列统计"""
+
+    def __init__(self, columns, total_columns):
+        self.columns = columns
+        self.total_columns = total_columns
+        self.total_rows = 0
+        self.sample = None
+        self.stats = None
+
+    @property
+    def sampled_rows(self):
+        return 0 if self.sample is None else len(self.sample)
+
+
+def _format_number(value):
+    if value is None:
+        return ""
+    if float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return f"{value:.4g}"
+
+
+def _iter_csv_chunks(table_data, columns, chunk_rows):
+    reader = pd.read_csv(open_base64(table_data), usecols=columns, chunksize=chunk_rows)
+    for chunk in reader:
+        yield chunk[columns]
+
+
+def _iter_xlsx_chunks(table_data, max_columns, chunk_rows):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(spool_base64(table_data), read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        total_columns = len(header)
+        names = [str(h) if h is not None else f"Unnamed: {i}" for i, h in enumerate(header)][:max_columns]
+        yield total_columns, names
+        batch = []
+        for row in rows:
+            batch.append(row[:len(names)])
+            if len(batch) >= chunk_rows:
+                yield pd.DataFrame(batch, columns=names)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=names)
+    finally:
+        workbook.close()
+
+
+def read_table(table_data, file_type, max_rows=200, max_columns=50, sample_mode="head_tail",
+               include_stats=True, chunk_rows=50000):
+    """
+    分块读取 CSV/Excel 表格，只保留 max_rows 行样本和按列累积的统计量，
+    内存占用与块大小和预算相关，而不是与文件大小相关。
+    """
+    if file_type in CSV_TYPES:
+        header = pd.read_csv(open_base64(table_data), nrows=0)
+        total_columns = len(header.columns)
+        columns = list(header.columns[:max_columns])
+        chunks = _iter_csv_chunks(table_data, columns, chunk_rows)
+    elif file_type in XLSX_TYPES:
+        chunks = _iter_xlsx_chunks(table_data, max_columns, chunk_rows)
+        first = next(chunks, None)
+        if first is None:
+            return TableSummary([], 0)
+        total_columns, columns = first
+    elif file_type in XLS_TYPES:
+        # 旧版 .xls 为二进制复合文档，无法流式读取，只能整体加载后再套用同样的预算
+        frame = pd.read_excel(spool_base64(table_data))
+        total_columns = len(frame.columns)
+        columns = list(frame.columns[:max_columns])
+        chunks = (frame.iloc[i:i + chunk_rows][columns] for i in range(0, len(frame), chunk_rows))
+    else:
+        raise ValueError(f"不支持的文件类型: {file_type}")
+
+    summary = TableSummary(columns, total_columns)
+    head_budget = max_rows if sample_mode == "head" else (max_rows + 1) // 2 if sample_mode == "head_tail" else 0
+    tail_budget = max_rows if sample_mode == "tail" else max_rows // 2 if sample_mode == "head_tail" else 0
+    head_parts, head_size = [], 0
+    tail_parts, tail_size = deque(), 0
+    sampler = _StratifiedSampler(max_rows) if sample_mode == "stratified" else None
+    stats = {name: _ColumnStats() for name in columns} if include_stats else None
+
+    for chunk in chunks:
+        offset = summary.total_rows
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        summary.total_rows += len(chunk)
+        if head_size < head_budget:
+            part = chunk.iloc[:head_budget - head_size].copy()
+            head_parts.append(part)
+            head_size += len(part)
+        if tail_budget:
+            tail_parts.append(chunk.iloc[-tail_budget:].copy())
+            tail_size += len(tail_parts[-1])
+            while tail_parts and tail_size - len(tail_parts[0]) >= tail_budget:
+                tail_size -= len(tail_parts.popleft())
+        if sampler is not None:
+            sampler.update(chunk)
+        if stats is not None:
+            for name in columns:
+                stats[name].update(chunk[name])
+        elif head_size >= head_budget and not tail_budget and sampler is None:
+            # 只取开头几行且不需要统计时，可以提前结束读取（总行数仅统计到此处）
+            summary.total_rows = None
+            break
+
+    parts = head_parts
+    if tail_parts:
+        tail = pd.concat(list(tail_parts)).iloc[-tail_budget:]
+        if head_parts:
+            tail = tail[tail.index >= head_size]
+        parts = parts + [tail]
+    if sampler is not None:
+        sampled = sampler.result()
+        parts = [sampled] if sampled is not None else []
+    parts = [part for part in parts if not part.empty]
+    if parts:
+        summary.sample = pd.concat(parts)
+    if stats is not None:
+        summary.stats = pd.DataFrame([stats[name].as_row(name) for name in columns]).fillna("")
+    return summary
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：ASCII 约 4 字符 1 个 token，中文等多字节字符约 1 字符 1 个 token"""
+    wide_chars = (len(text.encode('utf-8')) - len(text)) // 2
+    return (len(text) - wide_chars) // 4 + wide_chars
+
+
+def _clip_cells(frame):
+    clipped = frame.copy()
+    for name in clipped.columns:
+        if clipped[name].dtype == object:
+            clipped[name] = clipped[name].map(
+                lambda v: v[:MAX_CELL_CHARS] + "…" if isinstance(v, str) and len(v) > MAX_CELL_CHARS else v
+            )
+    return clipped
+
+
+def _stats_markdown(stats, count):
+    if stats is None or count == 0:
+        return ""
+    note = "" if count >= len(stats) else f"（仅列出前 {count} 列）"
+    return f"\n\n列统计{note}:\n\n{stats.iloc[:count].to_markdown(index=False)}"
+
+
+def summary_to_markdown(summary, file_name, max_tokens=8000):
+    """将表格摘要渲染为 Markdown，超过 token 预算时先逐步减半样本行数，再减半列统计，最后截断"""
+    if summary.total_rows is None:
+        shape = f"至少 {summary.sampled_rows} 行 × {summary.total_columns} 列"
+    else:
+        shape = f"共 {summary.total_rows} 行 × {summary.total_columns} 列"
+    if len(summary.columns) < summary.total_columns:
+        shape += f"（仅保留前 {len(summary.columns)} 列）"
+
+    stats = summary.stats if summary.stats is not None and not summary.stats.empty else None
+    stats_rows = 0 if stats is None else len(stats)
+
+    sample = _clip_cells(summary.sample) if summary.sample is not None else None
+    rows = summary.sampled_rows
+    while True:
+        if sample is None or rows == 0:
+            body, note = "（无样本行）", ""
+        else:
+            # 缩减时保留样本首尾各一半，兼顾表头附近和末尾的数据
+            shown = sample if rows >= len(sample) else pd.concat(
+                [sample.iloc[:(rows + 1) // 2], sample.iloc[len(sample) - rows // 2:]]
+            )
+            body = shown.to_markdown(index=False)
+            complete = summary.total_rows is not None and rows >= summary.total_rows
+            note = "" if complete else f"，展示 {rows} 行样本"
+        message = f"文件名: {file_name or '未命名'}\n\n{shape}{note}\n\n{body}{_stats_markdown(stats, stats_rows)}"
+        if estimate_tokens(message) <= max_tokens:
+            return message
+        if rows > 0:
+            rows //= 2
+        elif stats_rows > 0:
+            stats_rows //= 2
+        else:
+            # 每个字符至少按 1/4 个 token 估算、至多 1 个，截断到 max_tokens 个字符一定不超出预算
+            return message[:max_tokens]
@@ -1,8 +1,9 @@
-import base64
-import pandas as pd
-from io import BytesIO
 import logging
-from server import PromptServer
+from ..delivery import DeliveryService
+from ..metrics import NODE_PAYLOAD_BYTES
+from ..tracing import phase, traced
+from .payload import content_fingerprint, payload_size
+from .table_reader import SAMPLE_MODES, read_table, summary_to_markdown
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +30,16 @@ class MXChatTableSendNode:
                     "hidden": True,
                     "dynamicPrompts": False
                 }),
+            },
+            "optional": {
+                "max_rows": ("INT", {"default": 200, "min": 1, "max": 100000, "step": 1, "display": "样本行数上限"}),
+                "max_columns": ("INT", {"default": 50, "min": 1, "max": 1000, "step": 1, "display": "列数上限"}),
+                "sample_mode": (SAMPLE_MODES, {"default": "head_tail"}),
+                "include_stats": ("BOOLEAN", {"default": False}),
+                "max_tokens": ("INT", {"default": 8000, "min": 256, "max": 200000, "step": 256, "display": "输出 token 上限（估算）"}),
+            },
+            "hidden": {
+                "extra_pnginfo": "EXTRA_PNGINFO",
             }
         }
 
@@ -38,7 +49,9 @@ class MXChatTableSendNode:
     CATEGORY = "Agentpark/SendNode"
     OUTPUT_NODE = True  # 标记为输出节点，以便触发前端消息
 
-    def execute(self, table_data=None, file_type=None, file_name=None):
+    @traced
+    def execute(self, table_data=None, file_type=None, file_name=None, max_rows=200, max_columns=50,
+                sample_mode="head_tail", include_stats=False, max_tokens=8000):
         try:
             # 验证表格数据
             if not table_data:
@@ -46,31 +59,29 @@ class MXChatTableSendNode:
                 self.send_error("表格数据为空")
                 return ("表格数据为空",)
 
-            # 解码 Base64 数据
-            table_bytes = base64.b64decode(table_data)
-            table_io = BytesIO(table_bytes)
-
-            # 根据文件类型读取表格
-            if file_type == 'text/csv':
-                df = pd.read_csv(table_io)
-            elif file_type in ['application/vnd.ms-excel', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet']:
-                df = pd.read_excel(table_io)
-            else:
-                error_msg = f"不支持的文件类型: {file_type}"
+            # 分块读取表格，只保留样本行和列统计，避免大表整体加载
+            NODE_PAYLOAD_BYTES.labels("MXChatTableSendNode", "in").observe(payload_size(table_data))
+            try:
+                with phase("MXChatTableSendNode", "read"):
+                    summary = read_table(table_data, file_type, max_rows=max_rows, max_columns=max_columns,
+                                         sample_mode=sample_mode, include_stats=include_stats)
+            except ValueError as e:
+                error_msg = str(e)
                 logger.error(f"[MXChatTableSendNode] {error_msg}")
                 self.send_error(error_msg)
                 return (error_msg,)
 
             # 检查表格是否为空
-            if df.empty:
+            if summary.total_rows == 0 or not summary.columns:
                 logger.warning("[MXChatTableSendNode] 表格内容为空")
                 self.send_error("表格内容为空")
                 return ("表格内容为空",)
 
-            # 将表格转换为 Markdown 格式
-            table_md = df.to_markdown(index=False)
-            message = f"文件名: {file_name or '未命名'}\n\n{table_md}"
-     
+            # 将表格样本和统计转换为 Markdown 格式，并控制输出长度
+            with phase("MXChatTableSendNode", "render"):
+                message = summary_to_markdown(summary, file_name, max_tokens=max_tokens)
+            logger.info(f"[MXChatTableSendNode] 表格处理完成，总行数: {summary.total_rows}，样本行数: {summary.sampled_rows}")
+
             return (message,)
         except Exception as e:
             error_msg = f"[MXChatTableSendNode] 处理表格文件失败: {str(e)}"
@@ -80,7 +91,7 @@ class MXChatTableSendNode:
 
     def send_error(self, error_msg):
         """发送错误消息到前端"""
-        PromptServer.instance.send_sync("mx-chat-message", {
+        DeliveryService.get_instance().send({
             "text": f"错误: {error_msg}",
             "isUser": False,
             "sender": "牧小新",
@@ -89,5 +100,6 @@ class MXChatTableSendNode:
         })
 
     @classmethod
-    def IS_CHANGED(cls, table_data, file_type, file_name):
-        return True  # 每次执行都重新计算，确保数据最新
\ No newline at end of file
+    def IS_CHANGED(cls, table_data, file_type, file_name, **kwargs):
+        # 以表格内容哈希作为变化标记，内容不变时无需重新解析
+        return content_fingerprint(table_data=table_data, file_type=file_type, file_name=file_name, **kwargs)
\ No newline at end of file
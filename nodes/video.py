@@ -1,15 +1,19 @@
-import cv2
-import torch
-import numpy as np
-import tempfile
 import uuid
 import os
-import shutil
-import subprocess
+import threading
 import traceback
-import torchaudio
 from server import PromptServer
+from ..delivery import DeliveryService
 from ..logger import MXLogger
+from ..metrics import NODE_PAYLOAD_BYTES
+from ..tracing import current_trace_id, phase, traced, use_trace
+from ..retention import RetentionManager
+from ..settings import SettingsManager
+from ..routes import StreamRegistry
+from .lazy import lazy_import
+from .video_encode import encode_video, encode_video_segmented
+
+torch = lazy_import("torch")
 
 logger = MXLogger.get_instance()
 
@@ -22,6 +26,12 @@ class MXChatVideoReceiveNode:
             },
             "optional": {
                 "audio": ("AUDIO", {"forceInput": True}),
+                "fps": ("FLOAT", {"default": 30.0, "min": 1.0, "max": 120.0, "step": 1.0}),
+                "streaming": ("BOOLEAN", {"default": False, "label_on": "边编码边播放", "label_off": "编码完成后发送"}),
+                "encode_workers": ("INT", {"default": 0, "min": 0, "max": 256, "step": 1, "display": "并行编码进程数 (0=使用设置)"}),
+            },
+            "hidden": {
+                "extra_pnginfo": "EXTRA_PNGINFO",
             }
         }
     
@@ -30,7 +40,8 @@ class MXChatVideoReceiveNode:
     OUTPUT_NODE = True
     CATEGORY = "Agentpark/ReceiveNode"
 
-    def execute(self, video, audio=None):
+    @traced
+    def execute(self, video, audio=None, fps=30.0, streaming=False, encode_workers=0):
         try:
             logger.info("[MXChatVideoReceiveNode] 开始处理接收到的视频数据")
             
@@ -38,126 +49,29 @@ class MXChatVideoReceiveNode:
                 logger.error("[MXChatVideoReceiveNode] 输入视频为空或无效")
                 return self._return_default()
             
-            if len(video.shape) != 4:
+            if len(video.shape) != 4 or video.shape[-1] != 3:
                 logger.error(f"[MXChatVideoReceiveNode] 输入视频形状无效: {video.shape}")
                 return self._return_default()
-            
-            num_frames, height, width, channels = video.shape
-          
-            
-            # 调整分辨率到最大 1920x1080
-            max_width, max_height = 1920, 1080
-            if width > max_width or height > max_height:
-                scale = min(max_width / width, max_height / height)
-                new_width, new_height = int(width * scale), int(height * scale)
-                logger.info(f"调整分辨率从 {width}x{height} 到 {new_width}x{new_height}")
-            else:
-                new_width, new_height = width, height
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_file:
-                temp_file_path = temp_file.name
-            temp_avi_path = temp_file_path.replace('.mp4', '.avi')
-            
-            fourcc = cv2.VideoWriter_fourcc(*'MJPG')  # type: ignore
-            out = cv2.VideoWriter(temp_avi_path, fourcc, 30.0, (new_width, new_height), True)
-            if not out.isOpened():
-                logger.error("[MXChatVideoReceiveNode] 视频编码器初始化失败，尝试使用 XVID")
-                fourcc = cv2.VideoWriter_fourcc(*'XVID')  # type: ignore
-                out = cv2.VideoWriter(temp_avi_path, fourcc, 30.0, (new_width, new_height), True)
-                if not out.isOpened():
-                    raise Exception("视频编码器初始化失败（MJPG 和 XVID 均不可用）")
-            
-            for i in range(num_frames):
-                frame = video[i].cpu().numpy()
-                frame = np.clip(frame, 0, 1) * 255
-                frame = frame.astype(np.uint8)
-                if frame.shape[-1] != 3:
-                    logger.error(f"[MXChatVideoReceiveNode] 帧 {i} 的通道数不正确: {frame.shape}")
-                    continue
-                if new_width != width or new_height != height:
-                    frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
-                frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-                out.write(frame)
-            
-            out.release()
-            
-            # 检查 AVI 文件是否有效
-            if os.path.getsize(temp_avi_path) < 1024:  # 小于 1KB，可能为空
-                logger.error(f"[MXChatVideoReceiveNode] 生成的 AVI 文件可能为空，大小: {os.path.getsize(temp_avi_path)} 字节")
-            
-            # 如果有音频数据，将其保存为临时文件
-            temp_audio_path = None
-            if audio is not None and isinstance(audio, dict) and 'waveform' in audio and 'sample_rate' in audio:
-                try:
-                    logger.info("[MXChatVideoReceiveNode] 处理音频数据")
-                    waveform = audio['waveform']
-                    sample_rate = audio['sample_rate']
-                    
-                    # 确保波形是正确的形状
-                    if waveform.dim() == 3:  # [batch, channels, samples]
-                        waveform = waveform.squeeze(0)  # 移除批次维度，变为 [channels, samples]
-                    
-                    # 创建临时音频文件
-                    temp_audio_path = temp_file_path.replace('.mp4', '.wav')
-                    torchaudio.save(temp_audio_path, waveform, sample_rate)
-                    logger.info(f"[MXChatVideoReceiveNode] 音频数据已保存到临时文件: {temp_audio_path}")
-                    
-                    # 检查音频文件是否有效
-                    if os.path.getsize(temp_audio_path) < 1024:  # 小于 1KB，可能为空
-                        logger.warning(f"[MXChatVideoReceiveNode] 生成的音频文件可能为空，大小: {os.path.getsize(temp_audio_path)} 字节")
-                        temp_audio_path = None
-                except Exception as e:
-                    logger.error(f"[MXChatVideoReceiveNode] 处理音频数据失败: {str(e)}")
-                    logger.error(traceback.format_exc())
-                    temp_audio_path = None
-            
-            # 根据是否有音频数据选择不同的ffmpeg命令
-            if temp_audio_path:
-                logger.info("[MXChatVideoReceiveNode] 合并视频和音频")
-                subprocess.run(
-                    ['ffmpeg', '-i', temp_avi_path, '-i', temp_audio_path, '-c:v', 'libx264', 
-                     '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-y', temp_file_path],
-                    check=True, capture_output=True
-                )
-            else:
-                logger.info("[MXChatVideoReceiveNode] 仅处理视频数据，无音频")
-                subprocess.run(
-                    ['ffmpeg', '-i', temp_avi_path, '-c:v', 'libx264', '-preset', 'ultrafast', 
-                     '-pix_fmt', 'yuv420p', '-y', temp_file_path],
-                    check=True, capture_output=True
-                )
-            
-            # 保存到 ComfyUI/output 目录
+
+            if audio is not None and not (isinstance(audio, dict) and 'waveform' in audio and 'sample_rate' in audio):
+                logger.warning("[MXChatVideoReceiveNode] 音频数据无效，仅处理视频")
+                audio = None
+
+            # 直接编码到 ComfyUI/output 目录，分辨率限制在 1920x1080 以内
             comfyui_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
             output_dir = os.path.join(comfyui_root, 'output')
             os.makedirs(output_dir, exist_ok=True)
             filename = f'{uuid.uuid4()}.mp4'
             target_path = os.path.join(output_dir, filename)
-            shutil.copy2(temp_file_path, target_path)
-            if not os.path.exists(target_path):
-                logger.error(f"[MXChatVideoReceiveNode] 视频文件未正确生成: {target_path}")
-                raise Exception("视频文件生成失败")
-            elif os.path.getsize(target_path) < 1024:  # 检查 MP4 文件大小
-                logger.error(f"[MXChatVideoReceiveNode] 生成的 MP4 文件可能无效，大小: {os.path.getsize(target_path)} 字节")
+
+            # 编码交给后台投递线程，节点直接返回；帧张量同时是节点输出，ComfyUI 不会原地修改
+            session = PromptServer.instance.client_id
+            if streaming:
+                build = lambda: self._build_streaming(video, audio, fps, target_path, session)
             else:
-                logger.info(f"[MXChatVideoReceiveNode] 视频文件成功保存: {target_path}")
-            
-            video_url = f"/view?filename={filename}"
-          
-            
-            PromptServer.instance.send_sync("mx-chat-message", {
-                "text": "这是生成的视频",
-                "isUser": False,
-                "sender": "牧小新",
-                "videoData": [{"fileType": "video/mp4", "videoUrl": video_url}],
-                "mode": "agent",
-                "format": "markdown"
-            })
-            logger.info("[MXChatVideoReceiveNode] 视频已发送到前端")
-            
-    
-          
-            
+                build = lambda: self._build_file(video, audio, fps, target_path, encode_workers, session)
+            DeliveryService.get_instance().submit(build, record=True, files=[target_path])
+            logger.info("[MXChatVideoReceiveNode] 视频已提交后台编码")
             return (video,)
         
         except Exception as e:
@@ -166,6 +80,84 @@ class MXChatVideoReceiveNode:
             logger.error(traceback.format_exc())
             return self._return_default()
 
+    def _encode_file(self, video, audio, fps, target_path, encode_workers):
+        """长视频按 GOP 分段并行编码后拼接，短视频用单个 ffmpeg 进程"""
+        settings = SettingsManager.get_instance().section('video_encode')
+        workers = encode_workers or settings.get('workers', 0) or os.cpu_count() or 1
+        if workers > 1 and video.shape[0] >= settings.get('segment_min_frames', 600):
+            segments = encode_video_segmented(video, target_path, fps=fps, audio=audio, workers=workers,
+                                              gop_seconds=settings.get('gop_seconds', 2.0))
+            logger.info(f"[MXChatVideoReceiveNode] 分段并行编码完成，共 {segments} 段")
+        else:
+            encode_video(video, target_path, fps=fps, audio=audio)
+
+    def _build_file(self, video, audio, fps, target_path, encode_workers, session):
+        """在投递线程中编码完整文件，完成后返回消息"""
+        try:
+            with phase("MXChatVideoReceiveNode", "encode"):
+                self._encode_file(video, audio, fps, target_path, encode_workers)
+        except Exception as e:
+            self._encode_failed(e, target_path)
+            return None
+        self._register_output(target_path, session)
+        return self._video_message(f"/view?filename={os.path.basename(target_path)}", "这是生成的视频")
+
+    def _build_streaming(self, video, audio, fps, target_path, session):
+        """
+        输出分片 MP4：编码在单独的线程中进行，第一个分片写出后投递线程就返回流式地址，
+        前端在编码继续时开始播放，后续消息不必等整段视频编码完成。
+        """
+        filename = os.path.basename(target_path)
+        first_fragment = threading.Event()
+        trace_id = current_trace_id()
+        StreamRegistry.open(filename)
+
+        def run():
+            try:
+                with use_trace(trace_id), phase("MXChatVideoReceiveNode", "stream_encode"):
+                    encode_video(video, target_path, fps=fps, audio=audio, fragmented=True,
+                                 on_first_fragment=first_fragment.set)
+                self._register_output(target_path, session)
+            except Exception as e:
+                self._encode_failed(e, target_path)
+            finally:
+                StreamRegistry.finish(filename)
+                first_fragment.set()
+
+        thread = threading.Thread(target=run, name="mx-video-stream", daemon=True)
+        thread.start()
+        first_fragment.wait()
+        if not os.path.exists(target_path):
+            # 第一个分片写出前编码就失败了
+            return None
+        return self._video_message(f"/mx/stream/{filename}", "视频生成中，可边编码边播放", streaming=True)
+
+    @staticmethod
+    def _register_output(target_path, session):
+        size = os.path.getsize(target_path)
+        logger.info(f"[MXChatVideoReceiveNode] 视频文件成功保存: {target_path}，大小 {size} 字节")
+        NODE_PAYLOAD_BYTES.labels("MXChatVideoReceiveNode", "out").observe(size)
+        # 登记到输出索引，由后台按配额和保存时间清理；提交本次任务的会话仍在线时不会被清理
+        RetentionManager.get_instance().register(target_path, "video", session=session)
+
+    @staticmethod
+    def _encode_failed(error, target_path):
+        if os.path.exists(target_path):
+            os.remove(target_path)
+        logger.error(f"[MXChatVideoReceiveNode] 视频编码失败: {str(error)}")
+        logger.error(traceback.format_exc())
+
+    @staticmethod
+    def _video_message(video_url, text, streaming=False):
+        return {
+            "text": text,
+            "isUser": False,
+            "sender": "牧小新",
+            "videoData": [{"fileType": "video/mp4", "videoUrl": video_url, "streaming": streaming}],
+            "mode": "agent",
+            "format": "markdown"
+        }
+
     def _return_default(self):
         default_video = torch.zeros((1, 64, 64, 3), dtype=torch.float32)
-        return (default_video,)
\ No newline at end of file
+        return (default_video,)
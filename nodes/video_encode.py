@@ -0,0 +1,191 @@
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from .lazy import lazy_import
+from .media_io import FFmpegError, _StderrCollector, find_ffmpeg
+
+np = lazy_import("numpy")
+torch = lazy_import("torch")
+
+# 每次从帧张量转换并写入 ffmpeg 的帧数
+FEED_BATCH_FRAMES = 8
+
+
+def first_fragment_ready(path):
+    """检查分片 MP4 是否已写出第一个完整分片（moov 之后的第一个 moof + mdat）"""
+    try:
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            offset = 0
+            while offset + 8 <= size:
+                f.seek(offset)
+                box_size, box_type = struct.unpack(">I4s", f.read(8))
+                if box_size == 1:
+                    box_size = struct.unpack(">Q", f.read(8))[0]
+                if box_size < 8:
+                    return False
+                if box_type == b"mdat":
+                    return offset + box_size <= size
+                offset += box_size
+    except (OSError, struct.error):
+        pass
+    return False
+
+
+def _write_audio_input(audio):
+    """把 AUDIO 写成交织的 float32 原始数据临时文件，作为 ffmpeg 的第二路输入"""
+    waveform = audio["waveform"]
+    if waveform.dim() == 3:  # [batch, channels, samples]
+        waveform = waveform[0]
+    samples = waveform.detach().to(device="cpu", dtype=torch.float32).numpy()
+    fd, path = tempfile.mkstemp(prefix="mxchat_", suffix=".f32")
+    with os.fdopen(fd, "wb") as f:
+        np.ascontiguousarray(samples.T).tofile(f)
+    return path, samples.shape[0], int(audio["sample_rate"])
+
+
+def _video_input_args(width, height, fps):
+    return ["-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "pipe:0"]
+
+
+def _video_codec_args(max_size, threads=None):
+    """缩放到 max_size 以内并编码为 H.264 yuv420p"""
+    max_width, max_height = max_size
+    args = ["-vf", f"scale=w='min(iw,{max_width})':h='min(ih,{max_height})':force_original_aspect_ratio=decrease"
+                   f":force_divisible_by=2:flags=area",
+            "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p"]
+    if threads:
+        args += ["-threads", str(threads)]
+    return args
+
+
+def _feed_frames(process, video, after_batch=None):
+    """按批把帧张量转换为 rgb24 字节写入 ffmpeg 标准输入"""
+    try:
+        for start in range(0, video.shape[0], FEED_BATCH_FRAMES):
+            batch = video[start:start + FEED_BATCH_FRAMES]
+            process.stdin.write((batch.clamp(0, 1) * 255).to(torch.uint8).cpu().numpy().tobytes())
+            if after_batch:
+                after_batch()
+    except BrokenPipeError:
+        pass
+    finally:
+        process.stdin.close()
+
+
+def _run(cmd, feed=None):
+    """运行 ffmpeg；feed 不为空时由它向标准输入写数据"""
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE if feed else subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = _StderrCollector(process.stderr)
+    stderr.start()
+    if feed:
+        feed(process)
+    if process.wait() != 0:
+        raise FFmpegError(f"ffmpeg 编码视频失败: {stderr.text()}")
+
+
+def encode_video(video, path, fps=30.0, audio=None, max_size=(1920, 1080), fragmented=False,
+                 fragment_seconds=1.0, on_first_fragment=None):
+    """
+    把 [帧, 高, 宽, 3] 的帧张量通过标准输入送入 ffmpeg，直接编码为 H.264 MP4。
+    缩放到 max_size 以内、转 yuv420p 和混入音频都在同一个 ffmpeg 进程中完成。
+    fragmented 为 True 时输出分片 MP4，第一个分片写出后调用 on_first_fragment，
+    播放器可以在编码继续进行时开始播放。
+    """
+    ffmpeg = find_ffmpeg()
+    if not ffmpeg:
+        raise FFmpegError("未找到 ffmpeg")
+    num_frames, height, width, _ = video.shape
+
+    cmd = [ffmpeg, "-hide_banner", "-loglevel", "error", "-y"] + _video_input_args(width, height, fps)
+    audio_path = None
+    if audio is not None:
+        audio_path, channels, sample_rate = _write_audio_input(audio)
+        cmd += ["-f", "f32le", "-ar", str(sample_rate), "-ac", str(channels), "-i", audio_path]
+    cmd += ["-map", "0:v:0"] + (["-map", "1:a:0", "-c:a", "aac"] if audio_path else [])
+    cmd += _video_codec_args(max_size)
+    if fragmented:
+        # 固定关键帧间隔，每个关键帧开始一个分片
+        gop = max(1, int(round(fps * fragment_seconds)))
+        cmd += ["-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0",
+                "-movflags", "frag_keyframe+empty_moov+default_base_moof"]
+    else:
+        cmd += ["-movflags", "+faststart"]
+    cmd += ["-f", "mp4", path]
+
+    state = {"announced": not (fragmented and on_first_fragment)}
+
+    def check_fragment():
+        if not state["announced"] and first_fragment_ready(path):
+            on_first_fragment()
+            state["announced"] = True
+
+    try:
+        _run(cmd, lambda process: _feed_frames(process, video, check_fragment))
+        if not state["announced"]:
+            # 视频短于一个分片时，编码结束后再通知
+            on_first_fragment()
+    finally:
+        if audio_path and os.path.exists(audio_path):
+            os.remove(audio_path)
+
+
+def plan_segments(num_frames, workers, gop):
+    """把帧序列切成按 GOP 对齐的连续分段，分段数不超过 workers，返回 [(起始帧, 结束帧)]"""
+    per_segment = -(-num_frames // max(1, workers))
+    per_segment = max(gop, -(-per_segment // gop) * gop)
+    return [(start, min(start + per_segment, num_frames)) for start in range(0, num_frames, per_segment)]
+
+
+def encode_video_segmented(video, path, fps=30.0, audio=None, max_size=(1920, 1080), workers=None,
+                           gop_seconds=2.0):
+    """
+    分段并行编码：帧序列按 GOP 对齐切分，每段由独立的 ffmpeg 进程编码，
+    最后用 concat 无损拼接并混入音频。每个分段都从关键帧开始，拼接时不需要重新编码。
+    """
+    ffmpeg = find_ffmpeg()
+    if not ffmpeg:
+        raise FFmpegError("未找到 ffmpeg")
+    num_frames, height, width, _ = video.shape
+    workers = workers or os.cpu_count() or 1
+    gop = max(1, int(round(fps * gop_seconds)))
+    segments = plan_segments(num_frames, workers, gop)
+    # 各进程平分 CPU，避免 x264 线程数超过核心数
+    threads = max(1, (os.cpu_count() or 1) // len(segments))
+
+    work_dir = tempfile.mkdtemp(prefix="mxchat_segments_")
+    audio_path = None
+    try:
+        def encode_segment(index):
+            start, end = segments[index]
+            segment_path = os.path.join(work_dir, f"{index:05d}.mp4")
+            cmd = ([ffmpeg, "-hide_banner", "-loglevel", "error", "-y"] + _video_input_args(width, height, fps)
+                   + _video_codec_args(max_size, threads) + ["-g", str(gop), "-f", "mp4", segment_path])
+            _run(cmd, lambda process: _feed_frames(process, video[start:end]))
+            return segment_path
+
+        with ThreadPoolExecutor(max_workers=len(segments), thread_name_prefix="mx-video-encode") as pool:
+            segment_paths = list(pool.map(encode_segment, range(len(segments))))
+
+        list_path = os.path.join(work_dir, "segments.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            for segment_path in segment_paths:
+                f.write(f"file '{segment_path.replace(os.sep, '/')}'\n")
+
+        cmd = [ffmpeg, "-hide_banner", "-loglevel", "error", "-y", "-f", "concat", "-safe", "0", "-i", list_path]
+        if audio is not None:
+            audio_path, channels, sample_rate = _write_audio_input(audio)
+            cmd += ["-f", "f32le", "-ar", str(sample_rate), "-ac", str(channels), "-i", audio_path,
+                    "-map", "0:v:0", "-map", "1:a:0", "-c:a", "aac"]
+        cmd += ["-c:v", "copy", "-movflags", "+faststart", "-f", "mp4", path]
+        _run(cmd)
+        return len(segments)
+    finally:
+        if audio_path and os.path.exists(audio_path):
+            os.remove(audio_path)
+        shutil.rmtree(work_dir, ignore_errors=True)
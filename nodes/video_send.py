@@ -1,15 +1,14 @@
-import base64
-import cv2
-import torch
-import numpy as np
-from io import BytesIO
-import tempfile
 import logging
-import os
-import torchaudio
-import io
-import subprocess
 import traceback
+from ..metrics import NODE_PAYLOAD_BYTES
+from ..tracing import phase, traced
+from .lazy import lazy_import
+from .media_io import demux_video, find_ffmpeg, frame_select_filter, scale_filter
+from .payload import content_fingerprint, payload_path, payload_size
+
+cv2 = lazy_import("cv2")
+torch = lazy_import("torch")
+torchaudio = lazy_import("torchaudio")
 
 logger = logging.getLogger('MXChat')
 
@@ -26,7 +25,13 @@ class MXChatVideoSendNode:
                 "max_frames": ("INT", {"default": 0, "min": 0, "max": 10000, "step": 1, "display": "加载帧数上限 (0=全部)"}),
                 "skip_frames": ("INT", {"default": 0, "min": 0, "max": 100, "step": 1, "display": "每隔X帧取一帧 (0=不跳帧)"}),
                 "skip_first_frames": ("INT", {"default": 0, "min": 0, "max": 1000, "step": 1, "display": "跳过前X帧 (0=不跳过)"}),
-                "force_fps": ("INT", {"default": 0, "min": 0, "max": 120, "step": 1, "display": "强制帧率 (0=默认30帧)"})
+                "force_fps": ("INT", {"default": 0, "min": 0, "max": 120, "step": 1, "display": "强制帧率 (0=默认30帧)"}),
+                "target_width": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 1, "display": "输出宽度 (0=按比例/原始)"}),
+                "target_height": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 1, "display": "输出高度 (0=按比例/原始)"}),
+                "max_side": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 1, "display": "长边上限 (0=不限制)"})
+            },
+            "hidden": {
+                "extra_pnginfo": "EXTRA_PNGINFO",
             }
         }
 
@@ -36,6 +41,11 @@ class MXChatVideoSendNode:
     OUTPUT_NODE = True
     CATEGORY = "Agentpark/SendNode"
 
+    @classmethod
+    def IS_CHANGED(cls, video_data, **kwargs):
+        # 以附件内容哈希作为变化标记，相同附件重复运行时可命中 ComfyUI 的执行缓存
+        return content_fingerprint(video_data=video_data, **kwargs)
+
     def __init__(self):
         self.location_name = None
 
@@ -51,7 +61,9 @@ class MXChatVideoSendNode:
         else:
             logger.warning("[MXChatVideoSendNode] widgets 未定义，跳过初始化")
 
-    def execute(self, video_data, location_name="默认位置", text="", max_frames=0, skip_frames=0, skip_first_frames=0, force_fps=0):
+    @traced
+    def execute(self, video_data, location_name="默认位置", text="", max_frames=0, skip_frames=0, skip_first_frames=0, force_fps=0,
+                target_width=0, target_height=0, max_side=0):
         effective_location_name = self.location_name if self.location_name else location_name
         try:
             logger.info(f"[MXChatVideoSendNode] 开始处理视频数据，location_name: {effective_location_name}")
@@ -59,159 +71,100 @@ class MXChatVideoSendNode:
                 logger.error("[MXChatVideoSendNode] 未提供视频数据")
                 return (torch.zeros(1, 64, 64, 3), {"waveform": torch.zeros(1, 1, 1), "sample_rate": 44100})
 
-            if 'base64,' in video_data:
-                video_data = video_data.split('base64,')[1]
-             
-
-            # 解码 Base64 数据为字节
-            video_bytes = base64.b64decode(video_data)
-
-            # 创建临时目录用于处理视频和音频文件
-            temp_dir = tempfile.mkdtemp(prefix="mxchat_video_")
-            temp_file_path = os.path.join(temp_dir, "input.mp4")
-            temp_audio_path = os.path.join(temp_dir, "audio.wav")
-            
-            try:
-                # 将字节流写入临时文件
-                with open(temp_file_path, "wb") as f:
-                    f.write(video_bytes)
-                
-            
-                
-                # 使用 OpenCV 打开临时文件提取视频帧
-                cap = cv2.VideoCapture(temp_file_path, cv2.CAP_FFMPEG)
-                if not cap.isOpened():
-                    logger.error("[MXChatVideoSendNode] 无法打开视频文件")
-                    return (torch.zeros(1, 64, 64, 3), {"waveform": torch.zeros(1, 1, 1), "sample_rate": 44100})
-                
-                frames = []
-                frame_count = 0
-                frame_index = 0
-                
-                # 设置帧率
-                fps = 30.0  # 默认帧率
-                if force_fps > 0:
-                    fps = float(force_fps)
-                    logger.info(f"[MXChatVideoSendNode] 使用强制帧率: {fps} 帧/秒")
-                    
-                # 获取原始视频帧率
-                original_fps = cap.get(cv2.CAP_PROP_FPS)
-                logger.info(f"[MXChatVideoSendNode] 原始视频帧率: {original_fps} 帧/秒")
-                
-                while True:
-                    ret, frame = cap.read()
-                    if not ret:
-                        break
-                        
-                    # 处理跳过前X帧的逻辑
-                    if skip_first_frames > 0 and frame_index < skip_first_frames:
-                        frame_index += 1
-                        continue
-                        
-                    # 处理每隔X帧取一帧的逻辑
-                    if skip_frames > 0:
-                        if frame_index % (skip_frames + 1) != 0:  # 每隔skip_frames帧取一帧
-                            frame_index += 1
-                            continue
-                    
-                    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    frame_tensor = torch.from_numpy(frame_rgb).float() / 255.0
-                    frames.append(frame_tensor)
-                    
-                    frame_count += 1
-                    frame_index += 1
-                    
-                    # 处理帧数上限逻辑
-                    if max_frames > 0 and frame_count >= max_frames:
-                        logger.info(f"[MXChatVideoSendNode] 达到帧数上限 {max_frames}，停止提取")
-                        break
-                
-                cap.release()
-                
-                if not frames:
-                    logger.error("[MXChatVideoSendNode] 视频中未提取到帧")
-                    return (torch.zeros(1, 64, 64, 3), {"waveform": torch.zeros(1, 1, 1), "sample_rate": 44100})
-                
-                video_tensor = torch.stack(frames)  # [帧数, 高度, 宽度, 3]
-                logger.info(f"[MXChatVideoSendNode] 视频帧提取完成，形状: {video_tensor.shape}")
-                
-                # 提取音频数据 - 首先尝试使用ffmpeg提取音频到WAV文件
-                audio_data = None
-                try:
-                    # 使用ffmpeg提取音频到WAV文件
-                    ffmpeg_cmd = [
-                        "ffmpeg", "-i", temp_file_path, "-vn", "-acodec", "pcm_s16le", 
-                        "-ar", "44100", "-ac", "2", "-y", temp_audio_path
-                    ]
-                
-                    result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
-                    
-                    if result.returncode != 0:
-                        logger.warning(f"[MXChatVideoSendNode] ffmpeg提取音频失败: {result.stderr}")
-                        raise Exception(f"ffmpeg提取音频失败: {result.stderr}")
-                    
-                    if os.path.exists(temp_audio_path) and os.path.getsize(temp_audio_path) > 0:
-                        # 使用torchaudio加载提取的音频文件
-                        waveform, sample_rate = torchaudio.load(temp_audio_path)
-                        
-                        # 确保波形是三维张量 [batch_size, channels, samples]
-                        if waveform.dim() == 1:  # 单声道一维数据
-                            waveform = waveform.unsqueeze(0).unsqueeze(0)  # 转换为 [1, 1, samples]
-                        elif waveform.dim() == 2:  # 立体声二维数据 [channels, samples]
-                            waveform = waveform.unsqueeze(0)  # 转换为 [1, channels, samples]
-                        
-                        audio_data = {"waveform": waveform, "sample_rate": sample_rate}
-                        logger.info(f"[MXChatVideoSendNode] 音频提取成功，波形形状: {waveform.shape}, 采样率: {sample_rate}")
-                    else:
-                        logger.warning(f"[MXChatVideoSendNode] 音频文件不存在或为空: {temp_audio_path}")
-                        raise Exception("提取的音频文件不存在或为空")
-                        
-                except Exception as e:
-                    # 如果ffmpeg提取失败，尝试使用torchaudio直接从视频文件提取
-                    logger.warning(f"[MXChatVideoSendNode] ffmpeg提取音频失败，尝试使用torchaudio: {str(e)}")
-                    try:
-                        waveform, sample_rate = torchaudio.load(temp_file_path)
-                        
-                        # 确保波形是三维张量 [batch_size, channels, samples]
-                        if waveform.dim() == 1:  # 单声道一维数据
-                            waveform = waveform.unsqueeze(0).unsqueeze(0)  # 转换为 [1, 1, samples]
-                        elif waveform.dim() == 2:  # 立体声二维数据 [channels, samples]
-                            waveform = waveform.unsqueeze(0)  # 转换为 [1, channels, samples]
-                        
-                        audio_data = {"waveform": waveform, "sample_rate": sample_rate}
-                        logger.info(f"[MXChatVideoSendNode] 使用torchaudio直接提取音频成功，波形形状: {waveform.shape}, 采样率: {sample_rate}")
-                    except Exception as e2:
-                        logger.error(f"[MXChatVideoSendNode] 所有音频提取方法均失败: {str(e2)}")
-                        logger.error(traceback.format_exc())
-                        audio_data = {"waveform": torch.zeros(1, 2, 44100), "sample_rate": 44100}
-            except Exception as e:
-                logger.error(f"[MXChatVideoSendNode] 提取音频失败: {str(e)}")
-                logger.error(traceback.format_exc())
-                audio_data = {"waveform": torch.zeros(1, 2, 44100), "sample_rate": 44100}
-            
+            if force_fps > 0:
+                logger.info(f"[MXChatVideoSendNode] 使用强制帧率: {force_fps} 帧/秒")
+
+            # 附件引用直接使用仓库中的文件，base64 数据流式解码到临时文件
+            size = (target_width, target_height, max_side)
+            NODE_PAYLOAD_BYTES.labels("MXChatVideoSendNode", "in").observe(payload_size(video_data))
+            with phase("MXChatVideoSendNode", "decode"), payload_path(video_data, suffix=".mp4") as video_path:
+                if find_ffmpeg():
+                    frames, audio = self._demux_ffmpeg(video_path, max_frames, skip_frames, skip_first_frames, size)
+                else:
+                    logger.warning("[MXChatVideoSendNode] 未找到 ffmpeg，使用 OpenCV 解码视频")
+                    frames, audio = self._demux_opencv(video_path, max_frames, skip_frames, skip_first_frames, size)
+
+            if not frames:
+                logger.error("[MXChatVideoSendNode] 视频中未提取到帧")
+                return (torch.zeros(1, 64, 64, 3), {"waveform": torch.zeros(1, 1, 1), "sample_rate": 44100})
+
+            video_tensor = self._frames_to_tensor(frames)
             logger.info(f"[MXChatVideoSendNode] 视频处理完成，输出张量形状: {video_tensor.shape}")
-            if audio_data:
-                logger.info(f"[MXChatVideoSendNode] 音频数据: 波形形状={audio_data['waveform'].shape}, 采样率={audio_data['sample_rate']}")
+
+            if audio is not None:
+                waveform, sample_rate = audio
+                audio_data = {"waveform": torch.from_numpy(waveform).unsqueeze(0), "sample_rate": sample_rate}
+                logger.info(f"[MXChatVideoSendNode] 音频数据: 波形形状={audio_data['waveform'].shape}, 采样率={sample_rate}")
             else:
                 logger.warning("[MXChatVideoSendNode] 没有有效的音频数据")
                 audio_data = {"waveform": torch.zeros(1, 2, 44100), "sample_rate": 44100}
-                
+
             return (video_tensor, audio_data)
 
         except Exception as e:
             logger.error(f"[MXChatVideoSendNode] 处理视频失败: {str(e)}")
+            logger.error(traceback.format_exc())
             return (torch.zeros(1, 64, 64, 3), {"waveform": torch.zeros(1, 1, 1), "sample_rate": 44100})
-        finally:
-            # 清理所有临时文件和目录
-            if 'temp_dir' in locals() and os.path.exists(temp_dir):
-                try:
-                    for root, dirs, files in os.walk(temp_dir, topdown=False):
-                        for file in files:
-                            try:
-                                os.unlink(os.path.join(root, file))
-                            except Exception as e:
-                                logger.warning(f"[MXChatVideoSendNode] 删除临时文件失败: {str(e)}")
-                    os.rmdir(temp_dir)
-                   
-                except Exception as e:
-                    logger.warning(f"[MXChatVideoSendNode] 清理临时目录失败: {str(e)}")
\ No newline at end of file
+
+    def _demux_ffmpeg(self, video_path, max_frames, skip_frames, skip_first_frames, size):
+        """一次读取输入，同时得到选中的视频帧和 44.1kHz 立体声音频；先选帧再缩放，丢弃的帧不做缩放"""
+        select = frame_select_filter(skip_first_frames, skip_frames)
+        filters = ([select] if select else []) + scale_filter(*size)
+        frames, audio = demux_video(video_path, filters, max_frames)
+        logger.info(f"[MXChatVideoSendNode] 视频帧提取完成，共 {len(frames)} 帧，音频: {'有' if audio else '无'}")
+        return frames, audio
+
+    def _demux_opencv(self, video_path, max_frames, skip_frames, skip_first_frames, size):
+        """没有 ffmpeg 时的回退：OpenCV 解码视频帧，torchaudio 读取音频"""
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG)
+        if not cap.isOpened():
+            logger.error("[MXChatVideoSendNode] 无法打开视频文件")
+            return [], None
+
+        frames = []
+        frame_index = 0
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            selected = frame_index >= skip_first_frames and (skip_frames <= 0 or frame_index % (skip_frames + 1) == 0)
+            frame_index += 1
+            if not selected:
+                continue
+            frame = self._resize_opencv(frame, *size)
+            frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            if max_frames > 0 and len(frames) >= max_frames:
+                logger.info(f"[MXChatVideoSendNode] 达到帧数上限 {max_frames}，停止提取")
+                break
+        cap.release()
+
+        audio = None
+        try:
+            waveform, sample_rate = torchaudio.load(video_path)
+            audio = (waveform.numpy(), sample_rate)
+        except Exception as e:
+            logger.warning(f"[MXChatVideoSendNode] torchaudio 提取音频失败: {str(e)}")
+        return frames, audio
+
+    @staticmethod
+    def _resize_opencv(frame, target_width, target_height, max_side):
+        """与 scale_filter 相同的尺寸规则，用于 OpenCV 回退路径"""
+        height, width = frame.shape[:2]
+        if target_width > 0 or target_height > 0:
+            new_width = target_width if target_width > 0 else round(width * target_height / height)
+            new_height = target_height if target_height > 0 else round(height * target_width / width)
+        elif max_side > 0 and max(width, height) > max_side:
+            scale = max_side / max(width, height)
+            new_width, new_height = round(width * scale), round(height * scale)
+        else:
+            return frame
+        return cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
+
+    @staticmethod
+    def _frames_to_tensor(frames):
+        """把 uint8 帧逐帧写入预分配的 float32 张量，不再保留一份 float 帧列表"""
+        height, width, _ = frames[0].shape
+        video_tensor = torch.empty((len(frames), height, width, 3), dtype=torch.float32)
+        for i, frame in enumerate(frames):
+            video_tensor[i].copy_(torch.from_numpy(frame))
+        return video_tensor.div_(255.0)
@@ -0,0 +1,283 @@
+"""
+工作流结果缓存（默认关闭）。
+
+侧边栏提交前把 API 格式的提示词发到 /mx/cache/lookup：键为整个图（节点类型和全部输入，含种子）的规范化哈希，
+发送节点的附件只参与内容哈希。命中时直接把上次各接收节点发出的消息重放给该会话，不再排队执行；
+未命中时键随工作流 extra 提交，执行期间接收节点的最终消息按 traceId 记录。
+侧边栏拿到 /prompt 返回的 prompt_id，收到该提示词的执行结束事件后调用 /mx/cache/commit，
+服务端再按 ComfyUI 历史记录（/history）中的状态决定是否写入：执行成功、且实际执行过的接收节点
+（提示词中的接收节点去掉 ComfyUI 复用缓存输出的节点）都产出了最终消息才缓存，执行出错或被中断时丢弃。
+缓存引用的输出文件在 RetentionManager 中固定，条目过期或被淘汰后取消固定，交回正常清理。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .logger import MXLogger
+from .media_store import SEND_NODE_INPUTS
+from .retention import RetentionManager
+from .settings import SettingsManager
+from .tracing import trace_id_from
+
+logger = MXLogger.get_instance()
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '.cache', 'result_cache.sqlite3')
+
+# 会向聊天界面输出结果的接收节点
+RECEIVE_NODE_TYPES = ("MXChatReceive", "MXChatStreamReceive", "MXChatImageReceive", "MXChatVideoReceive",
+                      "MXChatAudioReceive")
+# 前端已经计算过内容哈希的附件输入
+DIGEST_PREFIX = "sha256:"
+# 提交后超过该时间仍未结束记录（如提示词未通过校验、侧边栏已关闭）的记录直接丢弃
+PENDING_TIMEOUT = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    messages TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS entry_files (
+    key TEXT NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (key, path)
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+CREATE INDEX IF NOT EXISTS entry_files_path ON entry_files (path);
+"""
+
+
+def cache_key_from(extra_pnginfo):
+    """从提交的 extra_pnginfo 中取出侧边栏查询时得到的缓存键"""
+    try:
+        return extra_pnginfo["workflow"]["extra"].get("mx_cache_key") or None
+    except (KeyError, TypeError, AttributeError):
+        return None
+
+
+def _digest(value):
+    if isinstance(value, str) and value.startswith(DIGEST_PREFIX):
+        return value
+    data = value if isinstance(value, str) else json.dumps(value, sort_keys=True)
+    return DIGEST_PREFIX + hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def prompt_key(prompt):
+    """API 格式提示词的规范化哈希：忽略节点标题等元数据，发送节点的附件只取内容哈希"""
+    canonical = {}
+    for node_id, node in prompt.items():
+        class_type = node.get("class_type")
+        inputs = dict(node.get("inputs", {}))
+        input_name = SEND_NODE_INPUTS.get(class_type)
+        if input_name and inputs.get(input_name):
+            inputs[input_name] = _digest(inputs[input_name])
+        canonical[str(node_id)] = {"class_type": class_type, "inputs": inputs}
+    payload = json.dumps(canonical, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def receive_node_ids(prompt):
+    return {str(node_id) for node_id, node in prompt.items() if node.get("class_type") in RECEIVE_NODE_TYPES}
+
+
+class ResultCache:
+    """SQLite 保存的结果缓存，按 TTL 和总容量（LRU）淘汰"""
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        settings = SettingsManager.get_instance().section('result_cache')
+        self.enabled = settings.get('enabled', False)
+        self.ttl = settings.get('ttl_hours', 24) * 60 * 60
+        self.max_entries = settings.get('max_entries', 500)
+        self.max_bytes = int(settings.get('max_mb', 2048) * 1024 * 1024)
+        self.db_path = db_path
+        self._db = None
+        self._db_lock = threading.Lock()
+        # traceId -> 正在记录的执行
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+    def _conn(self):
+        # 首次使用时才创建数据库，未启用缓存时不产生文件
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+        return self._db
+
+    def lookup(self, key):
+        """返回缓存的 [(event, data), ...]；未命中、过期或引用的文件已不存在时返回 None"""
+        if not self.enabled:
+            return None
+        # 检查和淘汰在同一次加锁中完成，避免与并发写入的同键新条目交错
+        with self._db_lock:
+            db = self._conn()
+            row = db.execute("SELECT messages, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            files = [path for (path,) in db.execute("SELECT path FROM entry_files WHERE key = ?", (key,))]
+            if (self.ttl > 0 and row[1] < time.time() - self.ttl) or not all(os.path.exists(path) for path in files):
+                unpinned = self._evict_locked(db, [key])
+                hit = False
+            else:
+                db.execute("UPDATE entries SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+                unpinned = ()
+                hit = True
+        for path in unpinned:
+            RetentionManager.get_instance().pin(path, False)
+        if not hit:
+            return None
+        for path in files:
+            RetentionManager.get_instance().touch(path)
+        return [tuple(message) for message in json.loads(row[0])]
+
+    def begin(self, trace_id, key, receive_ids):
+        """提示词入队时开始按 traceId 记录，执行结束后由 complete 决定是否写入缓存"""
+        if not self.enabled or not trace_id or not key or not receive_ids:
+            return
+        now = time.time()
+        with self._pending_lock:
+            for stale in [t for t, p in self._pending.items() if p["started"] < now - PENDING_TIMEOUT]:
+                del self._pending[stale]
+            self._pending[trace_id] = {"key": key, "receive_ids": set(receive_ids), "ran": None,
+                                       "messages": [], "files": [], "started": now}
+
+    def record(self, trace_id, event, data, files=()):
+        """记录接收节点发出的一条最终消息（DeliveryService 在发送后调用）"""
+        if not trace_id or not self._pending:
+            return
+        with self._pending_lock:
+            pending = self._pending.get(trace_id)
+            if pending is None:
+                return
+            pending["messages"].append((event, data))
+            pending["files"].extend(os.path.abspath(path) for path in files)
+
+    def complete(self, history_item):
+        """
+        提示词执行结束后，按 ComfyUI 历史记录中的一项（/history/{prompt_id} 的值）结束记录：
+        status 为成功时统计实际执行的接收节点并排队写入，否则丢弃。返回是否排队写入。
+        """
+        try:
+            queued = history_item["prompt"]
+            extra_data = queued[3]
+            outputs = {str(node_id) for node_id in queued[4]} if len(queued) > 4 else None
+            status = history_item.get("status") or {}
+        except (KeyError, IndexError, TypeError, AttributeError):
+            return False
+        trace_id = trace_id_from(extra_data.get("extra_pnginfo") if isinstance(extra_data, dict) else None)
+        with self._pending_lock:
+            pending = self._pending.get(trace_id)
+            if pending is None or pending["ran"] is not None:
+                # 不是本插件记录的提示词，或已经处理过（重复调用）
+                return False
+            if status.get("status_str") != "success" or not status.get("completed"):
+                del self._pending[trace_id]
+                return False
+            ran = set(pending["receive_ids"])
+            if outputs is not None:
+                ran &= outputs
+            for event, data in status.get("messages", []):
+                # ComfyUI 复用缓存输出的节点不会再执行，也不会再发出结果消息
+                if event == "execution_cached" and isinstance(data, dict):
+                    ran -= {str(node_id) for node_id in data.get("nodes", [])}
+            pending["ran"] = len(ran)
+        # 接收节点的消息已在投递队列中排在前面，结束标记同样经过队列，保证在它们都记录之后才写入
+        from .delivery import DeliveryService
+        DeliveryService.get_instance().submit(lambda: self._finish(trace_id))
+        return True
+
+    def _finish(self, trace_id):
+        with self._pending_lock:
+            pending = self._pending.pop(trace_id, None)
+        if pending is None:
+            return None
+        if not pending["ran"] or len(pending["messages"]) != pending["ran"]:
+            # 没有接收节点执行，或有接收节点未产出结果（如执行出错），不缓存不完整的结果
+            logger.info(f"[ResultCache] 本次执行的结果不完整，不写入缓存："
+                        f"执行 {pending['ran']} 个接收节点，记录 {len(pending['messages'])} 条消息")
+            return None
+        try:
+            self._store(pending["key"], pending["messages"], pending["files"])
+        except Exception as e:
+            logger.error(f"[ResultCache] 写入缓存失败: {str(e)}")
+        # 返回 None，投递服务不发送任何消息
+        return None
+
+    def _store(self, key, messages, files):
+        retention = RetentionManager.get_instance()
+        encoded = json.dumps(messages, ensure_ascii=False)
+        size = len(encoded.encode('utf-8')) + sum(os.path.getsize(path) for path in files if os.path.exists(path))
+        now = time.time()
+        with self._db_lock:
+            db = self._conn()
+            db.execute("BEGIN")
+            db.execute("INSERT OR REPLACE INTO entries (key, messages, size, created, last_access, hits) "
+                       "VALUES (?, ?, ?, ?, ?, 0)", (key, encoded, size, now, now))
+            db.execute("DELETE FROM entry_files WHERE key = ?", (key,))
+            db.executemany("INSERT OR IGNORE INTO entry_files (key, path) VALUES (?, ?)", [(key, p) for p in files])
+            db.execute("COMMIT")
+        for path in files:
+            # 缓存仍引用的文件不参与输出清理
+            retention.register(path, "cached", pinned=True)
+        logger.info(f"[ResultCache] 已缓存 {len(messages)} 条结果消息，{size} 字节")
+        self.enforce()
+
+    def enforce(self):
+        """淘汰过期条目，再按最近访问时间把条目数和总容量降到上限以内"""
+        with self._db_lock:
+            db = self._conn()
+            expired = [k for (k,) in db.execute("SELECT key FROM entries WHERE created < ?",
+                                                (time.time() - self.ttl,))] if self.ttl > 0 else []
+            rows = db.execute("SELECT key, size FROM entries ORDER BY last_access DESC").fetchall()
+        expired_set = set(expired)
+        evicted = []
+        count, total = 0, 0
+        for key, size in rows:
+            if key in expired_set:
+                continue
+            count += 1
+            total += size
+            if (self.max_entries and count > self.max_entries) or (self.max_bytes and total > self.max_bytes):
+                evicted.append(key)
+        if expired or evicted:
+            self._evict(expired + evicted)
+            logger.info(f"[ResultCache] 淘汰缓存：过期 {len(expired)} 条，超出上限 {len(evicted)} 条")
+
+    def _evict(self, keys):
+        with self._db_lock:
+            unpinned = self._evict_locked(self._conn(), keys)
+        for path in unpinned:
+            RetentionManager.get_instance().pin(path, False)
+
+    @staticmethod
+    def _evict_locked(db, keys):
+        """删除条目（调用方持有 _db_lock），返回不再被任何条目引用、需要取消固定的文件"""
+        placeholders = ','.join('?' * len(keys))
+        files = {path for (path,) in db.execute(f"SELECT path FROM entry_files WHERE key IN ({placeholders})", keys)}
+        db.execute("BEGIN")
+        db.execute(f"DELETE FROM entries WHERE key IN ({placeholders})", keys)
+        db.execute(f"DELETE FROM entry_files WHERE key IN ({placeholders})", keys)
+        db.execute("COMMIT")
+        if not files:
+            return set()
+        # 其他条目仍引用的文件继续固定
+        still_used = {path for (path,) in db.execute(
+            f"SELECT path FROM entry_files WHERE path IN ({','.join('?' * len(files))})", list(files))}
+        return files - still_used
@@ -0,0 +1,158 @@
+import os
+import sqlite3
+import threading
+import time
+
+from .logger import MXLogger
+from .settings import SettingsManager
+
+logger = MXLogger.get_instance()
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '.cache', 'retention.sqlite3')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL,
+    session TEXT,
+    pinned INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS artifacts_last_access ON artifacts (last_access);
+CREATE INDEX IF NOT EXISTS artifacts_created ON artifacts (created);
+"""
+
+
+class RetentionManager:
+    """
+    记录 Agentpark 节点生成的所有输出文件（大小、创建时间、最近访问时间、所属会话），
+    后台按总容量配额和最长保存时间做 LRU 清理。清理只查询索引，不扫描输出目录。
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        retention = SettingsManager.get_instance().section('retention')
+        self.enabled = retention.get('enabled', True)
+        self.max_total_bytes = int(retention.get('max_total_mb', 20480) * 1024 * 1024)
+        self.max_age = retention.get('max_age_days', 7) * 24 * 60 * 60
+        self.interval = retention.get('interval_seconds', 300)
+        self.low_water_ratio = retention.get('low_water_ratio', 0.9)
+        self.active_sessions = lambda: set()
+        self._db_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def register(self, path, kind, session=None, pinned=False):
+        """登记一个新生成的文件；已登记时更新大小和访问时间，已固定的文件保持固定"""
+        try:
+            size = os.path.getsize(path)
+        except OSError as e:
+            logger.warning(f"[RetentionManager] 无法登记文件 {path}: {str(e)}")
+            return
+        now = time.time()
+        with self._db_lock:
+            self._db.execute(
+                "INSERT INTO artifacts (path, kind, size, created, last_access, session, pinned) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET size = excluded.size, last_access = excluded.last_access, "
+                "session = COALESCE(excluded.session, artifacts.session), pinned = MAX(artifacts.pinned, excluded.pinned)",
+                (os.path.abspath(path), kind, size, now, now, session, int(pinned)),
+            )
+
+    def touch(self, path):
+        """文件被再次读取或引用时刷新访问时间"""
+        with self._db_lock:
+            self._db.execute("UPDATE artifacts SET last_access = ? WHERE path = ?", (time.time(), os.path.abspath(path)))
+
+    def pin(self, path, pinned=True):
+        """固定的文件不会被清理"""
+        with self._db_lock:
+            self._db.execute("UPDATE artifacts SET pinned = ? WHERE path = ?", (int(pinned), os.path.abspath(path)))
+
+    def total_bytes(self):
+        with self._db_lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+
+    def _evictable(self, order_by, where="", params=()):
+        sessions = [s for s in self.active_sessions() if s]
+        query = "SELECT path, size FROM artifacts WHERE pinned = 0"
+        if sessions:
+            query += f" AND (session IS NULL OR session NOT IN ({','.join('?' * len(sessions))}))"
+        if where:
+            query += f" AND {where}"
+        query += f" ORDER BY {order_by}"
+        with self._db_lock:
+            return self._db.execute(query, (*sessions, *params)).fetchall()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"[RetentionManager] 删除文件失败 {path}: {str(e)}")
+            return False
+        with self._db_lock:
+            self._db.execute("DELETE FROM artifacts WHERE path = ?", (path,))
+        return True
+
+    def purge_older_than(self, max_age):
+        """删除超过 max_age 秒未访问的文件，返回删除数量"""
+        removed = 0
+        for path, _ in self._evictable("last_access", "last_access < ?", (time.time() - max_age,)):
+            removed += self._remove(path)
+        return removed
+
+    def enforce(self):
+        """执行一次清理：先按最长保存时间过期，再按 LRU 把总容量降到低水位以下"""
+        expired = self.purge_older_than(self.max_age) if self.max_age > 0 else 0
+        evicted = 0
+        total = self.total_bytes()
+        if self.max_total_bytes > 0 and total > self.max_total_bytes:
+            target = self.max_total_bytes * self.low_water_ratio
+            for path, size in self._evictable("last_access"):
+                if total <= target:
+                    break
+                if self._remove(path):
+                    total -= size
+                    evicted += 1
+        if expired or evicted:
+            logger.info(f"[RetentionManager] 清理完成：过期 {expired} 个，超出配额淘汰 {evicted} 个，当前占用 {total} 字节")
+        return expired + evicted
+
+    def start(self):
+        """启动后台清理线程"""
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='mx-retention', daemon=True)
+        self._thread.start()
+        logger.info("[RetentionManager] 已启动输出文件清理线程")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.enforce()
+            except Exception as e:
+                logger.error(f"[RetentionManager] 清理失败: {str(e)}")
+            self._stop_event.wait(self.interval)
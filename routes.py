@@ -0,0 +1,201 @@
+import asyncio
+import os
+import re
+import threading
+import time
+
+from aiohttp import web
+from server import PromptServer
+from .delivery import DeliveryService
+from .logger import MXLogger
+from .media_store import MediaStore, attachment_refs, store_attachment
+from .metrics import CONTENT_TYPE, render_latest
+from .result_cache import ResultCache, prompt_key
+from .retention import RetentionManager
+from .settings import SettingsManager
+from .tracing import export_chrome_trace
+
+logger = MXLogger.get_instance()
+
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))), "output")
+# 正在写入时每次读取的块大小和无新数据时的等待间隔
+STREAM_CHUNK_BYTES = 256 * 1024
+STREAM_POLL_SECONDS = 0.1
+# 编码中的文件超过该时间没有新数据时结束响应，避免编码器异常退出后连接一直轮询
+STREAM_IDLE_SECONDS = 60.0
+# 执行结束事件先于历史记录写入发出，提交缓存时最多等待历史记录出现的时间
+HISTORY_WAIT_SECONDS = 10.0
+
+_FILENAME = re.compile(r'^[0-9a-f-]{36}\.mp4$')
+_TRACE_ID = re.compile(r'^[0-9A-Za-z-]{8,64}$')
+_PROMPT_ID = re.compile(r'^[0-9A-Za-z-]{1,64}$')
+
+
+class StreamRegistry:
+    """记录正在编码中的输出文件，编码完成前流式路由会持续读取文件的新增部分"""
+    _active = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def open(cls, filename):
+        with cls._lock:
+            cls._active[filename] = threading.Event()
+
+    @classmethod
+    def finish(cls, filename):
+        with cls._lock:
+            done = cls._active.pop(filename, None)
+        if done:
+            done.set()
+
+    @classmethod
+    def get(cls, filename):
+        with cls._lock:
+            return cls._active.get(filename)
+
+
+async def stream_output_file(request):
+    """/mx/stream/{filename}：编码中的分片 MP4 边写边发送，编码完成后按普通文件（支持 Range）返回"""
+    filename = request.match_info['filename']
+    if not _FILENAME.match(filename):
+        raise web.HTTPNotFound()
+    path = os.path.join(OUTPUT_DIR, filename)
+    done = StreamRegistry.get(filename)
+    if done is None:
+        if not os.path.exists(path):
+            raise web.HTTPNotFound()
+        return web.FileResponse(path)
+
+    loop = asyncio.get_running_loop()
+    try:
+        # 打开和读取文件都在线程池中进行，磁盘慢时也不阻塞事件循环
+        f = await loop.run_in_executor(None, open, path, 'rb')
+    except FileNotFoundError:
+        raise web.HTTPNotFound()
+    response = web.StreamResponse(headers={"Content-Type": "video/mp4", "Cache-Control": "no-store"})
+    try:
+        await response.prepare(request)
+        idle_since = loop.time()
+        while True:
+            # 先取完成标记再读：标记已设置且读不到新数据时，文件尾部已全部发出
+            finished = done.is_set()
+            chunk = await loop.run_in_executor(None, f.read, STREAM_CHUNK_BYTES)
+            if chunk:
+                await response.write(chunk)
+                idle_since = loop.time()
+            elif finished:
+                break
+            elif loop.time() - idle_since > STREAM_IDLE_SECONDS:
+                logger.warning(f"[Routes] {filename} 超过 {STREAM_IDLE_SECONDS:.0f} 秒没有新数据，结束流式响应")
+                break
+            else:
+                await asyncio.sleep(STREAM_POLL_SECONDS)
+    finally:
+        f.close()
+    await response.write_eof()
+    return response
+
+
+async def metrics(request):
+    """/mx/metrics：ComfyUI 进程内节点指标的 Prometheus 文本格式"""
+    return web.Response(body=render_latest().encode('utf-8'), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def trace(request):
+    """/mx/trace/{trace_id}：一次请求的链路追踪，Chrome Trace Event 格式"""
+    trace_id = request.match_info['trace_id']
+    if not _TRACE_ID.match(trace_id):
+        raise web.HTTPNotFound()
+    # 追踪文件可能较大，在线程池中读取
+    data = await asyncio.get_running_loop().run_in_executor(None, export_chrome_trace, trace_id)
+    if not data["traceEvents"]:
+        raise web.HTTPNotFound()
+    return web.json_response(data, headers={"Content-Disposition": f'attachment; filename="trace-{trace_id}.json"'})
+
+
+def _lookup_and_replay(prompt, client_id, trace_id):
+    key = prompt_key(prompt)
+    messages = ResultCache.get_instance().lookup(key)
+    if messages:
+        delivery = DeliveryService.get_instance()
+        for event, data in messages:
+            delivery.send(data, event=event, sid=client_id, trace_id=trace_id)
+        logger.info(f"[Routes] 结果缓存命中，重放 {len(messages)} 条消息")
+    return key, bool(messages)
+
+
+async def cache_lookup(request):
+    """/mx/cache/lookup：按 API 格式提示词查询结果缓存，命中时把缓存的结果重放给发起请求的会话"""
+    if not ResultCache.get_instance().enabled:
+        return web.json_response({"enabled": False, "hit": False})
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest()
+    prompt = body.get("prompt")
+    trace_id = body.get("traceId")
+    if not isinstance(prompt, dict) or (trace_id and not _TRACE_ID.match(trace_id)):
+        raise web.HTTPBadRequest()
+    # 附件哈希、查询和重放都可能较慢，在线程池中进行
+    key, hit = await asyncio.get_running_loop().run_in_executor(
+        None, _lookup_and_replay, prompt, body.get("clientId"), trace_id)
+    return web.json_response({"enabled": True, "hit": hit, "key": key})
+
+
+def _wait_history(prompt_id):
+    """等待 ComfyUI 写入提示词的历史记录（与 /history/{prompt_id} 相同），超时返回 None"""
+    deadline = time.monotonic() + HISTORY_WAIT_SECONDS
+    while True:
+        item = PromptServer.instance.prompt_queue.get_history(prompt_id=prompt_id).get(prompt_id)
+        if item is not None or time.monotonic() > deadline:
+            return item
+        time.sleep(0.1)
+
+
+async def cache_commit(request):
+    """/mx/cache/commit：侧边栏收到提示词的执行结束事件后调用，按历史记录中的执行状态决定是否写入缓存"""
+    if not ResultCache.get_instance().enabled:
+        return web.json_response({"enabled": False, "queued": False})
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest()
+    prompt_id = body.get("prompt_id")
+    if not isinstance(prompt_id, str) or not _PROMPT_ID.match(prompt_id):
+        raise web.HTTPBadRequest()
+    item = await asyncio.get_running_loop().run_in_executor(None, _wait_history, prompt_id)
+    queued = item is not None and ResultCache.get_instance().complete(item)
+    return web.json_response({"enabled": True, "queued": queued})
+
+
+def _store_attachment(value, session):
+    """保存附件并登记到 RetentionManager：按会话和访问时间与输出文件一起清理，每次提交重新上传时刷新访问时间"""
+    store = MediaStore.get_instance()
+    ref = store_attachment(value, store)
+    for item in attachment_refs(ref) if ref else []:
+        RetentionManager.get_instance().register(store.path_for(item), "media", session=session)
+    return ref
+
+
+async def store_media(request):
+    """/mx/media：侧边栏提交前上传发送节点的附件，存入附件仓库后返回引用，提交的提示词中只携带引用"""
+    if not SettingsManager.get_instance().get('media_store', 'compact_prompts', True):
+        return web.json_response({"enabled": False})
+    value = await request.text()
+    session = request.rel_url.query.get('clientId')
+    # 解码、写文件和登记清理在线程池中进行，不阻塞事件循环
+    ref = await asyncio.get_running_loop().run_in_executor(None, _store_attachment, value, session)
+    if ref is None:
+        raise web.HTTPBadRequest()
+    return web.json_response({"enabled": True, "ref": ref})
+
+
+def register_routes():
+    """注册插件自己的 HTTP 路由"""
+    PromptServer.instance.routes.get('/mx/stream/{filename}')(stream_output_file)
+    PromptServer.instance.routes.get('/mx/metrics')(metrics)
+    PromptServer.instance.routes.get('/mx/trace/{trace_id}')(trace)
+    PromptServer.instance.routes.post('/mx/cache/lookup')(cache_lookup)
+    PromptServer.instance.routes.post('/mx/cache/commit')(cache_commit)
+    PromptServer.instance.routes.post('/mx/media')(store_media)
+    logger.info("[Routes] 流式播放、指标、链路追踪、结果缓存和附件上传路由注册完成")
@@ -1,16 +1,28 @@
+import asyncio
+import gc
 import os
+import signal
 import tempfile
 import socket
 import subprocess
 import time
 import sys
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
+import torch
 import whisper
 import logging
 from opencc import OpenCC
 
+try:
+    from .metrics import BYTES_BUCKETS, CONTENT_TYPE, counter, gauge, histogram, render_latest
+    from .settings import SettingsManager
+except ImportError:
+    from metrics import BYTES_BUCKETS, CONTENT_TYPE, counter, gauge, histogram, render_latest
+    from settings import SettingsManager
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -26,9 +38,53 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 未指定每进程线程数时，每个工作进程使用的线程数
+DEFAULT_THREADS_PER_WORKER = 4
+
+
+def available_cpus():
+    """当前进程可以使用的 CPU 编号"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def resolve_workers(settings):
+    """根据 whisper 配置计算 (工作进程数, 每进程线程数)"""
+    cpus = len(available_cpus())
+    workers = settings.get("workers", 1)
+    threads = settings.get("threads_per_worker", 0)
+    if workers <= 0:
+        workers = max(1, cpus // (threads or DEFAULT_THREADS_PER_WORKER))
+    if threads <= 0:
+        threads = max(1, cpus // workers)
+    return workers, threads
+
+
+def worker_cpus(index, threads):
+    """第 index 个工作进程绑定的 CPU，工作进程多于可用核心时循环复用"""
+    cpus = available_cpus()
+    count = min(threads, len(cpus))
+    start = (index * count) % len(cpus)
+    return [cpus[(start + i) % len(cpus)] for i in range(count)]
+
+
+WHISPER_SETTINGS = SettingsManager.get_instance().section("whisper")
+WORKERS, THREADS_PER_WORKER = resolve_workers(WHISPER_SETTINGS)
+
+# 多进程运行时本工作进程导出指标的端口；None 表示单进程，在服务端口上直接导出，0 表示不导出
+_metrics_port = None
+
+if WORKERS > 1:
+    # 父进程在 fork 之前不能创建 OpenMP/MKL 线程池：线程不会被复制到子进程，池的锁状态却会，子进程推理时可能死锁。
+    # 加载模型前就限制为单线程，父进程中的运算都不会启动线程池，工作进程 fork 后再各自设置线程数
+    torch.set_num_threads(1)
+    torch.set_num_interop_threads(1)
+
 # 加载Whisper模型和OpenCC转换器
 try:
-    model = whisper.load_model("small")
+    # 多进程模式下模型必须留在 CPU 上：fork 之后子进程不能继续使用父进程初始化的 CUDA
+    model = whisper.load_model(WHISPER_SETTINGS.get("model", "small"), device="cpu" if WORKERS > 1 else None)
     converter = OpenCC('t2s')  # 繁体到简体转换
     logger.info("Whisper模型和OpenCC转换器加载成功")
 except Exception as e:
@@ -36,6 +92,15 @@ except Exception as e:
     model = None
     converter = None
 
+# Whisper 模型不是线程安全的，同一时间只处理一个请求；识别在线程池中执行，不阻塞事件循环
+model_lock = asyncio.Lock()
+
+ASR_IN_FLIGHT = gauge("mxchat_asr_in_flight", "正在处理（含排队）的语音识别请求数")
+ASR_QUEUE_DEPTH = gauge("mxchat_asr_queue_depth", "等待 Whisper 模型的请求数")
+ASR_SECONDS = histogram("mxchat_asr_seconds", "语音识别各阶段耗时（秒）", ("phase",))
+ASR_AUDIO_BYTES = histogram("mxchat_asr_audio_bytes", "上传音频大小（字节）", buckets=BYTES_BUCKETS)
+ASR_REQUESTS = counter("mxchat_asr_requests_total", "语音识别请求数", ("status",))
+
 @app.post("/whisper")
 async def transcribe_audio(audio: UploadFile = File(...)):
     if not model:
@@ -44,6 +109,8 @@ async def transcribe_audio(audio: UploadFile = File(...)):
     if not audio.filename.lower().endswith(('.wav', '.mp3', '.ogg', '.m4a')):
         raise HTTPException(status_code=400, detail="不支持的音频格式")
 
+    ASR_IN_FLIGHT.inc()
+    request_start = time.perf_counter()
     try:
         logger.info(f"接收到音频文件: {audio.filename}")
         # 创建临时文件保存上传的音频
@@ -51,19 +118,31 @@ async def transcribe_audio(audio: UploadFile = File(...)):
         try:
             temp_audio = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
             content = await audio.read()
+            ASR_AUDIO_BYTES.observe(len(content))
             temp_audio.write(content)
             temp_audio.flush()
             temp_audio.close()  # 确保文件被关闭
             logger.info(f"临时文件已创建: {temp_audio.name}")
 
             # 使用Whisper模型进行语音识别
-            result = model.transcribe(temp_audio.name)
+            queued_at = time.perf_counter()
+            with ASR_QUEUE_DEPTH.track_inprogress():
+                await model_lock.acquire()
+            try:
+                ASR_SECONDS.labels("queue").observe(time.perf_counter() - queued_at)
+                with ASR_SECONDS.labels("transcribe").time():
+                    result = await run_in_threadpool(model.transcribe, temp_audio.name)
+            finally:
+                model_lock.release()
             text = result["text"].strip()
             # 将繁体转换为简体
             if converter:
                 text = converter.convert(text)
             logger.info(f"语音识别结果(简体): {text}")
+            ASR_REQUESTS.labels("ok").inc()
         finally:
+            ASR_IN_FLIGHT.dec()
+            ASR_SECONDS.labels("total").observe(time.perf_counter() - request_start)
             # 确保在任何情况下都尝试删除临时文件
             if temp_audio and os.path.exists(temp_audio.name):
                 try:
@@ -82,9 +161,17 @@ async def transcribe_audio(audio: UploadFile = File(...)):
                 }
             )
     except Exception as e:
+        ASR_REQUESTS.labels("error").inc()
         logger.error(f"处理音频文件时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/metrics")
+async def metrics(request: Request):
+    # 多进程时共享端口上的请求会落到任意一个工作进程，各进程的计数器不能混在一起抓取
+    if _metrics_port is not None and (request.scope.get("server") or (None, None))[1] != _metrics_port:
+        raise HTTPException(status_code=404, detail="多进程运行时请从各工作进程的指标端口（whisper.metrics_port + 序号）抓取 /metrics")
+    return Response(content=render_latest(), headers={"Content-Type": CONTENT_TYPE})
+
 @app.options("/whisper")
 async def whisper_options():
     return JSONResponse(
@@ -147,11 +234,119 @@ def check_and_free_ports(ports=[8165]):
         else:
             logger.info(f"端口 {port} 未被占用，可以使用")
 
+def _exit_with_parent():
+    """Linux 上让工作进程在父进程退出时收到 SIGTERM，避免留下孤儿进程"""
+    try:
+        import ctypes
+        PR_SET_PDEATHSIG = 1
+        ctypes.CDLL("libc.so.6", use_errno=True).prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+    except (OSError, AttributeError):
+        pass
+
+
+def run_worker(sock, index, threads, pin_cpus, metrics_sock=None):
+    """工作进程：绑定 CPU 和线程数后在共享的监听 socket 上运行 uvicorn，另有指标端口时同时监听"""
+    global _metrics_port
+    import uvicorn
+    sockets = [sock]
+    _metrics_port = 0
+    if metrics_sock is not None:
+        sockets.append(metrics_sock)
+        _metrics_port = metrics_sock.getsockname()[1]
+    _exit_with_parent()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    if pin_cpus and hasattr(os, "sched_setaffinity"):
+        cpus = worker_cpus(index, threads)
+        os.sched_setaffinity(0, cpus)
+        logger.info(f"Whisper 工作进程 {index} (PID {os.getpid()}) 绑定 CPU {cpus}")
+    # 线程池在子进程中第一次推理时才创建；inter-op 线程数已在父进程中固定为 1
+    torch.set_num_threads(threads)
+    uvicorn.Server(uvicorn.Config(app, log_level="info")).run(sockets=sockets)
+
+
+def _listen(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def serve_prefork(host, port, workers, threads, pin_cpus=True, metrics_port=0):
+    """
+    预先 fork 多个工作进程共同监听一个端口。模型已在父进程中加载，子进程以写时复制的方式共享权重
+    （推理只读取权重，内存页不会被复制），总内存接近单个模型而不是 workers 倍。
+    父进程只负责在工作进程意外退出时重新 fork。
+    每个工作进程有独立的指标，metrics_port 大于 0 时第 i 个工作进程在 metrics_port + i 上导出 /metrics，
+    由 Prometheus 分别抓取后再汇总；为 0 时多进程模式不导出指标。
+    父进程必须以单线程运行 torch（见模块开头），否则直接报错退出，而不是带着已创建的线程池 fork。
+    """
+    if torch.get_num_threads() != 1 or torch.get_num_interop_threads() != 1:
+        raise RuntimeError(
+            f"多进程模式要求父进程的 torch 线程数为 1（当前 intra-op {torch.get_num_threads()}，"
+            f"inter-op {torch.get_num_interop_threads()}），带着 OpenMP/MKL 线程池 fork 工作进程可能死锁"
+        )
+    sock = _listen(host, port)
+    # 指标端口在父进程中创建，重启的工作进程沿用同一个端口
+    metrics_socks = [_listen(host, metrics_port + index, 16) for index in range(workers)] if metrics_port > 0 else None
+    # 把已加载的对象移出垃圾回收的跟踪范围，子进程中的回收不会改写这些对象所在的内存页
+    gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(sock, index, threads, pin_cpus, metrics_socks[index] if metrics_socks else None)
+            except BaseException:
+                logger.exception(f"Whisper 工作进程 {index} 异常退出")
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(workers):
+        spawn(index)
+    logger.info(f"Whisper 服务以 {workers} 个工作进程运行，每进程 {threads} 个线程")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            logger.warning(f"Whisper 工作进程 {index} (PID {pid}) 已退出，状态 {status}，正在重新启动...")
+            time.sleep(1)
+            spawn(index)
+
+
 if __name__ == "__main__":
     # 在启动服务器前检查并释放端口
     logger.info("正在检查端口占用情况...")
     check_and_free_ports()
     
-    import uvicorn
     logger.info("正在启动Whisper服务器...")
-    uvicorn.run(app, host="0.0.0.0", port=8165)
+    if WORKERS > 1 and hasattr(os, "fork") and model is not None:
+        serve_prefork("0.0.0.0", 8165, WORKERS, THREADS_PER_WORKER, WHISPER_SETTINGS.get("pin_cpus", True),
+                      WHISPER_SETTINGS.get("metrics_port", 0))
+    else:
+        import uvicorn
+        torch.set_num_threads(THREADS_PER_WORKER)
+        uvicorn.run(app, host="0.0.0.0", port=8165)
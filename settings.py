@@ -0,0 +1,112 @@
+import copy
+import json
+import logging
+import os
+
+logger = logging.getLogger('MXChat')
+
+# 部署级运行参数的默认值，settings.json 中的同名字段会覆盖这里的值
+DEFAULT_SETTINGS = {
+    "websocket": {
+        "compression": True,           # 是否协商 permessage-deflate
+        "coalesce_window_ms": 15,      # 小消息合并窗口（毫秒），0 表示不合并
+        "coalesce_max_bytes": 8192,    # 单个合并帧的最大字节数
+        "send_queue_max": 256,         # 每个连接的发送队列长度，满时丢弃最旧的预览消息，仍然积压时关闭慢连接
+    },
+    "delivery": {
+        "max_queue": 64,               # 后台投递队列达到该长度时丢弃最旧的预览，结果消息不受限制
+    },
+    "folder_sync": {
+        "link_mode": "auto",           # auto: 优先 reflink，失败时复制；hardlink: 硬链接；copy: 始终复制
+        "debounce_ms": 500,            # 同一文件连续事件的合并窗口（毫秒）
+        "workers": 4,                  # 并行同步不同文件的线程数
+        "compact_workflows": False,    # 同步时把工作流中的内联附件移入附件仓库（仓库只在本机有效，导出的工作流不可移植）
+    },
+    "retention": {
+        "enabled": True,
+        "max_total_mb": 20480,         # 输出文件总容量上限（MB），0 表示不限制
+        "max_age_days": 7,             # 超过该天数未访问的文件会被清理，0 表示不限制
+        "interval_seconds": 300,       # 后台清理间隔
+        "low_water_ratio": 0.9,        # 超出配额时清理到上限的该比例
+    },
+    "media_store": {
+        "compact_prompts": True,       # 侧边栏提交前上传发送节点的附件，提示词中只携带仓库引用
+    },
+    "video_encode": {
+        "workers": 0,                  # 分段并行编码的进程数，0 表示按 CPU 核心数
+        "segment_min_frames": 600,     # 帧数达到该值才分段编码，短视频仍用单进程
+        "gop_seconds": 2.0,            # 分段按关键帧间隔（秒）对齐
+    },
+    "whisper": {
+        "model": "small",              # Whisper 模型名称
+        "workers": 1,                  # 语音识别工作进程数，0 表示按 CPU 核心数 / 每进程线程数；大于 1 时模型在 CPU 上运行
+        "threads_per_worker": 0,       # 每个工作进程的推理线程数，0 表示平均分配可用核心
+        "pin_cpus": True,              # 是否把每个工作进程绑定到固定的 CPU 核心（Linux）
+        "metrics_port": 0,             # 多进程时第 i 个工作进程在 metrics_port + i 上导出 /metrics，0 表示不导出
+    },
+    "chat_scheduler": {
+        "max_concurrent": 4,           # 同时发往 LLM 上游的 /chat 请求数
+        "tokens_per_minute": 0,        # 每个 clientId 每分钟的 token 预算（按提示词长度估算），0 表示不限制
+        "completion_tokens_estimate": 512,  # 放行时预扣的回复 token 数
+        "queue_timeout_seconds": 120,  # 排队超过该时间返回 429
+        "max_queued_per_client": 8,    # 单个 clientId 最多排队的请求数
+        "client_weights": {},          # clientId -> 权重，默认 1，权重越大分到的份额越多
+    },
+    "result_cache": {
+        "enabled": False,              # 相同的工作流和附件再次提交时直接重放上次的结果，不再执行
+        "ttl_hours": 24,               # 缓存条目的保存时间（小时），0 表示不过期
+        "max_entries": 500,            # 最多保存的条目数，超出时按最近访问时间淘汰
+        "max_mb": 2048,                # 缓存消息和引用的输出文件总大小上限（MB）
+    },
+    "tracing": {
+        "enabled": True,               # 是否记录带 traceId 请求的各阶段耗时
+        "max_file_mb": 20,             # logs/traces.jsonl 超过该大小时轮转
+    },
+}
+
+
+def _deep_merge(base, override):
+    """递归合并字典，override 中的值优先"""
+    merged = copy.deepcopy(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _deep_merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class SettingsManager:
+    """读取 settings.json 中的部署参数，与 config.json（模型配置）分开保存"""
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, settings_path="settings.json"):
+        self.settings_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), settings_path)
+        self.settings = copy.deepcopy(DEFAULT_SETTINGS)
+        self.load_settings()
+
+    def load_settings(self):
+        """加载 settings.json，文件不存在或解析失败时使用默认值"""
+        self.settings = copy.deepcopy(DEFAULT_SETTINGS)
+        if not os.path.exists(self.settings_path):
+            return
+        try:
+            with open(self.settings_path, 'r', encoding='utf-8') as f:
+                content = f.read().strip()
+            if content:
+                self.settings = _deep_merge(DEFAULT_SETTINGS, json.loads(content))
+        except Exception as e:
+            logger.error(f"读取 settings.json 失败: {str(e)}，使用默认设置")
+
+    def section(self, name):
+        """获取某个配置分组（返回副本）"""
+        return copy.deepcopy(self.settings.get(name, {}))
+
+    def get(self, section, key, default=None):
+        return self.settings.get(section, {}).get(key, default)
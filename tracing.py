@@ -0,0 +1,216 @@
+"""
+请求链路追踪。
+
+侧边栏发送消息时生成 traceId，写入工作流的 extra 字段随提示词提交；节点通过隐藏输入
+EXTRA_PNGINFO 读到它，执行、各阶段、后台投递和浏览器渲染都按 traceId 记录一段耗时，
+追加写入 logs/traces.jsonl。export_chrome_trace 把某次请求的记录转换为 Chrome Trace Event
+格式，可在 chrome://tracing 或 https://ui.perfetto.dev 中查看瀑布图。
+
+命令行导出：python tracing.py <traceId> [-o trace.json]
+"""
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from .metrics import phase as metrics_phase
+    from .settings import SettingsManager
+except ImportError:
+    from metrics import phase as metrics_phase
+    from settings import SettingsManager
+
+TRACE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "logs", "traces.jsonl")
+
+# 当前节点执行所属的 traceId，由 traced 装饰器设置
+_current_trace = contextvars.ContextVar("mx_trace_id", default=None)
+
+
+def trace_id_from(extra_pnginfo):
+    """从节点的 EXTRA_PNGINFO 隐藏输入（或提交的 extra_pnginfo）中取出 traceId"""
+    try:
+        return extra_pnginfo["workflow"]["extra"].get("mx_trace_id") or None
+    except (KeyError, TypeError, AttributeError):
+        return None
+
+
+def current_trace_id():
+    return _current_trace.get()
+
+
+@contextmanager
+def use_trace(trace_id):
+    """在后台线程中沿用提交方的 traceId，期间的 span()/phase() 记到同一条链路上"""
+    token = _current_trace.set(trace_id)
+    try:
+        yield
+    finally:
+        _current_trace.reset(token)
+
+
+class Tracer:
+    """把 span 追加写入 JSONL 文件，超过大小上限时轮转为 .1"""
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, path=TRACE_FILE, enabled=None, max_bytes=None):
+        settings = SettingsManager.get_instance()
+        self.path = path
+        self.enabled = settings.get('tracing', 'enabled', True) if enabled is None else enabled
+        if max_bytes is None:
+            max_bytes = settings.get('tracing', 'max_file_mb', 20) * 1024 * 1024
+        self.max_bytes = max_bytes
+        self._write_lock = threading.Lock()
+        self._file = None
+
+    def record(self, trace_id, name, start, duration, process="comfyui", thread=None, **attrs):
+        """记录一段耗时；start 为 Unix 时间戳（秒），duration 为秒"""
+        if not self.enabled or not trace_id:
+            return
+        span = {
+            "traceId": trace_id,
+            "name": name,
+            "ts": int(start * 1e6),
+            "dur": max(0, int(duration * 1e6)),
+            "process": process,
+            "thread": thread or threading.current_thread().name,
+        }
+        if attrs:
+            span["attrs"] = attrs
+        line = json.dumps(span, ensure_ascii=False) + "\n"
+        with self._write_lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+            if self.max_bytes and self._file.tell() > self.max_bytes:
+                self._file.close()
+                self._file = None
+                os.replace(self.path, self.path + ".1")
+
+    @contextmanager
+    def span(self, name, trace_id=None, **attrs):
+        trace_id = trace_id or _current_trace.get()
+        if not self.enabled or not trace_id:
+            yield
+            return
+        start, began = time.time(), time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(trace_id, name, start, time.perf_counter() - began, **attrs)
+
+
+def span(name, trace_id=None, **attrs):
+    """记录一段耗时，未指定 trace_id 时使用当前节点执行的 traceId；没有 traceId 时不记录"""
+    return Tracer.get_instance().span(name, trace_id, **attrs)
+
+
+@contextmanager
+def phase(node, name):
+    """同时记录阶段耗时指标和追踪 span：with phase("MXChatVideoReceiveNode", "encode"): ..."""
+    with metrics_phase(node, name), span(name, node=node):
+        yield
+
+
+def traced(execute):
+    """
+    节点 execute 的装饰器：从隐藏输入 extra_pnginfo 中取出 traceId，记录整个执行的 span，
+    执行期间 span()/phase() 和 DeliveryService.submit 自动使用该 traceId。
+    execute 自己声明了 extra_pnginfo 参数时原样传入。
+    """
+    wants_extra = "extra_pnginfo" in inspect.signature(execute).parameters
+
+    @functools.wraps(execute)
+    def wrapper(self, *args, extra_pnginfo=None, **kwargs):
+        if wants_extra:
+            kwargs["extra_pnginfo"] = extra_pnginfo
+        trace_id = trace_id_from(extra_pnginfo)
+        if not trace_id:
+            return execute(self, *args, **kwargs)
+        token = _current_trace.set(trace_id)
+        try:
+            with span("execute", node=type(self).__name__):
+                return execute(self, *args, **kwargs)
+        finally:
+            _current_trace.reset(token)
+    return wrapper
+
+
+def read_spans(trace_id=None, path=TRACE_FILE):
+    """读取记录的 span（含轮转出的旧文件），可按 traceId 过滤"""
+    spans = []
+    for file_path in (path + ".1", path):
+        if not os.path.exists(file_path):
+            continue
+        with open(file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if trace_id and f'"{trace_id}"' not in line:
+                    continue
+                try:
+                    span_data = json.loads(line)
+                except ValueError:
+                    continue
+                if trace_id is None or span_data.get("traceId") == trace_id:
+                    spans.append(span_data)
+    return spans
+
+
+def to_chrome_trace(spans):
+    """转换为 Chrome Trace Event 格式：每个进程（comfyui/browser）一行，进程内按线程分轨"""
+    events = []
+    pids, tids = {}, {}
+    for span_data in sorted(spans, key=lambda s: s["ts"]):
+        process = span_data.get("process", "comfyui")
+        if process not in pids:
+            pids[process] = len(pids) + 1
+            events.append({"ph": "M", "name": "process_name", "pid": pids[process], "tid": 0,
+                           "args": {"name": process}})
+        thread_key = (process, span_data.get("thread") or "main")
+        if thread_key not in tids:
+            tids[thread_key] = len(tids) + 1
+            events.append({"ph": "M", "name": "thread_name", "pid": pids[process], "tid": tids[thread_key],
+                           "args": {"name": thread_key[1]}})
+        attrs = dict(span_data.get("attrs") or {})
+        node = attrs.get("node")
+        events.append({
+            "name": f"{node}.{span_data['name']}" if node else span_data["name"],
+            "cat": process,
+            "ph": "X",
+            "ts": span_data["ts"],
+            "dur": span_data["dur"],
+            "pid": pids[process],
+            "tid": tids[thread_key],
+            "args": dict(attrs, traceId=span_data["traceId"]),
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def export_chrome_trace(trace_id, path=TRACE_FILE):
+    return to_chrome_trace(read_spans(trace_id, path))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="导出一次请求的链路追踪（Chrome Trace Event 格式）")
+    parser.add_argument("trace_id")
+    parser.add_argument("-o", "--output", help="输出文件，默认 trace-<traceId>.json")
+    args = parser.parse_args()
+    output = args.output or f"trace-{args.trace_id}.json"
+    trace = export_chrome_trace(args.trace_id)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(trace, f, ensure_ascii=False)
+    print(f"已导出 {sum(1 for e in trace['traceEvents'] if e['ph'] == 'X')} 个 span 到 {output}")
@@ -1,6 +1,15 @@
+import { api } from "../../scripts/api.js";
 import { MessageComponent } from './messageComponent.js';
 import { InputComponent } from './inputComponent.js';
 
+// 发送节点的附件输入，查询结果缓存时只提交其内容哈希
+const ATTACHMENT_INPUTS = {
+    MXChatImageSend: 'image_data',
+    MXChatAudioSend: 'audio_data',
+    MXChatVideoSend: 'video_data',
+    MXChatTableSend: 'table_data'
+};
+
 export class MXChatSidebar {
     constructor() {
         this.visible = false;
@@ -11,6 +20,12 @@ export class MXChatSidebar {
             chat: [],
             build: []
         };
+        // 链路追踪：traceId -> 发送时刻，以及待上报的浏览器端 span
+        this.traceStarts = new Map();
+        this.traceBuffer = [];
+        // 流式接收节点的 streamId -> 正在追加文本的消息组件
+        this.streamMessages = new Map();
+        this.traceFlushTimer = null;
         this.setupWebSocket();
         this.renderToggleButton();
         this.renderSidebar();
@@ -29,7 +44,8 @@ export class MXChatSidebar {
             clientId = this.generateClientId();
             localStorage.setItem('mxChatClientId', clientId);
         }
-        this.ws = new WebSocket(`${wsUrl}?clientId=${clientId}`);
+        // mxBatch=1 表示本客户端能解析服务端合并后的 mx-batch 帧
+        this.ws = new WebSocket(`${wsUrl}?clientId=${clientId}&mxBatch=1`);
         this.wsReady = false;
         this.ws.binaryType = 'arraybuffer';
     
@@ -54,14 +70,42 @@ export class MXChatSidebar {
                 // 处理消息类型
                 const messageHandlers = {
                     'mx-chat-message': (d) => {
+                        const renderStart = performance.now();
                         if (this.currentMode === 'agent' && d.data?.text && typeof this.addMessage === 'function') {
                             const message = {
                                 text: d.data.text,
                                 format: d.data.format || 'text',
+                                formatFeatures: d.data.formatFeatures,
                                 reasoning_content: d.data.reasoning_content || '' // 如果有 reasoning_content
                             };
                             this.addMessage(message, d.data.isUser || false, d.data.imageData || null, d.data.audioData || null, d.data.videoData || null);
                         }
+                        if (d.data?.traceId) this.traceRendered(d.data.traceId, renderStart);
+                    },
+                    'mx-chat-stream': (d) => {
+                        const renderStart = performance.now();
+                        const data = d.data || {};
+                        if (this.currentMode !== 'agent' || !data.streamId) return;
+                        let entry = this.streamMessages.get(data.streamId);
+                        if (!entry) {
+                            if (data.done && !data.text) return;
+                            const messageComponent = new MessageComponent({ text: '', format: 'text' }, false);
+                            this.modeMessages[this.currentMode].push(messageComponent);
+                            messageComponent.appendTo(this.messagesContainer);
+                            entry = { component: messageComponent, text: '' };
+                            this.streamMessages.set(data.streamId, entry);
+                        }
+                        if (data.done) {
+                            // 结束消息带完整文本和只检测一次的格式，覆盖逐段追加的内容
+                            entry.component.updateText({ text: data.text || entry.text, format: data.format || 'text', formatFeatures: data.formatFeatures });
+                            this.streamMessages.delete(data.streamId);
+                        } else {
+                            entry.text += data.delta || '';
+                            entry.component.updateText({ text: entry.text });
+                        }
+                        this.messagesContainer.scrollTop = this.messagesContainer.scrollHeight;
+                        // 首个片段渲染时即计入端到端耗时，与 chat 模式的首字延迟对齐
+                        if (data.traceId) this.traceRendered(data.traceId, renderStart);
                     },
                     'imageData_ack': (d) => {
                         if (d.success) {
@@ -84,8 +128,16 @@ export class MXChatSidebar {
                     }
                 };
     
-                const handler = messageHandlers[data.type || data.event];
-                if (handler) handler(data);
+                const dispatch = (msg) => {
+                    const handler = messageHandlers[msg.type || msg.event];
+                    if (handler) handler(msg);
+                };
+                // 服务端会把短时间内的多条小消息合并为一个 mx-batch 帧
+                if ((data.type || data.event) === 'mx-batch' && Array.isArray(data.data)) {
+                    data.data.forEach(dispatch);
+                } else {
+                    dispatch(data);
+                }
              } catch (error) {
                 console.error(`[ERROR] 解析 WebSocket 消息失败:`, error);
              }
@@ -105,6 +157,138 @@ export class MXChatSidebar {
         });
     }
     
+    recordSpan(traceId, name, startMs, endMs, attrs = null) {
+        // performance.now() 加上 timeOrigin 换算为 Unix 毫秒时间戳，与服务端记录的时间对齐
+        this.traceBuffer.push({ traceId, name, start: performance.timeOrigin + startMs, duration: endMs - startMs, attrs });
+        if (this.traceBuffer.length > 500) this.traceBuffer.splice(0, this.traceBuffer.length - 500);
+        if (!this.traceFlushTimer) this.traceFlushTimer = setTimeout(() => this.flushSpans(), 200);
+    }
+
+    flushSpans() {
+        this.traceFlushTimer = null;
+        if (!this.traceBuffer.length) return;
+        if (!this.wsReady) {
+            // 连接未就绪时稍后重试，span 保留在缓冲区中
+            this.traceFlushTimer = setTimeout(() => this.flushSpans(), 1000);
+            return;
+        }
+        this.ws.send(JSON.stringify({ type: 'trace_spans', spans: this.traceBuffer.splice(0) }));
+    }
+
+    async lookupResultCache(traceId) {
+        // 服务端未启用结果缓存时本页面不再查询
+        if (this.resultCacheEnabled === false) return null;
+        try {
+            const { output } = await app.graphToPrompt();
+            for (const node of Object.values(output)) {
+                const inputName = ATTACHMENT_INPUTS[node.class_type];
+                const value = inputName && node.inputs?.[inputName];
+                if (typeof value === 'string' && value) node.inputs[inputName] = await this.digestAttachment(value);
+            }
+            const response = await fetch('/mx/cache/lookup', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ prompt: output, clientId: localStorage.getItem('mxChatClientId'), traceId })
+            });
+            if (!response.ok) return null;
+            const result = await response.json();
+            if (result.enabled === false) this.resultCacheEnabled = false;
+            return result;
+        } catch (error) {
+            console.warn(`[WARN] 查询结果缓存失败，继续执行工作流:`, error);
+            return null;
+        }
+    }
+
+    async queueWithAttachmentRefs(onQueued) {
+        // 只替换提交的提示词中的附件，工作流（extra_pnginfo）保持内联，输出文件元数据在其他环境中也能使用
+        const graphToPrompt = app.graphToPrompt;
+        app.graphToPrompt = async (...args) => {
+            const prompt = await graphToPrompt.apply(app, args);
+            await this.uploadAttachments(prompt.output);
+            return prompt;
+        };
+        // /prompt 的响应中带有 prompt_id，拿到后立即交给调用方，不错过随后的执行事件
+        const queuePrompt = api.queuePrompt;
+        if (onQueued) {
+            api.queuePrompt = async (...args) => {
+                const result = await queuePrompt.apply(api, args);
+                if (result?.prompt_id) onQueued(result.prompt_id);
+                return result;
+            };
+        }
+        try {
+            await app.queuePrompt();
+        } finally {
+            app.graphToPrompt = graphToPrompt;
+            api.queuePrompt = queuePrompt;
+        }
+    }
+
+    commitResultCacheOnEnd(promptId) {
+        // 提示词执行结束（成功、出错或中断）后通知服务端，由服务端按历史记录中的状态决定是否写入缓存
+        const events = ['execution_success', 'execution_error', 'execution_interrupted'];
+        const onEnd = async (event) => {
+            if (event.detail?.prompt_id !== promptId) return;
+            events.forEach(name => api.removeEventListener(name, onEnd));
+            try {
+                await fetch('/mx/cache/commit', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ prompt_id: promptId })
+                });
+            } catch (error) {
+                console.warn(`[WARN] 提交结果缓存失败:`, error);
+            }
+        };
+        events.forEach(name => api.addEventListener(name, onEnd));
+    }
+
+    async uploadAttachments(output) {
+        // 服务端未启用附件仓库时本页面不再上传
+        if (this.mediaStoreEnabled === false) return;
+        await Promise.all(Object.values(output).map(async node => {
+            const inputName = ATTACHMENT_INPUTS[node.class_type];
+            const value = inputName && node.inputs?.[inputName];
+            if (typeof value !== 'string' || value.length < 4096 || value.startsWith('mxref:')) return;
+            try {
+                const clientId = encodeURIComponent(localStorage.getItem('mxChatClientId') || '');
+                const response = await fetch(`/mx/media?clientId=${clientId}`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'text/plain' },
+                    body: value
+                });
+                if (!response.ok) return;
+                const result = await response.json();
+                if (result.enabled === false) {
+                    this.mediaStoreEnabled = false;
+                    return;
+                }
+                node.inputs[inputName] = result.ref;
+            } catch (error) {
+                console.warn(`[WARN] 上传附件失败，提示词中保留内联数据:`, error);
+            }
+        }));
+    }
+
+    async digestAttachment(value) {
+        // 非安全上下文（如局域网 http 访问）没有 crypto.subtle，原样提交由服务端计算哈希
+        if (!window.crypto?.subtle) return value;
+        const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(value));
+        return 'sha256:' + Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    traceRendered(traceId, renderStart) {
+        const renderEnd = performance.now();
+        this.recordSpan(traceId, 'render', renderStart, renderEnd);
+        const sendStart = this.traceStarts.get(traceId);
+        if (sendStart !== undefined) {
+            // 只有第一条结果计入端到端耗时
+            this.traceStarts.delete(traceId);
+            this.recordSpan(traceId, 'end_to_end', sendStart, renderEnd);
+        }
+    }
+
     generateClientId() {
         return 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, (c) => {
             const r = Math.random() * 16 | 0;
@@ -134,6 +318,8 @@ export class MXChatSidebar {
         }
     
         const sendData = async () => {
+            const traceId = this.generateClientId();
+            const sendStart = performance.now();
             try {
                 if (this.currentMode === 'agent') {
                     if (!app || !app.graph || !app.graph._nodes) {
@@ -156,21 +342,28 @@ export class MXChatSidebar {
     
                         // 处理图片数据
                         if (imageData?.length > 0) {
+                            // 同一位置的多张图片合并发给一个节点，节点输出一个图片批次
+                            const imagesByLocation = new Map();
                             for (const img of imageData) {
+                                if (!imagesByLocation.has(img.locationName)) imagesByLocation.set(img.locationName, []);
+                                imagesByLocation.get(img.locationName).push(img.base64Data);
+                            }
+                            for (const [locationName, images] of imagesByLocation) {
                                 const imageSendNode = app.graph._nodes.find(n => {
                                     if (n.type !== 'MXChatImageSend') return false;
                                     const locationWidget = n.widgets.find(w => w.name === 'location_name');
-                                    return locationWidget && locationWidget.value === img.locationName;
+                                    return locationWidget && locationWidget.value === locationName;
                                 });
     
                                 if (!imageSendNode) {
-                                    throw new Error(`未找到 location_name 为 ${img.locationName} 的 MXChatImage 节点`);
+                                    throw new Error(`未找到 location_name 为 ${locationName} 的 MXChatImage 节点`);
                                 }
     
                                 const imageWidget = imageSendNode.widgets.find(w => w.name === 'image_data');
                                 const textWidget = imageSendNode.widgets.find(w => w.name === 'text');
                                 if (!imageWidget) throw new Error('MXChatImageSend 缺少 image_data 小部件');
-                                imageWidget.value = img.base64Data;
+                                // 单张图片保持原来的 base64 字符串，多张时为 JSON 数组
+                                imageWidget.value = images.length === 1 ? images[0] : JSON.stringify(images);
                                 if (textWidget) textWidget.value = "";
                             }
                         }
@@ -230,8 +423,33 @@ export class MXChatSidebar {
                             }
                         }
     
-                        // 统一触发工作流执行
-                        await app.queuePrompt();
+                        // 统一触发工作流执行，traceId 随工作流的 extra 字段提交，节点和服务端按它记录各阶段耗时
+                        this.traceStarts.set(traceId, sendStart);
+                        if (this.traceStarts.size > 100) this.traceStarts.delete(this.traceStarts.keys().next().value);
+                        // 结果缓存命中时服务端直接重放上次的结果，不再排队执行
+                        const lookupStart = performance.now();
+                        const cached = await this.lookupResultCache(traceId);
+                        if (cached?.hit) {
+                            this.recordSpan(traceId, 'cache_hit', lookupStart, performance.now());
+                            return;
+                        }
+                        app.graph.extra = app.graph.extra || {};
+                        app.graph.extra.mx_trace_id = traceId;
+                        // 流式接收节点按 clientId 只把片段发给发起请求的侧边栏
+                        app.graph.extra.mx_client_id = localStorage.getItem('mxChatClientId');
+                        // 未命中时带上缓存键，执行结果由服务端记录
+                        if (cached?.key) app.graph.extra.mx_cache_key = cached.key;
+                        const queueStart = performance.now();
+                        try {
+                            await this.queueWithAttachmentRefs(cached?.key ? promptId => this.commitResultCacheOnEnd(promptId) : null);
+                        } finally {
+                            // 不把 traceId 等留在保存的工作流里
+                            delete app.graph.extra.mx_trace_id;
+                            delete app.graph.extra.mx_client_id;
+                            delete app.graph.extra.mx_cache_key;
+                        }
+                        this.recordSpan(traceId, 'prepare', sendStart, queueStart);
+                        this.recordSpan(traceId, 'queue_prompt', queueStart, performance.now());
                     }
                 } else if (this.currentMode === 'chat') {
                     // 保持 chat 模式逻辑不变
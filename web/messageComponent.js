@@ -51,15 +51,15 @@ export class MessageComponent extends MXChatComponent {
                     markedScript.src = 'https://cdn.jsdelivr.net/npm/marked/marked.min.js';
                     markedScript.onload = () => {
                         this.textElement.innerHTML = window.marked.parse(messageText);
-                        if (window.Prism) Prism.highlightAll();
+                        this.highlightCode();
                     };
                     document.head.appendChild(markedScript);
                 } else {
                     this.textElement.innerHTML = window.marked.parse(messageText);
-                    if (window.Prism) Prism.highlightAll();
+                    this.highlightCode();
                 }
                 
-                if (!window.Prism) {
+                if (!window.Prism && this.needsHighlight()) {
                     const prismScript = document.createElement('script');
                     prismScript.src = 'https://cdn.jsdelivr.net/npm/prismjs/prism.min.js';
                     document.head.appendChild(prismScript);
@@ -98,7 +98,10 @@ export class MessageComponent extends MXChatComponent {
                 const audioWrapper = this.createElement('div', 'mx-chat-audio');
                 const audio = this.createElement('audio');
                 audio.controls = true;
-                if (audioData && audioData.fileType && audioData.audioData) {
+                if (audioData?.audioUrl) {
+                    audio.src = audioData.audioUrl;
+                    audio.preload = 'metadata';
+                } else if (audioData && audioData.fileType && audioData.audioData) {
                     audio.src = `data:${audioData.fileType};base64,${audioData.audioData}`;
                 } else {
                     console.warn('audioData 格式不正确，无法渲染音频:', audioData);
@@ -116,6 +119,10 @@ export class MessageComponent extends MXChatComponent {
                         fileName = audioData.fileName || 'audio-file';
                     } else if (typeof audioData === 'string') {
                         base64Data = audioData;
+                    } else if (audioData?.audioUrl) {
+                        // 对于URL类型的音频，不支持直接拖拽
+                        console.warn('URL类型音频不支持拖拽功能');
+                        return;
                     }
                     
                     e.dataTransfer.setData('text/plain', JSON.stringify({
@@ -124,6 +131,9 @@ export class MessageComponent extends MXChatComponent {
                         data: base64Data
                     }));
                 });
+                if (Array.isArray(audioData?.waveform) && audioData.waveform.length > 0) {
+                    audioWrapper.appendChild(this.createWaveform(audioData.waveform, audio));
+                }
                 audioWrapper.appendChild(audio);
                 audioContainer.appendChild(audioWrapper);
             });
@@ -148,6 +158,12 @@ export class MessageComponent extends MXChatComponent {
                     return;
                 }
                 video.src = videoSrc;
+                if (vidData?.streaming) {
+                    // 边编码边播放的视频自动静音播放，不等待完整文件
+                    video.autoplay = true;
+                    video.muted = true;
+                    video.playsInline = true;
+                }
                 video.addEventListener('click', () => this.showVideoModal(videoSrc));
                 video.draggable = true;
                 video.addEventListener('dragstart', (e) => {
@@ -183,6 +199,33 @@ export class MessageComponent extends MXChatComponent {
         this.element.appendChild(this.content);
     }
 
+    createWaveform(peaks, audio) {
+        // 按服务端计算的峰值绘制波形预览，点击可跳转播放位置
+        const canvas = this.createElement('canvas', 'mx-chat-audio-waveform');
+        canvas.width = 300;
+        canvas.height = 40;
+        const draw = (progress = 0) => {
+            const ctx = canvas.getContext('2d');
+            const barWidth = canvas.width / peaks.length;
+            ctx.clearRect(0, 0, canvas.width, canvas.height);
+            peaks.forEach((peak, i) => {
+                const barHeight = Math.max(1, peak * canvas.height);
+                ctx.fillStyle = i / peaks.length < progress ? '#4a9eff' : 'rgba(255, 255, 255, 0.35)';
+                ctx.fillRect(i * barWidth, (canvas.height - barHeight) / 2, Math.max(1, barWidth - 1), barHeight);
+            });
+        };
+        draw();
+        audio.addEventListener('timeupdate', () => {
+            if (audio.duration) draw(audio.currentTime / audio.duration);
+        });
+        canvas.addEventListener('click', (e) => {
+            if (!audio.duration) return;
+            const rect = canvas.getBoundingClientRect();
+            audio.currentTime = ((e.clientX - rect.left) / rect.width) * audio.duration;
+        });
+        return canvas;
+    }
+
     toggleReasoning() {
         this.isReasoningVisible = !this.isReasoningVisible;
         this.reasoningText.style.display = this.isReasoningVisible ? 'block' : 'none';
@@ -190,6 +233,17 @@ export class MessageComponent extends MXChatComponent {
             this.isReasoningVisible ? '▼ 隐藏推理' : '▶ 展开推理';
     }
 
+    needsHighlight() {
+        // formatFeatures 由服务端格式检测给出，明确不含代码块时不加载、不执行代码高亮
+        const features = this.message.formatFeatures;
+        return !Array.isArray(features) || features.includes('code');
+    }
+
+    highlightCode() {
+        // 只高亮本条消息，不重新扫描整个页面
+        if (window.Prism && this.needsHighlight()) Prism.highlightAllUnder(this.textElement);
+    }
+
     updateText(newData) {
         if (typeof newData === 'object') {
             const reasoningContent = newData.reasoning_content || '';
@@ -199,6 +253,7 @@ export class MessageComponent extends MXChatComponent {
             // 更新 this.message
             this.message.text = content;
             if (newData.format) this.message.format = newData.format;
+            if (newData.formatFeatures) this.message.formatFeatures = newData.formatFeatures;
     
             if (reasoningContent) {
                 if (!this.reasoningContainer) {
@@ -222,7 +277,7 @@ export class MessageComponent extends MXChatComponent {
             if (this.textElement) {
                 if (format === 'markdown' && window.marked) {
                     this.textElement.innerHTML = window.marked.parse(content);
-                    if (window.Prism) Prism.highlightAll();
+                    this.highlightCode();
                 } else {
                     this.textElement.textContent = content;
                 }
@@ -477,6 +532,14 @@ styleElement.textContent = `
         height: 40px;
         margin-top: 8px;
     }
+    .mx-chat-audio-waveform {
+        display: block;
+        width: 100%;
+        max-width: 300px;
+        height: 40px;
+        margin-top: 8px;
+        cursor: pointer;
+    }
     .mx-chat-video video {
         width: 100%;
         max-width: 150px;
@@ -6,6 +6,9 @@ from server import PromptServer
 from aiohttp import web, WSMsgType
 
 from .logger import MXLogger
+from .settings import SettingsManager
+from .tracing import Tracer
+from .ws_transport import MXChatSocket
 
 logger = MXLogger.get_instance()
 
@@ -156,13 +159,34 @@ class WebSocketHandler:
             )
             logger.info(f"已发送错误响应给 sid: {sid}")
 
+    def handle_trace_spans(self, data, sid):
+        """记录浏览器上报的 span，start/duration 为毫秒"""
+        tracer = Tracer.get_instance()
+        for span in data.get('spans', []):
+            try:
+                attrs = span.get('attrs') or {}
+                tracer.record(span['traceId'], span['name'], span['start'] / 1000.0, span['duration'] / 1000.0,
+                              process="browser", thread=f"sidebar-{sid[:8]}", **attrs)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"[WebSocketHandler] 忽略无效的追踪数据: {str(e)}")
+
     def register_handlers(self):
         PromptServer.instance.routes._items = [r for r in PromptServer.instance.routes._items if r.path != '/ws']
 
         async def custom_websocket_handler(request):
-            ws = web.WebSocketResponse()
-            await ws.prepare(request)
+            ws_settings = SettingsManager.get_instance().section('websocket')
+            # 协商 permessage-deflate 后 aiohttp 压缩该连接上的所有帧
+            raw_ws = web.WebSocketResponse(compress=bool(ws_settings.get('compression', True)))
+            await raw_ws.prepare(request)
             sid = request.rel_url.query.get('clientId', '') or str(uuid.uuid4().hex)
+            # 只有声明支持 mx-batch 的客户端（聊天侧边栏）才合并小消息，ComfyUI 自身的连接保持逐条发送
+            coalesce = request.rel_url.query.get('mxBatch') == '1'
+            ws = MXChatSocket(
+                raw_ws,
+                coalesce_window_ms=ws_settings.get('coalesce_window_ms', 0) if coalesce else 0,
+                coalesce_max_bytes=ws_settings.get('coalesce_max_bytes', 8192),
+                max_queue=ws_settings.get('send_queue_max', 256),
+            )
             PromptServer.instance.sockets[sid] = ws
             logger.info(f"WebSocket 连接建立，sid: {sid}")
 
@@ -191,7 +215,7 @@ class WebSocketHandler:
                     sid=sid
                 )
 
-                async for msg in ws:
+                async for msg in raw_ws:
                     if msg.type == WSMsgType.TEXT:
                         try:
                             data = json.loads(msg.data)
@@ -224,6 +248,8 @@ class WebSocketHandler:
                                     data={"mode": mode},
                                     sid=sid
                                 )
+                            elif message_type == "trace_spans":
+                                self.handle_trace_spans(data, sid)
                             elif message_type == "log":
                                 logger.info(f"[WebSocketHandler] 前端日志: {data.get('message', 'No message')}")
                             else:
@@ -232,10 +258,14 @@ class WebSocketHandler:
                             logger.error(f"[WebSocketHandler] 处理消息失败: {str(e)}")
                             logger.error(traceback.format_exc())
                     elif msg.type == WSMsgType.ERROR:
-                        logger.warning(f"WebSocket 连接关闭，异常: {ws.exception()}")
+                        logger.warning(f"WebSocket 连接关闭，异常: {raw_ws.exception()}")
             finally:
-                PromptServer.instance.sockets.pop(sid, None)
-            return ws
+                if PromptServer.instance.sockets.get(sid) is ws:
+                    PromptServer.instance.sockets.pop(sid, None)
+                ws.stop()
+                if ws.dropped:
+                    logger.info(f"WebSocket 连接关闭，sid: {sid}，共丢弃 {ws.dropped} 条预览消息")
+            return raw_ws
 
         PromptServer.instance.routes.get('/ws')(custom_websocket_handler)
         logger.info("[WebSocketHandler] WebSocket 消息处理器注册完成")
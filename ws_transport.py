@@ -0,0 +1,164 @@
+import asyncio
+import collections
+import json
+
+from .logger import MXLogger
+from .metrics import counter
+
+logger = MXLogger.get_instance()
+
+BATCH_EVENT = "mx-batch"
+# 可丢弃的预览类事件：发送队列满时丢弃最旧的一条，而不是阻塞其他消息
+PREVIEW_EVENTS = frozenset({"progress", "mx-chat-preview"})
+
+WS_DROPPED = counter("mxchat_ws_dropped_total", "慢客户端发送队列满时丢弃的预览消息数")
+WS_OVERFLOW_CLOSED = counter("mxchat_ws_overflow_closed_total", "发送队列积压过多被关闭的慢连接数")
+
+
+class MXChatSocket:
+    """
+    包装 aiohttp 的 WebSocketResponse，放入 PromptServer.instance.sockets 中替代原始连接：
+    压缩由握手时协商的 permessage-deflate 负责（WebSocketResponse(compress=...)），
+    同一连接上的小消息在合并窗口内打包成一个 mx-batch 帧，合并后的帧压缩效果也更好。
+    每个连接有独立的发送队列和写任务，慢客户端只会让自己的队列变长，不会阻塞
+    PromptServer 的消息循环。入队从不等待：队列满时先丢弃最旧的预览，新消息是预览时直接丢弃；
+    队列中全是必须送达的消息时关闭这个慢连接，客户端重连后重新同步状态。
+    """
+
+    def __init__(self, ws, coalesce_window_ms=0, coalesce_max_bytes=8192, max_queue=256):
+        self._ws = ws
+        self._coalesce_window = max(coalesce_window_ms, 0) / 1000.0
+        self._coalesce_max_bytes = coalesce_max_bytes
+        self._pending = []
+        self._pending_bytes = 0
+        self._flush_handle = None
+        self._max_queue = max(1, max_queue)
+        self._outbox = collections.deque()
+        self._outbox_ready = asyncio.Event()
+        self.dropped = 0
+        self._stopped = False
+        self._writer_task = asyncio.ensure_future(self._write_loop())
+
+    def __getattr__(self, name):
+        # 其余属性和方法（closed、exception 等）直接交给原始连接
+        return getattr(self._ws, name)
+
+    async def send_json(self, data, compress=None, *, dumps=json.dumps):
+        preview = isinstance(data, dict) and data.get("type") in PREVIEW_EVENTS
+        self._enqueue(("str", dumps(data), compress), preview)
+
+    async def send_str(self, data, compress=None):
+        self._enqueue(("str", data, compress), False)
+
+    async def send_bytes(self, data, compress=None):
+        # ComfyUI 的二进制帧是采样预览图，可以丢弃
+        self._enqueue(("bytes", data, compress), True)
+
+    async def close(self, *args, **kwargs):
+        self.stop()
+        # 等写任务真正退出后再发送缓冲的小消息，避免两处同时写连接
+        try:
+            await self._writer_task
+        except asyncio.CancelledError:
+            pass
+        await self.flush()
+        return await self._ws.close(*args, **kwargs)
+
+    def stop(self):
+        """连接结束时停止写任务，未发送的消息直接丢弃"""
+        self._stopped = True
+        self._writer_task.cancel()
+        self._outbox.clear()
+
+    def _enqueue(self, item, preview):
+        # 在 PromptServer 的消息循环中调用，不能等待
+        if self._stopped:
+            return
+        while len(self._outbox) >= self._max_queue and self._drop_oldest_preview():
+            pass
+        if len(self._outbox) >= self._max_queue:
+            if preview:
+                # 队列中全是必须送达的消息时，新的预览直接丢弃
+                self.dropped += 1
+                WS_DROPPED.inc()
+                return
+            self._close_slow_client()
+            return
+        self._outbox.append(item + (preview,))
+        self._outbox_ready.set()
+
+    def _close_slow_client(self):
+        logger.warning(f"[MXChatSocket] 发送队列积压 {len(self._outbox)} 条必须送达的消息，关闭慢连接")
+        WS_OVERFLOW_CLOSED.inc()
+        self.stop()
+        # 关闭后 /ws 处理函数的接收循环结束，连接从 PromptServer.instance.sockets 中移除
+        asyncio.ensure_future(self._ws.close())
+
+    def _drop_oldest_preview(self):
+        for index, queued in enumerate(self._outbox):
+            if queued[3]:
+                del self._outbox[index]
+                self.dropped += 1
+                WS_DROPPED.inc()
+                return True
+        return False
+
+    async def _write_loop(self):
+        while True:
+            await self._outbox_ready.wait()
+            while self._outbox:
+                kind, data, compress, _ = self._outbox.popleft()
+                try:
+                    if kind == "flush":
+                        await self.flush()
+                    elif kind == "bytes":
+                        # 二进制帧不参与合并，但要保证排在已缓冲的文本消息之后
+                        await self.flush()
+                        await self._ws.send_bytes(data, compress=compress)
+                    else:
+                        await self._deliver_str(data, compress)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.debug(f"[MXChatSocket] 发送消息失败: {str(e)}")
+            self._outbox_ready.clear()
+
+    async def _deliver_str(self, data, compress=None):
+        size = len(data)
+        if self._coalesce_window > 0 and size < self._coalesce_max_bytes:
+            if self._pending_bytes + size > self._coalesce_max_bytes:
+                await self.flush()
+            self._pending.append(data)
+            self._pending_bytes += size
+            if self._flush_handle is None:
+                loop = asyncio.get_running_loop()
+                self._flush_handle = loop.call_later(self._coalesce_window, self._schedule_flush)
+            return
+        await self.flush()
+        await self._send_frame(data, compress)
+
+    async def flush(self):
+        """立即发送已缓冲的小消息"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        pending, self._pending, self._pending_bytes = self._pending, [], 0
+        if len(pending) == 1:
+            await self._send_frame(pending[0])
+        else:
+            # 各条消息已经是 JSON 字符串，直接拼接，避免二次序列化
+            await self._send_frame('{"type": "%s", "data": [%s]}' % (BATCH_EVENT, ",".join(pending)))
+
+    def _schedule_flush(self):
+        # 合并窗口到期时只在发送队列中放入标记，由写任务发送，连接上始终只有写任务在写
+        self._flush_handle = None
+        if not self._stopped:
+            self._outbox.append(("flush", None, None, False))
+            self._outbox_ready.set()
+
+    async def _send_frame(self, data, compress=None):
+        # compress 为 None 时使用连接协商的压缩，调用方可按帧指定压缩窗口
+        await self._ws.send_str(data, compress=compress)
+